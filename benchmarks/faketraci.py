@@ -0,0 +1,383 @@
+"""
+Stand-in for the traci module, so the controller can be benchmarked without a sumo binary.
+
+The corridor is read straight from sumo_config: the lights' programs, controlled links and
+lane shapes from the net file, the routes from the route file and the detectors from the
+additional file. Vehicles then move along their routes in a fixed number of steps per edge
+and wait at the end of an edge while its light is red. There is no car following and no
+randomness, so the same calls always get the same answers. That makes it good for
+measuring what the controller costs per step, not for judging a controller.
+
+Only the parts of the traci interface SimulationController uses are here. The traci python
+package (pip install traci) is still needed for its constants, just not sumo itself.
+"""
+
+import os
+import math
+import time
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
+
+import traci.constants as tc
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sumo_config')
+
+# speed vehicles report while moving, in m/s
+MOVING_SPEED = 10.0
+
+
+class Phase(object):
+    def __init__(self, duration, state):
+        super(Phase, self).__init__()
+        self.duration = duration
+        self.state = state
+
+
+class Logic(object):
+    def __init__(self, programID, phases):
+        super(Logic, self).__init__()
+        self.programID = programID
+        self.phases = phases
+
+
+class Corridor(object):
+    """everything the fake needs from the sumo config files, read once"""
+
+    def __init__(self, config_dir=CONFIG_DIR):
+        super(Corridor, self).__init__()
+        net = ElementTree.parse(os.path.join(config_dir, 'corridor.net.xml')).getroot()
+
+        self.lane_shapes = {}
+        for edge in net.iter('edge'):
+            if edge.get('function') == 'internal':
+                continue
+            for lane in edge.iter('lane'):
+                self.lane_shapes[lane.get('id')] = [tuple(float(v) for v in point.split(',')) for point in lane.get('shape').split()]
+
+        self.logics = OrderedDict()
+        for logic in net.iter('tlLogic'):
+            phases = [Phase(float(phase.get('duration')), phase.get('state')) for phase in logic.iter('phase')]
+            self.logics[logic.get('id')] = Logic(logic.get('programID'), phases)
+
+        # light id -> controlled links by link index, as traci.trafficlight.getControlledLinks has them
+        self.controlled_links = {}
+        for light in self.logics:
+            self.controlled_links[light] = [[] for i in range(len(self.logics[light].phases[0].state))]
+        # (from edge, to edge) -> [(light, link index, from lane)], one per lane the move can be made from
+        self.moves = {}
+        for connection in net.iter('connection'):
+            if connection.get('tl') is None:
+                continue
+            from_lane = '{}_{}'.format(connection.get('from'), connection.get('fromLane'))
+            to_lane = '{}_{}'.format(connection.get('to'), connection.get('toLane'))
+            light = connection.get('tl')
+            index = int(connection.get('linkIndex'))
+            self.controlled_links[light][index].append((from_lane, to_lane, connection.get('via')))
+            self.moves.setdefault((connection.get('from'), connection.get('to')), []).append((light, index, from_lane))
+
+        routes = ElementTree.parse(os.path.join(config_dir, 'corridor.rou.xml')).getroot()
+        self.routes = {}
+        for route in routes.iter('route'):
+            self.routes[route.get('id')] = route.get('edges').split()
+
+        additional = ElementTree.parse(os.path.join(config_dir, 'corridor.add.xml')).getroot()
+        self.detectors = []
+        self.lane_detectors = {}
+        for detector in additional.iter('e1Detector'):
+            self.detectors.append(detector.get('id'))
+            self.lane_detectors[detector.get('lane')] = detector.get('id')
+
+
+class _Domain(object):
+    def __init__(self, sim):
+        super(_Domain, self).__init__()
+        self.sim = sim
+        self.subscriptions = OrderedDict()
+
+    def subscribe(self, object_id, varIDs):
+        self.sim.calls += 1
+        self.subscriptions[object_id] = list(varIDs)
+
+    def getAllSubscriptionResults(self):
+        self.sim.calls += 1
+        start = time.perf_counter()
+        results = {}
+        for object_id in self.subscriptions:
+            if self.exists(object_id):
+                results[object_id] = dict((var, self.value(object_id, var)) for var in self.subscriptions[object_id])
+        # real sumo gathers these while it steps, so they count as simulator time
+        self.sim.busy_time += time.perf_counter() - start
+        return results
+
+    def exists(self, object_id):
+        return True
+
+
+class _Vehicle(_Domain):
+    def add(self, vehID, routeID):
+        self.sim.calls += 1
+        self.sim.pending.append((vehID, routeID))
+
+    def getIDList(self):
+        self.sim.calls += 1
+        return tuple(self.sim.vehicles)
+
+    def setSpeedFactor(self, vehID, factor):
+        # every vehicle moves at the same speed here, so the factor only costs the call
+        self.sim.calls += 1
+
+    def isStopped(self, vehID):
+        # sumo only counts scheduled stops here, and there are none
+        self.sim.calls += 1
+        return False
+
+    def getNextTLS(self, vehID):
+        self.sim.calls += 1
+        vehicle = self.sim.vehicles[vehID]
+        edges = vehicle['edges']
+        for i in range(vehicle['edge'], len(edges) - 1):
+            move = self.sim.move(vehicle, i)
+            if move != None:
+                light, index, lane = move
+                distance = (self.sim.travel_steps - vehicle['progress'] if i == vehicle['edge'] else 0) * MOVING_SPEED
+                return [(light, index, distance, self.sim.state(light)[index])]
+        return []
+
+    def exists(self, object_id):
+        return object_id in self.sim.vehicles
+
+    def value(self, vehID, var):
+        if var == tc.VAR_STOPSTATE:
+            return 0
+        raise NotImplementedError(var)
+
+
+class _TrafficLight(_Domain):
+    def getIDList(self):
+        self.sim.calls += 1
+        return tuple(self.sim.corridor.logics)
+
+    def getControlledLinks(self, tlsID):
+        self.sim.calls += 1
+        return self.sim.corridor.controlled_links[tlsID]
+
+    def getProgram(self, tlsID):
+        self.sim.calls += 1
+        return self.sim.corridor.logics[tlsID].programID
+
+    def getCompleteRedYellowGreenDefinition(self, tlsID):
+        self.sim.calls += 1
+        return [self.sim.corridor.logics[tlsID]]
+
+    def getPhase(self, tlsID):
+        self.sim.calls += 1
+        return self.sim.lights[tlsID]['phase']
+
+    def getNextSwitch(self, tlsID):
+        self.sim.calls += 1
+        return self.sim.lights[tlsID]['next_switch']
+
+    def setPhase(self, tlsID, index):
+        self.sim.calls += 1
+        light = self.sim.lights[tlsID]
+        light['phase'] = index
+        light['next_switch'] = self.sim.time + self.sim.corridor.logics[tlsID].phases[index].duration
+
+    def setPhaseDuration(self, tlsID, phaseDuration):
+        self.sim.calls += 1
+        self.sim.lights[tlsID]['next_switch'] = self.sim.time + phaseDuration
+
+    def value(self, tlsID, var):
+        if var == tc.TL_NEXT_SWITCH:
+            return self.sim.lights[tlsID]['next_switch']
+        if var == tc.TL_CURRENT_PHASE:
+            return self.sim.lights[tlsID]['phase']
+        raise NotImplementedError(var)
+
+
+class _InductionLoop(_Domain):
+    def getIDList(self):
+        self.sim.calls += 1
+        return tuple(self.sim.corridor.detectors)
+
+    def getLastStepVehicleIDs(self, loopID):
+        self.sim.calls += 1
+        return tuple(self.sim.detector_vehicles[loopID])
+
+    def getLastStepMeanSpeed(self, loopID):
+        self.sim.calls += 1
+        return self.sim.detector_speed(loopID)
+
+    def value(self, loopID, var):
+        if var == tc.LAST_STEP_VEHICLE_ID_LIST:
+            return tuple(self.sim.detector_vehicles[loopID])
+        if var == tc.LAST_STEP_MEAN_SPEED:
+            return self.sim.detector_speed(loopID)
+        raise NotImplementedError(var)
+
+
+class _Lane(_Domain):
+    def getShape(self, laneID):
+        self.sim.calls += 1
+        return self.sim.corridor.lane_shapes[laneID]
+
+
+class _Simulation(_Domain):
+    def subscribe(self, varIDs):
+        super(_Simulation, self).subscribe('', varIDs)
+
+    def getSubscriptionResults(self):
+        self.sim.calls += 1
+        return dict((var, self.value('', var)) for var in self.subscriptions.get('', []))
+
+    def getEmergencyStoppingVehiclesIDList(self):
+        self.sim.calls += 1
+        return ()
+
+    def getArrivedIDList(self):
+        self.sim.calls += 1
+        return tuple(self.sim.arrived)
+
+    def getDepartedIDList(self):
+        self.sim.calls += 1
+        return tuple(self.sim.departed)
+
+    def saveState(self, fileName):
+        raise NotImplementedError('the fake simulation has no saved states, use warm starts without warm-up steps')
+
+    def value(self, object_id, var):
+        if var == tc.VAR_DEPARTED_VEHICLES_IDS:
+            return tuple(self.sim.departed)
+        if var == tc.VAR_ARRIVED_VEHICLES_IDS:
+            return tuple(self.sim.arrived)
+        if var == tc.VAR_EMERGENCYSTOPPING_VEHICLES_IDS:
+            return ()
+        raise NotImplementedError(var)
+
+
+class FakeTraci(object):
+    """
+    drop-in for the traci module, pass it to SimulatorBackend(module=...).
+
+    travel_steps is the number of steps a vehicle takes to drive an edge, so raising it keeps
+    more vehicles on the road at once. calls counts every call made into the fake, and
+    busy_time the seconds spent stepping and gathering subscription results, i.e. the
+    simulator's share of a run
+    """
+
+    def __init__(self, travel_steps=10, config_dir=CONFIG_DIR):
+        super(FakeTraci, self).__init__()
+        self.travel_steps = travel_steps
+        self.corridor = Corridor(config_dir)
+        self.calls = 0
+        self.busy_time = 0.0
+        self.reset()
+
+    def reset(self):
+        self.vehicle = _Vehicle(self)
+        self.trafficlight = _TrafficLight(self)
+        self.inductionloop = _InductionLoop(self)
+        self.lane = _Lane(self)
+        self.simulation = _Simulation(self)
+
+        self.time = 0
+        self.pending = []
+        self.vehicles = OrderedDict()
+        self.departed = []
+        self.arrived = []
+        self.inserted = 0
+        self.vehicle_steps = 0
+        self.steps = 0
+        self.lights = OrderedDict()
+        for light in self.corridor.logics:
+            self.lights[light] = {'phase': 0, 'next_switch': self.corridor.logics[light].phases[0].duration}
+        self.detector_vehicles = dict((detector, []) for detector in self.corridor.detectors)
+        self.detector_speeds = dict((detector, []) for detector in self.corridor.detectors)
+
+    def start(self, cmd, label=None):
+        self.reset()
+
+    def load(self, args):
+        if '--load-state' in args:
+            raise NotImplementedError('the fake simulation has no saved states, use warm starts without warm-up steps')
+        self.calls += 1
+        self.reset()
+
+    def close(self):
+        pass
+
+    def state(self, light):
+        return self.corridor.logics[light].phases[self.lights[light]['phase']].state
+
+    def move(self, vehicle, edge):
+        """(light, link index, lane) for leaving the vehicle's route edge number edge, None if uncontrolled"""
+        moves = self.corridor.moves.get((vehicle['edges'][edge], vehicle['edges'][edge + 1]))
+        if moves == None:
+            return None
+        # spread vehicles over the lanes the move can be made from
+        return moves[vehicle['number'] % len(moves)]
+
+    def detector_speed(self, detector):
+        speeds = self.detector_speeds[detector]
+        if len(speeds) == 0:
+            return -1.0
+        return sum(speeds) / len(speeds)
+
+    def simulationStep(self, step=0.0):
+        self.calls += 1
+        start = time.perf_counter()
+        self.time += 1
+        self.steps += 1
+
+        # same timing as sumo: a switch due at t happens on the step to floor(t) + 1, and the
+        # new phase's duration counts from the step before that
+        for light in self.lights:
+            phases = self.corridor.logics[light].phases
+            state = self.lights[light]
+            while self.time >= math.floor(state['next_switch']) + 1:
+                state['phase'] = (state['phase'] + 1) % len(phases)
+                state['next_switch'] = self.time - 1 + phases[state['phase']].duration
+
+        self.departed = []
+        for vehicle_id, route in self.pending:
+            self.vehicles[vehicle_id] = {'edges': self.corridor.routes[route], 'edge': 0, 'progress': 0,
+                                         'number': self.inserted}
+            self.inserted += 1
+            self.departed.append(vehicle_id)
+        self.pending = []
+
+        for detector in self.detector_vehicles:
+            self.detector_vehicles[detector] = []
+            self.detector_speeds[detector] = []
+
+        self.arrived = []
+        for vehicle_id in list(self.vehicles):
+            vehicle = self.vehicles[vehicle_id]
+            vehicle['progress'] = min(vehicle['progress'] + 1, self.travel_steps)
+            if vehicle['progress'] < self.travel_steps:
+                continue
+            if vehicle['edge'] == len(vehicle['edges']) - 1:
+                del self.vehicles[vehicle_id]
+                self.arrived.append(vehicle_id)
+                continue
+
+            # at the end of the edge, over the detector if there is one
+            move = self.move(vehicle, vehicle['edge'])
+            moving = True
+            if move != None:
+                light, index, lane = move
+                moving = self.state(light)[index] in 'Gg'
+                detector = self.corridor.lane_detectors.get(lane)
+                if detector != None:
+                    self.detector_vehicles[detector].append(vehicle_id)
+                    self.detector_speeds[detector].append(MOVING_SPEED if moving else 0.0)
+            if moving:
+                vehicle['edge'] += 1
+                vehicle['progress'] = 0
+
+        self.vehicle_steps += len(self.vehicles)
+        self.busy_time += time.perf_counter() - start
+
+    def mean_vehicles(self):
+        """vehicles on the road per step, averaged over the steps so far"""
+        return self.vehicle_steps / self.steps if self.steps else 0.0
@@ -0,0 +1,97 @@
+#!/usr/local/bin/python3
+
+# micro-benchmark of network activation: neat's pure python FeedForwardNetwork against
+# the numpy compiled networks in vectorisednetwork.py, on randomly grown genomes
+
+import os
+import sys
+import time
+import random
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import neat
+import vectorisednetwork
+
+
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--genomes", type="int", default=30,
+                         help="number of genomes to build networks from")
+    opt_parser.add_option("--mutations", type="int", default=20,
+                         help="mutations applied to each genome, to grow hidden nodes and connections")
+    opt_parser.add_option("--batch", type="int", default=256,
+                         help="number of input vectors per network")
+    opt_parser.add_option("--seed", type="int", default=1234)
+    options, args = opt_parser.parse_args()
+    return options
+
+
+def make_genomes(config, count, mutations, seed):
+    random.seed(seed)
+    genomes = []
+    for key in range(count):
+        genome = config.genome_type(key)
+        genome.configure_new(config.genome_config)
+        for i in range(mutations):
+            genome.mutate(config.genome_config)
+        genomes.append(genome)
+    return genomes
+
+
+def timed(function, repeat=3):
+    # best of a few runs, to keep noise from other processes out of it
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def run_benchmarks(config, genomes, batch, seed):
+    """returns a dict of timings (seconds) and the largest output difference seen"""
+    inputs = np.random.RandomState(seed).uniform(0.0, 50.0, (batch, len(config.genome_config.input_keys)))
+    rows = inputs.tolist()
+    results = {'genomes': len(genomes), 'batch': batch}
+
+    results['create_neat'], neat_nets = timed(lambda: [neat.nn.FeedForwardNetwork.create(g, config) for g in genomes])
+    results['create_numpy'], numpy_nets = timed(lambda: [vectorisednetwork.VectorisedNetwork.create(g, config) for g in genomes])
+
+    # one input vector at a time, the way get_duration uses them
+    results['activate_neat'], expected = timed(lambda: [[net.activate(row) for row in rows] for net in neat_nets])
+    results['activate_numpy'], single = timed(lambda: [[net.activate(row) for row in rows] for net in numpy_nets])
+
+    # the whole batch per network, then every network and the whole batch in one pass
+    results['batch_numpy'], batched = timed(lambda: [net.activate_batch(inputs) for net in numpy_nets])
+    stacked = vectorisednetwork.StackedNetworks(numpy_nets)
+    results['stacked_numpy'], stacked_out = timed(lambda: stacked.activate_batch(inputs))
+
+    expected = np.array(expected)
+    results['max_difference'] = max(np.abs(np.array(single) - expected).max(),
+                                    np.abs(np.array(batched) - expected).max(),
+                                    np.abs(stacked_out.transpose(1, 0, 2) - expected).max())
+    return results
+
+
+if __name__ == "__main__":
+    options = get_options()
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neat_configuration'))
+
+    genomes = make_genomes(config, options.genomes, options.mutations, options.seed)
+    results = run_benchmarks(config, genomes, options.batch, options.seed)
+
+    activations = results['genomes'] * results['batch']
+    print('{} genomes x {} inputs ({} activations)'.format(results['genomes'], results['batch'], activations))
+    print('create   neat   {:9.4f}s   numpy {:9.4f}s'.format(results['create_neat'], results['create_numpy']))
+    for name in ['activate_neat', 'activate_numpy', 'batch_numpy', 'stacked_numpy']:
+        print('{:15s} {:9.4f}s  {:8.2f}us/activation  {:7.1f}x'.format(
+            name, results[name], 1e6 * results[name] / activations, results['activate_neat'] / results[name]))
+    print('largest difference from neat: {:.3g}'.format(results['max_difference']))
@@ -0,0 +1,231 @@
+#!/usr/local/bin/python3
+
+# benchmark suite for the controller and the evolution loop. by default sumo is replaced
+# with the scripted stand-in in faketraci.py, which measures what our own code costs per
+# step without needing a sumo binary. --sumo runs the same benchmarks against real sumo.
+# results are written as json, for comparing one commit's numbers against another's
+
+import os
+import sys
+import time
+import json
+import random
+import platform
+import optparse
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+import numpy as np
+import neat
+import custompopulation
+import evaluation
+import simulationcontroller
+import simulatorbackend
+import speciation
+import logging
+import faketraci
+import discovery
+import inference
+
+
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--sumo", action="store_true", default=False,
+                         help="run against real sumo instead of the scripted stand-in")
+    opt_parser.add_option("--backend", default="auto",
+                         help="with --sumo, the library to drive sumo through: auto, libsumo or traci")
+    opt_parser.add_option("--output", default="benchmark_results.json",
+                         help="file to write the results to")
+    opt_parser.add_option("--repeat", type="int", default=3,
+                         help="runs per measurement, the fastest is kept")
+    opt_parser.add_option("--pop-size", type="int", default=None,
+                         help="population size for the generation benchmark, defaults to the config's")
+    opt_parser.add_option("--travel-steps", default="5,10,20,40",
+                         help="steps per edge to scale the stand-in's vehicle count with, comma separated")
+    opt_parser.add_option("--only", default=None,
+                         help="comma separated benchmarks to run: step_loop, activation, generation, vehicle_scaling, speciation")
+    opt_parser.add_option("--seed", type="int", default=1234)
+    options, args = opt_parser.parse_args()
+    return options
+
+
+class Bench(object):
+    """where simulations come from: the stand-in, or sumo itself"""
+
+    def __init__(self, sumo, backend, repeat):
+        super(Bench, self).__init__()
+        self.sumo = sumo
+        self.backend = backend
+        self.repeat = repeat
+        self.fake = None
+        # sumo reads corridor.sumocfg from the working directory
+        if sumo:
+            os.chdir(os.path.join(BENCHMARK_DIR, '..', 'sumo_config'))
+        self.log = logging.Logging(logging.Level.ERROR.value)
+
+    def sim_options(self, travel_steps=10, **sim_options):
+        if self.sumo:
+            sim_options['backend'] = self.backend
+        else:
+            self.fake = faketraci.FakeTraci(travel_steps)
+            sim_options['backend'] = simulatorbackend.SimulatorBackend(module=self.fake)
+            sim_options['intersections'] = discovery.from_files(faketraci.CONFIG_DIR)
+        return sim_options
+
+
+def make_nets(config, seed):
+    random.seed(seed)
+    nets = {}
+    for key, intersection in enumerate(discovery.from_files(faketraci.CONFIG_DIR)):
+        genome = config.genome_type(key)
+        genome.configure_new(config.genome_config)
+        nets[intersection] = neat.nn.FeedForwardNetwork.create(genome, config)
+    return nets
+
+
+def time_run(bench, nets, **sim_options):
+    """best of bench.repeat runs of one full simulation, with what went on in the fastest"""
+    best = None
+    for i in range(bench.repeat):
+        options = bench.sim_options(**sim_options)
+        sim = simulationcontroller.SimulationController(bench.log, **options)
+        start = time.perf_counter()
+        sim.start()
+        sim.run(nets)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best['seconds']:
+            steps = sim.step
+            best = {'seconds': elapsed, 'steps': steps, 'steps_per_second': steps / elapsed,
+                    'us_per_step': 1e6 * elapsed / steps,
+                    'collector_calls_per_step': sim.collector.calls / steps}
+            if bench.fake != None:
+                # take the stand-in's own stepping out, to leave what the controller costs
+                best['traci_calls_per_step'] = bench.fake.calls / steps
+                best['controller_us_per_step'] = 1e6 * (elapsed - bench.fake.busy_time) / steps
+                best['mean_vehicles'] = bench.fake.mean_vehicles()
+    return best
+
+
+def bench_step_loop(bench, config, seed):
+    nets = make_nets(config, seed)
+    results = {}
+    for collection in ['poll', 'subscription']:
+        results[collection] = time_run(bench, nets, collection=collection)
+    return results
+
+
+def bench_activation(bench, config, seed):
+    genomes = inference.make_genomes(config, 30, 20, seed)
+    results = inference.run_benchmarks(config, genomes, 256, seed)
+    results['max_difference'] = float(results['max_difference'])
+    return results
+
+
+def bench_generation(bench, config, seed, pop_size):
+    """wall time of one generation of CustomPopulation.run, evaluating every triplet in turn"""
+    if pop_size != None:
+        config.pop_size = pop_size
+    random.seed(seed)
+    pop = custompopulation.CustomPopulation(config, discovery.from_files(faketraci.CONFIG_DIR))
+    evaluated = []
+
+    def score(populations, config, gen):
+        for genomes in evaluation.make_triplets(populations):
+            for intersection in genomes:
+                genomes[intersection].fitness = 0.0
+            scores = evaluation.evaluate_triplet(genomes, config, bench.log, **bench.sim_options())
+            evaluation.assign_scores(genomes, scores)
+            evaluated.append(genomes)
+
+    start = time.perf_counter()
+    pop.run(score, 1)
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'pop_size': config.pop_size, 'evaluations': len(evaluated),
+            'seconds_per_evaluation': elapsed / len(evaluated)}
+
+
+def bench_vehicle_scaling(bench, config, seed, travel_steps):
+    """per-step cost as the number of vehicles on the road goes up, stand-in only"""
+    if bench.sumo:
+        return {'skipped': 'vehicle scaling needs the stand-in, where travel time can be turned up'}
+    nets = make_nets(config, seed)
+    results = []
+    for steps in travel_steps:
+        result = time_run(bench, nets, travel_steps=steps)
+        result['travel_steps'] = steps
+        results.append(result)
+    return results
+
+
+def bench_speciation(config, seed, pop_size, generations=5):
+    """
+    neat's speciation against speciation.VectorisedSpeciesSet, on the same evolving population.
+    the vectorised one follows the stock one's species from one generation to the next, and
+    has to agree with it on every genome
+    """
+    pop_size = pop_size if pop_size != None else 150
+    vectorised_config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                                    speciation.VectorisedSpeciesSet, neat.DefaultStagnation,
+                                    os.path.join(BENCHMARK_DIR, '..', 'neat_configuration'))
+    random.seed(seed)
+    reporters = neat.reporting.ReporterSet()
+    reproduction = neat.DefaultReproduction(config.reproduction_config, reporters,
+                                            neat.DefaultStagnation(config.stagnation_config, reporters))
+    population = reproduction.create_new(config.genome_type, config.genome_config, pop_size)
+    stock = neat.DefaultSpeciesSet(config.species_set_config, reporters)
+    vectorised = speciation.VectorisedSpeciesSet(vectorised_config.species_set_config, reporters)
+    times = {'stock': 0.0, 'vectorised': 0.0}
+    matches = True
+    for generation in range(generations):
+        for name, species_set, species_config in [('stock', stock, config), ('vectorised', vectorised, vectorised_config)]:
+            start = time.perf_counter()
+            species_set.speciate(species_config, population, generation)
+            times[name] += time.perf_counter() - start
+        matches = matches and stock.genome_to_species == vectorised.genome_to_species
+        for genome in population.values():
+            genome.fitness = random.random()
+        population = reproduction.reproduce(config, stock, pop_size, generation)
+        vectorised.species = dict(stock.species)
+    return {'pop_size': pop_size, 'generations': generations, 'species': len(stock.species),
+            'stock_seconds': times['stock'], 'vectorised_seconds': times['vectorised'],
+            'speedup': times['stock'] / times['vectorised'], 'assignments_match': matches}
+
+
+if __name__ == "__main__":
+    options = get_options()
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         os.path.join(BENCHMARK_DIR, '..', 'neat_configuration'))
+    output = os.path.abspath(options.output)
+    bench = Bench(options.sumo, options.backend, options.repeat)
+
+    benchmarks = ['step_loop', 'activation', 'generation', 'vehicle_scaling', 'speciation']
+    if options.only != None:
+        benchmarks = options.only.split(',')
+
+    results = {}
+    for name in benchmarks:
+        start = time.perf_counter()
+        if name == 'step_loop':
+            results[name] = bench_step_loop(bench, config, options.seed)
+        elif name == 'activation':
+            results[name] = bench_activation(bench, config, options.seed)
+        elif name == 'generation':
+            results[name] = bench_generation(bench, config, options.seed, options.pop_size)
+        elif name == 'vehicle_scaling':
+            travel_steps = [int(steps) for steps in options.travel_steps.split(',')]
+            results[name] = bench_vehicle_scaling(bench, config, options.seed, travel_steps)
+        elif name == 'speciation':
+            results[name] = bench_speciation(config, options.seed, options.pop_size)
+        else:
+            sys.exit('unknown benchmark {}'.format(name))
+        print('{:16s} done in {:.2f}s'.format(name, time.perf_counter() - start))
+
+    report = {'mode': 'sumo' if options.sumo else 'fake', 'backend': options.backend if options.sumo else 'faketraci',
+              'seed': options.seed, 'repeat': options.repeat, 'python': platform.python_version(),
+              'numpy': np.__version__, 'neat': getattr(neat, '__version__', None), 'machine': platform.machine(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('results written to {}'.format(output))
@@ -0,0 +1,191 @@
+"""
+Checkpoints of a CustomPopulation: every intersection's population, their species sets,
+best_genome and the random state, written at the start of a generation so a resumed run carries on with its
+evaluation as if nothing happened.
+
+Most genomes live on for several generations, in a population, as a species representative or
+as a best genome, so checkpoints keep genomes apart from the rest of the state. Each checkpoint
+file holds the state with every genome replaced by its key, every genome's current fitness,
+and only the genomes the files since the last full checkpoint don't have yet. Every
+full_every-th checkpoint stores all of them again, so resuming reads a full file and the
+deltas after it.
+
+The state is pickled on the evolution thread, since the next generation changes it, but the
+genomes, compression and writing are left to a background thread. Files are written under a temporary
+name and renamed into place, so a crash never leaves half a checkpoint to resume from.
+
+    pop.add_reporter(checkpointer.PopulationCheckpointer(pop, 'checkpoints'))
+    ...
+    pop = checkpointer.restore('checkpoints', config, intersections)
+"""
+
+import io
+import os
+import re
+import gzip
+import pickle
+import random
+import tempfile
+import threading
+from queue import Queue
+
+from neat.reporting import BaseReporter, ReporterSet
+
+import custompopulation
+
+FILE_PATTERN = re.compile(r'^generation-(\d+)\.(full|delta)\.gz$')
+_STOP = None
+
+
+def checkpoint_name(generation, full):
+    return 'generation-{:05d}.{}.gz'.format(generation, 'full' if full else 'delta')
+
+
+class _StatePickler(pickle.Pickler):
+    """pickles the population state with genomes, and reporters, left out as references"""
+
+    def __init__(self, file, genome_type):
+        super(_StatePickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.genome_type = genome_type
+        # key -> genome, of every genome the state refers to
+        self.genomes = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, self.genome_type):
+            self.genomes[obj.key] = obj
+            return ('genome', obj.key)
+        # reporters hold threads and files, and belong to whoever resumes
+        if isinstance(obj, ReporterSet):
+            return ('reporters',)
+        return None
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, genomes, reporters):
+        super(_StateUnpickler, self).__init__(file)
+        self.genomes = genomes
+        self.reporters = reporters
+
+    def persistent_load(self, pid):
+        if pid[0] == 'genome':
+            return self.genomes[pid[1]]
+        return self.reporters
+
+
+class PopulationCheckpointer(BaseReporter):
+    def __init__(self, population, directory='checkpoints', interval=1, full_every=10):
+        super(PopulationCheckpointer, self).__init__()
+        self.population = population
+        self.directory = directory
+        self.interval = interval
+        self.full_every = full_every
+        os.makedirs(directory, exist_ok=True)
+        # keys of the genomes written since the last full checkpoint
+        self.stored = set()
+        self.since_full = None
+        self.last_generation = None
+        self.queue = Queue()
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def start_generation(self, generation):
+        # a resumed run starts on the generation it was saved at, no need to save that again
+        if generation % self.interval == 0 and generation != self.last_generation:
+            self.save(generation)
+
+    def save(self, generation):
+        pop = self.population
+        full = self.since_full == None or self.since_full + 1 >= self.full_every
+        if full:
+            self.stored = set()
+            self.since_full = 0
+        else:
+            self.since_full += 1
+
+        state = io.BytesIO()
+        pickler = _StatePickler(state, pop.config.genome_type)
+        pickler.dump({'generation': generation, 'population': pop.population, 'species': pop.species,
+                      'best_genome': pop.best_genome, 'intersections': pop.intersections,
+                      'random_state': random.getstate()})
+        new = dict((key, genome) for key, genome in pickler.genomes.items() if key not in self.stored)
+        self.stored.update(new)
+        fitness = dict((key, genome.fitness) for key, genome in pickler.genomes.items())
+        # genomes don't change once made, apart from their fitness, which is kept separately
+        # above, so they can be pickled on the writer thread
+        self.queue.put((checkpoint_name(generation, full), {'state': state.getvalue(), 'fitness': fitness, 'genomes': new}))
+        self.last_generation = generation
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            name, record = item
+            record = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=5) as compressed:
+                    compressed.write(record)
+            os.replace(tmp, os.path.join(self.directory, name))
+
+    def close(self):
+        """saves where run left the population, then waits for the queued checkpoints to be written"""
+        self.start_generation(self.population.generation)
+        self.queue.put(_STOP)
+        self.writer.join()
+
+
+def checkpoints(directory):
+    """[(generation, full)] of the checkpoints in directory, oldest first"""
+    found = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = FILE_PATTERN.match(name)
+            if match:
+                found.append((int(match.group(1)), match.group(2) == 'full'))
+    return sorted(found)
+
+
+def _read(directory, generation, full):
+    with gzip.open(os.path.join(directory, checkpoint_name(generation, full)), 'rb') as f:
+        return pickle.load(f)
+
+
+def load(directory, reporters=None, generation=None):
+    """
+    (initial_state, random_state) from the checkpoint of generation, or the latest one.
+    initial_state is what CustomPopulation takes. the species sets report to reporters, which
+    should end up being the population's own
+    """
+    found = checkpoints(directory)
+    if generation != None:
+        found = [checkpoint for checkpoint in found if checkpoint[0] <= generation]
+    if not len(found) or (generation != None and found[-1][0] != generation):
+        raise ValueError('no checkpoint for generation {} in {}'.format(generation if generation != None else 'any', directory))
+    fulls = [i for i, (g, full) in enumerate(found) if full]
+    if not len(fulls):
+        raise ValueError('no full checkpoint to start from in {}'.format(directory))
+    chain = found[fulls[-1]:]
+
+    genomes = {}
+    for g, full in chain:
+        record = _read(directory, g, full)
+        genomes.update(record['genomes'])
+    for key, fitness in record['fitness'].items():
+        genomes[key].fitness = fitness
+    state = _StateUnpickler(io.BytesIO(record['state']), genomes, reporters).load()
+    # checkpoints from before the intersections were saved are taken to be in today's order
+    initial_state = (state['population'], state['species'], state['generation'], state['best_genome'],
+                     state.get('intersections'))
+    return initial_state, state['random_state']
+
+
+def restore(directory, config, intersections, generation=None):
+    """a CustomPopulation for intersections picking up where the checkpoint left off"""
+    initial_state, random_state = load(directory, None, generation)
+    pop = custompopulation.CustomPopulation(config, intersections, initial_state)
+    for species_set in pop.species:
+        species_set.reporters = pop.reporters
+    random.setstate(random_state)
+    return pop
@@ -5,6 +5,8 @@ from neat.reporting import ReporterSet
 from neat.math_util import mean
 from neat.six_util import iteritems, itervalues
 import time
+from itertools import count
+from collections import OrderedDict
 
 
 class CompleteExtinctionException(Exception):
@@ -19,11 +21,15 @@ class CustomPopulation(object):
         3. Generate the next generation from the current population.
         4. Partition the new generation into species based on genetic similarity.
         5. Go to 1.
+
+    with one population per intersection, evolved side by side, population i for
+    intersections[i]
     """
 
-    def __init__(self, config, initial_state=None):
+    def __init__(self, config, intersections, initial_state=None):
         self.reporters = ReporterSet()
         self.config = config
+        self.intersections = list(intersections)
         stagnation = config.stagnation_type(config.stagnation_config, self.reporters)
         self.reproduction = config.reproduction_type(config.reproduction_config,
                                                      self.reporters,
@@ -40,27 +46,31 @@ class CustomPopulation(object):
 
         if initial_state is None:
             # Create a population from scratch, then partition into species.
-            self.population = [self.reproduction.create_new(config.genome_type,
-                                                           config.genome_config,
-                                                           config.pop_size),
-                                self.reproduction.create_new(config.genome_type,
-                                                           config.genome_config,
-                                                           config.pop_size),
-                                self.reproduction.create_new(config.genome_type,
-                                                           config.genome_config,
-                                                           config.pop_size)]
-
-            self.species = [config.species_set_type(config.species_set_config, self.reporters),
-                            config.species_set_type(config.species_set_config, self.reporters),
-                            config.species_set_type(config.species_set_config, self.reporters)]
+            self.population = []
+            self.species = []
             self.generation = 0
-            self.species[0].speciate(config, self.population[0], self.generation)
-            self.species[1].speciate(config, self.population[1], self.generation)
-            self.species[2].speciate(config, self.population[2], self.generation)
+            for intersection in self.intersections:
+                population = self.reproduction.create_new(config.genome_type,
+                                                          config.genome_config,
+                                                          config.pop_size)
+                species = config.species_set_type(config.species_set_config, self.reporters)
+                species.speciate(config, population, self.generation)
+                self.population.append(population)
+                self.species.append(species)
+            self.best_genome = [None] * len(self.intersections)
         else:
-            self.population, self.species, self.generation = initial_state
-
-        self.best_genome = [None, None, None]
+            # (populations, species sets, generation), and optionally the best genomes so far
+            # and the intersections they were evolved for
+            self.population, self.species, self.generation = initial_state[:3]
+            self.best_genome = list(initial_state[3]) if len(initial_state) > 3 else [None] * len(self.population)
+            saved = initial_state[4] if len(initial_state) > 4 else None
+            if saved != None and list(saved) != self.intersections:
+                raise ValueError('populations were evolved for intersections {}, not {}'.format(list(saved), self.intersections))
+            if len(self.population) != len(self.intersections):
+                raise ValueError('{} populations for {} intersections'.format(len(self.population), len(self.intersections)))
+            # new genomes mustn't reuse the keys of the ones carried over
+            last_key = max(key for population in self.population for key in population)
+            self.reproduction.genome_indexer = count(last_key + 1)
 
     def add_reporter(self, reporter):
         self.reporters.add(reporter)
@@ -73,9 +83,11 @@ class CustomPopulation(object):
         Runs NEAT's genetic algorithm for at most n generations.  If n
         is None, run until solution is found or extinction occurs.
 
-        The user-provided fitness_function must take only two arguments:
-            1. The population as a list of (genome id, genome) tuples.
+        The user-provided fitness_function must take three arguments:
+            1. An OrderedDict of intersection -> its population as a list of
+               (genome id, genome) tuples, in intersections order.
             2. The current configuration object.
+            3. The current generation.
 
         The return value of the fitness function is ignored, but it must assign
         a Python float to the `fitness` member of each genome.
@@ -98,7 +110,9 @@ class CustomPopulation(object):
             self.reporters.start_generation(self.generation)
 
             # Evaluate all genomes using the user-provided function.
-            fitness_function(list(iteritems(self.population[0])), list(iteritems(self.population[1])), list(iteritems(self.population[2])), self.config, self.generation)
+            populations = OrderedDict((intersection, list(iteritems(population)))
+                                      for intersection, population in zip(self.intersections, self.population))
+            fitness_function(populations, self.config, self.generation)
 
 
             for i in range(len(self.population)):
@@ -0,0 +1,124 @@
+"""Per-step data collection from the simulator for SimulationController.run."""
+
+import traci.constants as tc
+
+
+class PollingCollector(object):
+    """
+    collects everything the step loop needs with one traci call per value, per step.
+    this is how run has always worked and is kept as the reference behaviour.
+
+    after each collect() the following are filled in for the current step:
+        vehicles:           vehicle id -> True/False if the vehicle is stopped
+        emergency_stops:    ids of vehicles that braked harder than their emergency decel
+        arrived:            ids of vehicles that left the network in the last step
+        detector_vehicles:  detector id -> ids of vehicles seen in the last step
+        detector_speeds:    detector id -> mean speed over the last step
+
+    lights are only asked about when the controller needs them, see lightscheduler.py.
+    light_state(light) fills in, and returns, the light's
+        next_switch:        light id -> absolute sim time of the light's next phase switch
+        phases:             light id -> index of the light's current phase
+    """
+
+    def __init__(self, traci):
+        super(PollingCollector, self).__init__()
+        self.traci = traci
+        self.lights = []
+        self.detectors = []
+        self.vehicles = {}
+        self.emergency_stops = []
+        self.arrived = []
+        self.detector_vehicles = {}
+        self.detector_speeds = {}
+        self.next_switch = {}
+        self.phases = {}
+
+        # calls issued by this collector, and the calls the original per-step polling
+        # loop would have made for the same data
+        self.calls = 0
+        self.polled_calls = 0
+
+    def setup(self, lights, detectors):
+        self.lights = lights
+        self.detectors = detectors
+
+    def collect(self):
+        vehicles = self.traci.vehicle.getIDList()
+        self.vehicles = {}
+        for vehicle in vehicles:
+            self.vehicles[vehicle] = self.traci.vehicle.isStopped(vehicle)
+        self.emergency_stops = self.traci.simulation.getEmergencyStoppingVehiclesIDList()
+        self.arrived = self.traci.simulation.getArrivedIDList()
+        for detector in self.detectors:
+            self.detector_vehicles[detector] = self.traci.inductionloop.getLastStepVehicleIDs(detector)
+            self.detector_speeds[detector] = self.traci.inductionloop.getLastStepMeanSpeed(detector)
+
+        self.calls += 3 + len(vehicles) + 2 * len(self.detectors)
+        self.count_polled_calls()
+
+    def light_state(self, light):
+        """(next switch, phase) of light, as of the last step"""
+        self.next_switch[light] = self.traci.trafficlight.getNextSwitch(light)
+        self.phases[light] = self.traci.trafficlight.getPhase(light)
+        self.calls += 2
+        return self.next_switch[light], self.phases[light]
+
+    def count_polled_calls(self):
+        # the original loop asked isStopped twice per vehicle, the mean speed twice per
+        # detector whenever it was positive, and every light's next switch. the current
+        # phase is counted once per light too, as it would have to be polled to keep it
+        # up to date
+        self.polled_calls += 2 + 2 * len(self.vehicles) + 2 * len(self.lights)
+        for detector in self.detectors:
+            self.polled_calls += 3 if self.detector_speeds[detector] > 0 else 2
+
+    def saved_calls(self):
+        return self.polled_calls - self.calls
+
+
+class SubscriptionCollector(PollingCollector):
+    """
+    collects the same data as PollingCollector, but through traci subscriptions.
+    detectors and the simulation are subscribed to once in setup, and each vehicle once
+    when it departs; after that every value arrives with simulationStep and reading it
+    costs no round trip at all. lights are still asked directly, as they're only needed
+    now and then
+    """
+
+    def setup(self, lights, detectors):
+        super(SubscriptionCollector, self).setup(lights, detectors)
+        self.traci.simulation.subscribe([tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS,
+                                         tc.VAR_EMERGENCYSTOPPING_VEHICLES_IDS])
+        for detector in detectors:
+            self.traci.inductionloop.subscribe(detector, [tc.LAST_STEP_VEHICLE_ID_LIST, tc.LAST_STEP_MEAN_SPEED])
+        self.calls += 1 + len(detectors)
+
+        # vehicles already on the road, e.g. when starting from a saved state
+        vehicles = self.traci.vehicle.getIDList()
+        for vehicle in vehicles:
+            self.traci.vehicle.subscribe(vehicle, [tc.VAR_STOPSTATE])
+        self.calls += 1 + len(vehicles)
+
+    def collect(self):
+        simulation = self.traci.simulation.getSubscriptionResults()
+        # subscribing answers straight away with the current values, so new vehicles
+        # show up in the results below on the step they depart
+        for vehicle in simulation[tc.VAR_DEPARTED_VEHICLES_IDS]:
+            self.traci.vehicle.subscribe(vehicle, [tc.VAR_STOPSTATE])
+            self.calls += 1
+        self.emergency_stops = simulation[tc.VAR_EMERGENCYSTOPPING_VEHICLES_IDS]
+        self.arrived = simulation[tc.VAR_ARRIVED_VEHICLES_IDS]
+
+        # arrived vehicles drop out of the subscription results by themselves
+        self.vehicles = {}
+        for vehicle, values in self.traci.vehicle.getAllSubscriptionResults().items():
+            # same test as traci.vehicle.isStopped
+            self.vehicles[vehicle] = (values[tc.VAR_STOPSTATE] & 1) == 1
+
+        detectors = self.traci.inductionloop.getAllSubscriptionResults()
+        for detector in self.detectors:
+            self.detector_vehicles[detector] = detectors[detector][tc.LAST_STEP_VEHICLE_ID_LIST]
+            self.detector_speeds[detector] = detectors[detector][tc.LAST_STEP_MEAN_SPEED]
+
+        self.count_polled_calls()
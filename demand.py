@@ -0,0 +1,143 @@
+"""
+The traffic every evaluation faces.
+
+Every `interval` steps a batch of min_cars to max_cars vehicles is drawn. Each one takes
+route_0, route_1, ... with the probabilities in route_probabilities, and otherwise a route
+picked uniformly from other_routes. The draws come from random.Random(seed), in the same order
+the controller always drew them, so the defaults give exactly the demand of earlier runs.
+
+For a network of several copies of the corridor (see multicorridor.py) every copy gets the same
+vehicles, on its own routes: vehicle_N of copy k becomes c<k>.vehicle_<N * copies + k>, so
+vehicle numbers stay unique across the network. sumo would draw each vehicle's speed factor
+as it's inserted, from one generator for the whole network, so the copies would get different
+drivers, and which ones would depend on the other copies. Instead every vehicle is given one,
+drawn here the way sumo draws them for its default vehicle type, and the same in every copy.
+A single corridor leaves them to sumo as it always has, and costs no extra traci calls: the
+copies still don't score what a triplet scores on its own (see multicorridor.py), so there's
+nothing for the single corridor to line up with yet.
+
+The controller can insert this with a traci vehicle.add per car, or have sumo read it from a
+route file. Route files are written once per set of parameters into a content addressed cache
+(the file name is a hash of everything that goes into it), so any scenario is only generated
+once and can be shared between processes and runs.
+"""
+
+import os
+import random
+import hashlib
+import tempfile
+
+import numpy as np
+
+import multicorridor
+
+# bump when the file layout changes, so old cache entries aren't picked up
+FORMAT_VERSION = 3
+
+# sumo's default speed factor distribution, normc(1, 0.1, 0.2, 2)
+SPEED_FACTOR = (1.0, 0.1, 0.2, 2.0)
+
+
+class Demand(object):
+    def __init__(self, seed=1234, interval=20, min_cars=10, max_cars=40, route_probabilities=(0.35, 0.35), other_routes=(2, 13)):
+        super(Demand, self).__init__()
+        if sum(route_probabilities) > 1.0:
+            raise ValueError('route probabilities add up to more than 1: {}'.format(route_probabilities))
+        self.seed = seed
+        self.interval = interval
+        self.min_cars = min_cars
+        self.max_cars = max_cars
+        self.route_probabilities = tuple(route_probabilities)
+        # first and last route number, inclusive, for the cars not given one of the above
+        self.other_routes = tuple(other_routes)
+        self._departures = {}
+
+    def __repr__(self):
+        return 'Demand(seed={!r}, interval={!r}, min_cars={!r}, max_cars={!r}, route_probabilities={!r}, other_routes={!r})'.format(
+            self.seed, self.interval, self.min_cars, self.max_cars, self.route_probabilities, self.other_routes)
+
+    def departures(self, steps):
+        """[(step, vehicle id, route id)] for steps 0 to steps inclusive, in insertion order"""
+        if steps not in self._departures:
+            rng = random.Random(self.seed)
+            departures = []
+            for step in range(0, steps + 1, self.interval):
+                for car in range(rng.randint(self.min_cars, self.max_cars)):
+                    gen_number = rng.random()
+                    route_number = None
+                    threshold = 0.0
+                    for number, probability in enumerate(self.route_probabilities):
+                        threshold += probability
+                        if gen_number < threshold:
+                            route_number = number
+                            break
+                    if route_number == None:
+                        route_number = rng.randint(*self.other_routes)
+                    departures.append((step, 'vehicle_' + str(len(departures)), 'route_' + str(route_number)))
+            self._departures[steps] = departures
+        return self._departures[steps]
+
+    def speed_factors(self, steps):
+        """a speed factor for each of the departures, from a generator of their own"""
+        rng = random.Random('{}-speed'.format(self.seed))
+        mean, deviation, low, high = SPEED_FACTOR
+        factors = []
+        for departure in self.departures(steps):
+            # drawn again until it's inside the bounds, as sumo does
+            factor = rng.gauss(mean, deviation)
+            while factor < low or factor > high:
+                factor = rng.gauss(mean, deviation)
+            factors.append(round(factor, 4))
+        return factors
+
+    def replicated(self, steps, copies=1):
+        """
+        [(step, vehicle id, route id, speed factor)], with every vehicle repeated in each of
+        copies copies of the corridor. the speed factor is None, for sumo to pick, with one copy
+        """
+        if copies <= 1:
+            return [(step, vehicle, route, None) for step, vehicle, route in self.departures(steps)]
+        departures = []
+        for (step, vehicle, route), factor in zip(self.departures(steps), self.speed_factors(steps)):
+            number = int(vehicle.split('_')[-1])
+            for k in range(copies):
+                prefix = multicorridor.copy_prefix(k)
+                departures.append((step, '{}vehicle_{}'.format(prefix, number * copies + k), prefix + route, factor))
+        return departures
+
+    def by_step(self, steps, copies=1):
+        """step -> [(vehicle id, route id, speed factor)], for the steps anything departs on"""
+        schedule = {}
+        for step, vehicle, route, factor in self.replicated(steps, copies):
+            schedule.setdefault(step, []).append((vehicle, route, factor))
+        return schedule
+
+    def counts(self, steps, routes):
+        """(steps + 1, routes) array of vehicles departing per step and route number"""
+        counts = np.zeros((steps + 1, routes), dtype=np.int64)
+        for step, vehicle, route in self.departures(steps):
+            counts[step, int(route.split('_')[-1])] += 1
+        return counts
+
+    def key(self, steps, copies=1):
+        return hashlib.sha1('{}|{!r}|steps={}|copies={}'.format(FORMAT_VERSION, self, steps, copies).encode('utf-8')).hexdigest()
+
+    def route_file(self, steps, cache_dir='demand_cache', copies=1):
+        """path of a sumo route file with these departures, written if the cache doesn't have it yet"""
+        path = os.path.join(cache_dir, 'demand_{}.rou.xml'.format(self.key(steps, copies)[:16]))
+        if os.path.exists(path):
+            return path
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        lines = ['<!-- {!r}, steps {}, copies {} -->'.format(self, steps, copies), '<routes>']
+        for step, vehicle, route, factor in self.replicated(steps, copies):
+            # traci.vehicle.add's defaults, not the ones sumo uses for route files
+            extra = ' speedFactor="{}"'.format(factor) if factor != None else ''
+            lines.append('    <vehicle id="{}" route="{}" depart="{}" departLane="first" departPos="base" departSpeed="0"{}/>'.format(vehicle, route, step, extra))
+        lines.append('</routes>')
+        # several processes may get here at once, so each writes its own file and the last one wins
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+        return path
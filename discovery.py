@@ -0,0 +1,132 @@
+"""
+Which traffic lights get a network of their own, found from the network instead of written down.
+
+A light is an intersection when some induction loop belongs to it, by the detector naming
+scheme the corridor uses:
+
+    <light>_<anything>_<side>       e.g. WC_mainNorth1_0_W, or c0.WC_mainNorth1_0_W in a copy
+
+where side is the side of the intersection the detector is on, one of N, S, E, W. Light ids
+can have underscores in them too, so a detector belongs to the longest light its id starts
+with. Lights without detectors keep running their own programs, and detectors that don't
+belong to a light are left alone.
+
+Intersections are ordered west to east, then south to north, by the junctions each light
+controls, so they come out in the same order however sumo lists them. Population k of a
+CustomPopulation evolves the networks of intersection k (on the corridor: WC, CC, EC).
+
+discover() asks a running sumo, from_files() reads the same off the net and additional files,
+for when nothing is running yet (e.g. to know how many populations to make).
+"""
+
+import os
+import xml.etree.ElementTree as ElementTree
+
+import phasetable
+
+
+def light_of(detector, lights):
+    """the light detector belongs to, or None"""
+    light = None
+    end = detector.find('_')
+    while end != -1:
+        if detector[:end] in lights:
+            light = detector[:end]
+        end = detector.find('_', end + 1)
+    return light
+
+
+def side_of(detector):
+    """index into phasetable.DIRECTIONS of the side detector is on, or None"""
+    side = detector[detector.rfind('_') + 1:]
+    if side in phasetable.DIRECTIONS:
+        return phasetable.DIRECTIONS.index(side)
+    return None
+
+
+def intersections(lights, detectors, positions=None):
+    """
+    the lights with detectors, ordered by positions (light -> (x, y)) when given, and
+    otherwise in the order of lights
+    """
+    lights = list(lights)
+    known = set(lights)
+    with_detectors = set()
+    for detector in detectors:
+        light = light_of(detector, known)
+        if light != None and side_of(detector) != None:
+            with_detectors.add(light)
+    found = [light for light in lights if light in with_detectors]
+    if positions != None:
+        found.sort(key=lambda light: positions.get(light, (0.0, 0.0)))
+    return found
+
+
+def detector_index(detectors, intersections):
+    """
+    (detectors, rows, sides) for the detectors belonging to one of intersections: their ids, the
+    index of their intersection, and the side they're on. worked out once, so the step loop
+    never has to take a detector id apart
+    """
+    index = dict((intersection, row) for row, intersection in enumerate(intersections))
+    kept, rows, sides = [], [], []
+    for detector in detectors:
+        light = light_of(detector, index)
+        side = side_of(detector)
+        if light != None and side != None:
+            kept.append(detector)
+            rows.append(index[light])
+            sides.append(side)
+    return kept, rows, sides
+
+
+def discover(traci):
+    """the intersections of the network sumo is running, through traci or libsumo"""
+    lights = traci.trafficlight.getIDList()
+    positions = {}
+    for light in lights:
+        points = [traci.junction.getPosition(junction) for junction in traci.trafficlight.getControlledJunctions(light)]
+        if len(points):
+            positions[light] = (sum(x for x, y in points) / len(points), sum(y for x, y in points) / len(points))
+    return intersections(lights, traci.inductionloop.getIDList(), positions)
+
+
+def light_positions(net):
+    """light -> mean (x, y) of the junctions it controls, from a parsed net file"""
+    junctions = {}
+    for junction in net.iter('junction'):
+        junctions[junction.get('id')] = (float(junction.get('x')), float(junction.get('y')))
+    edge_ends = {}
+    for edge in net.iter('edge'):
+        if edge.get('to') != None:
+            edge_ends[edge.get('id')] = edge.get('to')
+    controlled = {}
+    for connection in net.iter('connection'):
+        light = connection.get('tl')
+        if light != None and connection.get('from') in edge_ends:
+            controlled.setdefault(light, set()).add(edge_ends[connection.get('from')])
+    positions = {}
+    for light, ends in controlled.items():
+        points = [junctions[junction] for junction in ends]
+        positions[light] = (sum(x for x, y in points) / len(points), sum(y for x, y in points) / len(points))
+    return positions
+
+
+# (paths, modification times) -> intersections, so every controller doesn't parse the net again
+_found = {}
+
+
+def from_files(config_dir='.', net_file='corridor.net.xml', additional_file='corridor.add.xml'):
+    """the intersections discover() would find once sumo has loaded these files"""
+    paths = (os.path.join(config_dir, net_file), os.path.join(config_dir, additional_file))
+    key = (paths, tuple(os.path.getmtime(path) for path in paths))
+    if key not in _found:
+        net = ElementTree.parse(paths[0]).getroot()
+        lights = []
+        # a light with several programs has a tlLogic for each
+        for logic in net.iter('tlLogic'):
+            if logic.get('id') not in lights:
+                lights.append(logic.get('id'))
+        detectors = [detector.get('id') for detector in ElementTree.parse(paths[1]).getroot().iter('e1Detector')]
+        _found[key] = intersections(lights, detectors, light_positions(net))
+    return list(_found[key])
@@ -0,0 +1,354 @@
+#!/usr/local/bin/python3
+"""
+Evaluating triplets on workers spread over several machines.
+
+The Coordinator runs in the process doing the evolution. It listens on a port and hands out
+one task at a time, a (triplet, seed) pair, to whichever worker asks. Every worker connects
+to it (python distributed.py --connect HOST:PORT, from a sumo_config directory on its own
+machine), runs the triplet in its own sumo and sends back the penalties.
+
+Lost work is handed out again:
+
+    a worker that drops its connection, or that hasn't sent a heartbeat for `timeout`
+    seconds, is forgotten, and its task goes back on the queue
+    a task that's been out for longer than `task_timeout` seconds (if set) is handed to
+    another worker as well, and whichever answers first is kept
+    a run that fails, or comes back with None for a score, is retried up to max_attempts
+    times before evaluate gives up with an EvaluationError
+
+Everything goes over multiprocessing.connection, which unpickles whatever it's sent, so anyone
+who can connect and knows the authkey can run code on the other end. There's no default key:
+run.py --serve makes up a random one unless given --authkey, and prints it for the workers. The
+coordinator also only listens on 127.0.0.1 unless run.py is given --host, so reaching it from
+other machines is something to ask for, preferably over a network you trust:
+
+    python run.py --nogui --serve 6000 &          # prints the authkey
+    python ../distributed.py --connect localhost:6000 --authkey KEY --workers 4
+"""
+
+import os
+import sys
+import time
+import socket
+import secrets
+import optparse
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+import evaluation
+import logging
+
+DEFAULT_HOST = '127.0.0.1'
+
+
+def new_authkey():
+    """a random authkey, for a coordinator that wasn't given one"""
+    return secrets.token_hex(16)
+
+
+class EvaluationError(Exception):
+    """a task failed on every attempt it was given"""
+
+
+def parse_address(address):
+    """'host:port' -> (host, port)"""
+    host, port = address.rsplit(':', 1)
+    return (host, int(port))
+
+
+class _WorkerLink(object):
+    """the coordinator's view of one connected worker"""
+
+    def __init__(self, name, connection):
+        super(_WorkerLink, self).__init__()
+        self.name = name
+        self.connection = connection
+        self.last_seen = time.time()
+        # task id it's working on, and since when
+        self.task = None
+        self.task_start = None
+        # set once the coordinator has given up on it
+        self.lost = False
+
+
+class Coordinator(object):
+    """
+    hands triplets out to remote workers. evaluate has the same signature as
+    ParallelEvaluator.evaluate, so it can be passed to CustomPopulation.run directly
+    """
+
+    def __init__(self, config, authkey, address=(DEFAULT_HOST, 6000), cache=None,
+                 timeout=60.0, task_timeout=None, heartbeat=5.0, max_attempts=3, **sim_options):
+        super(Coordinator, self).__init__()
+        if not authkey:
+            raise ValueError('the coordinator needs an authkey, see distributed.new_authkey')
+        self.config = config
+        self.cache = cache
+        self.timeout = timeout
+        self.task_timeout = task_timeout
+        self.heartbeat = heartbeat
+        self.max_attempts = max_attempts
+        self.sim_options = sim_options
+
+        self.condition = threading.Condition()
+        self.next_id = 0
+        # task id -> triplet, for every task not yet finished
+        self.tasks = {}
+        self.queue = deque()
+        self.failures = {}
+        # task id -> when it was last handed out again for taking too long
+        self.overdue = {}
+        self.results = {}
+        self.errors = {}
+        self.workers = {}
+        self.closing = False
+        self.dispatched = 0
+        self.redispatched = 0
+        # the generation being evaluated, sent with every task so workers' racing policies
+        # start each one afresh
+        self.generation = None
+
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        for target in [self.accept_loop, self.watch_loop]:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    # connections
+
+    def accept_loop(self):
+        while not self.closing:
+            try:
+                connection = self.listener.accept()
+            except Exception:
+                # a bad authkey or a half open connection, neither of which stops the rest
+                continue
+            thread = threading.Thread(target=self.serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, connection):
+        worker = None
+        try:
+            kind, name = connection.recv()
+            worker = _WorkerLink(name, connection)
+            with self.condition:
+                self.workers[name] = worker
+            connection.send(('setup', self.config, self.sim_options, self.heartbeat))
+            while not worker.lost:
+                if not connection.poll(1.0):
+                    continue
+                message = connection.recv()
+                worker.last_seen = time.time()
+                if message[0] == 'ready':
+                    connection.send(self.next_task(worker))
+                elif message[0] == 'result':
+                    self.finish(worker, message[1], message[2], None)
+                elif message[0] == 'failed':
+                    self.finish(worker, message[1], None, message[2])
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+            if worker != None:
+                self.lose(worker, 'disconnected')
+
+    def next_task(self, worker):
+        with self.condition:
+            if self.closing:
+                return ('stop',)
+            # tasks finished elsewhere while they sat in the queue are skipped
+            while len(self.queue) and self.queue[0] not in self.tasks:
+                self.queue.popleft()
+            if not len(self.queue):
+                return ('idle',)
+            task = self.queue.popleft()
+            worker.task = task
+            worker.task_start = time.time()
+            self.dispatched += 1
+            return ('task', task, self.tasks[task], self.generation)
+
+    def finish(self, worker, task, penalties, error):
+        with self.condition:
+            if worker.task == task:
+                worker.task = None
+            if task not in self.tasks:
+                # someone else got there first
+                return
+            if error == None and (penalties == None or None in penalties.values()):
+                error = 'no score for {}'.format(penalties)
+            if error == None:
+                self.results[task] = penalties
+                del self.tasks[task]
+                self.overdue.pop(task, None)
+                self.condition.notify_all()
+                return
+            self.failures[task] = self.failures.get(task, 0) + 1
+            if self.failures[task] < self.max_attempts:
+                print('distributed: task {} failed on {}, retrying: {}'.format(task, worker.name, error.strip().splitlines()[-1]))
+                self.queue.append(task)
+            else:
+                self.errors[task] = error
+                del self.tasks[task]
+                self.overdue.pop(task, None)
+            self.condition.notify_all()
+
+    def lose(self, worker, reason):
+        with self.condition:
+            worker.lost = True
+            if self.workers.get(worker.name) is worker:
+                del self.workers[worker.name]
+            if worker.task != None and worker.task in self.tasks:
+                print('distributed: worker {} {}, handing task {} out again'.format(worker.name, reason, worker.task))
+                self.queue.appendleft(worker.task)
+                self.redispatched += 1
+            worker.task = None
+            self.condition.notify_all()
+
+    def watch_loop(self):
+        while not self.closing:
+            time.sleep(min(self.heartbeat, 1.0))
+            now = time.time()
+            with self.condition:
+                workers = list(self.workers.values())
+            for worker in workers:
+                if now - worker.last_seen > self.timeout:
+                    # its serve thread notices and hangs up
+                    self.lose(worker, 'went quiet')
+                elif self.task_timeout != None and worker.task != None and now - worker.task_start > self.task_timeout:
+                    with self.condition:
+                        # once per task_timeout at most, however many workers it's on by now
+                        task = worker.task
+                        if task in self.tasks and now - self.overdue.get(task, 0) > self.task_timeout:
+                            self.overdue[task] = now
+                            print('distributed: task {} is taking too long on {}, handing it out again'.format(task, worker.name))
+                            self.queue.append(task)
+                            self.redispatched += 1
+
+    # evaluation
+
+    def evaluate_all(self, triplets):
+        """penalties for every triplet, in order, once some worker has run each of them"""
+        with self.condition:
+            ids = []
+            for genomes in triplets:
+                self.tasks[self.next_id] = genomes
+                self.queue.append(self.next_id)
+                ids.append(self.next_id)
+                self.next_id += 1
+            while any(task in self.tasks for task in ids):
+                self.condition.wait(1.0)
+            failed = [task for task in ids if task in self.errors]
+            if len(failed):
+                raise EvaluationError('{} of {} tasks failed, the first with:\n{}'.format(len(failed), len(ids), self.errors[failed[0]]))
+            return [self.results.pop(task) for task in ids]
+
+    def evaluate(self, populations, config, gen):
+        self.generation = gen
+        evaluation.score_generation(populations, config, self.evaluate_all, self.cache, self.sim_options)
+        print('distributed: {} workers connected, {} tasks handed out, {} handed out again'.format(
+            len(self.workers), self.dispatched, self.redispatched))
+
+    def close(self):
+        """workers are told to stop the next time they ask for work"""
+        with self.condition:
+            self.closing = True
+        deadline = time.time() + self.heartbeat * 2
+        while len(self.workers) and time.time() < deadline:
+            time.sleep(0.1)
+        self.listener.close()
+
+
+def work(address, authkey, name=None, poll_interval=0.5):
+    """
+    runs tasks for the coordinator at address until it says to stop. needs to run in a
+    directory with the sumo config, like run.py
+    """
+    if name == None:
+        name = '{}-{}'.format(socket.gethostname(), os.getpid())
+    connection = Client(address, authkey=authkey)
+    sending = threading.Lock()
+
+    def send(message):
+        with sending:
+            connection.send(message)
+
+    send(('hello', name))
+    kind, config, sim_options, heartbeat = connection.recv()
+    label = 'node{}'.format(os.getpid())
+    log = logging.Logging(logging.Level.WARNING.value, logging.Level.DEBUG.value, 'experiment_output.{}'.format(label))
+
+    stopped = threading.Event()
+    # the generation the racing policy, if there is one, is racing
+    generation = None
+
+    def beat():
+        while not stopped.wait(heartbeat):
+            try:
+                send(('heartbeat',))
+            except (OSError, ValueError):
+                return
+    thread = threading.Thread(target=beat)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            send(('ready',))
+            message = connection.recv()
+            if message[0] == 'stop':
+                break
+            if message[0] == 'idle':
+                time.sleep(poll_interval)
+                continue
+            kind, task, genomes, gen = message
+            policy = sim_options.get('racing')
+            if gen != generation and policy != None:
+                policy.new_generation()
+            generation = gen
+            try:
+                penalties = evaluation.evaluate_triplet(genomes, config, log, label=label, **sim_options)
+            except Exception:
+                send(('failed', task, traceback.format_exc()))
+                # whatever broke may have taken the warm simulation with it
+                evaluation.close_simulations()
+                continue
+            # sent as it is, a run racing stopped early has to stay a RacedPenalties so the
+            # coordinator neither caches it nor ranks it with the finished ones
+            send(('result', task, penalties))
+    except EOFError:
+        pass
+    finally:
+        stopped.set()
+        evaluation.close_simulations()
+        log.close()
+        connection.close()
+
+
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--connect", default="localhost:6000", metavar="HOST:PORT",
+                         help="address of the coordinator (run.py --serve)")
+    opt_parser.add_option("--authkey", default=None,
+                         help="shared secret, the one the coordinator printed or was given")
+    opt_parser.add_option("--workers", type="int", default=1,
+                         help="worker processes to run on this machine, each with its own sumo")
+    options, args = opt_parser.parse_args()
+    return options
+
+
+if __name__ == "__main__":
+    options = get_options()
+    if options.authkey == None:
+        sys.exit('--authkey is needed, the coordinator prints it when it starts')
+    address = parse_address(options.connect)
+    authkey = options.authkey.encode()
+    processes = [multiprocessing.Process(target=work, args=(address, authkey)) for i in range(options.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
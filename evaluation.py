@@ -0,0 +1,288 @@
+"""Scores genome triplets, one genome per intersection (WC, CC, EC on the corridor), either one after another or in worker processes."""
+
+import os
+import multiprocessing
+import multiprocessing.util
+import neat
+from collections import OrderedDict
+import simulationcontroller
+import multicorridor
+import racing
+import sumopool
+import logging
+
+
+def make_triplets(populations):
+    """
+    lines up the populations, a dict of intersection -> [(genome id, genome)], into one dict of
+    genomes per simulation, keyed by the intersection each genome controls. they're still
+    called triplets, whatever the number of intersections
+    """
+    triplets = []
+    for i in range(max(len(population) for population in populations.values())):
+        # in the case of species stagnation, any number of members may be removed from a population
+        # so we just re-use and re-score genomes in that case, not counting their first score
+        genomes = {}
+        for intersection, population in populations.items():
+            genomes[intersection] = population[i % len(population)][1]
+        triplets.append(genomes)
+    return triplets
+
+
+# with warm_start on, each process keeps a single simulation alive and reuses it for every triplet,
+# as long as they're on the same demand and number of copies
+_warm_simulation = None
+_warm_key = None
+
+
+def evaluate_triplet(genomes, config, log, gui='nogui', label=None, **sim_options):
+    """
+    runs one full simulation for a triplet and returns the penalties dict.
+    any sim_options are passed on to the SimulationController
+    """
+    return evaluate_batch([genomes], config, log, gui, label, **sim_options)[0]
+
+
+def evaluate_batch(batch, config, log, gui='nogui', label=None, **sim_options):
+    """
+    runs a list of triplets side by side in one simulation, each in its own copy of the
+    corridor (see multicorridor.py), and returns their penalties dicts in the same order.
+    a batch shorter than sim_options['copies'] is padded out with its last triplet, so every
+    triplet runs on a network of the same size
+    """
+    global _warm_simulation, _warm_key
+    size = len(batch)
+    copies = max(sim_options.get('copies', 1), size)
+    batch = list(batch) + [batch[-1]] * (copies - size)
+    sim_options['copies'] = copies
+    networks = []
+    for genomes in batch:
+        nets = {}
+        for intersection in genomes:
+            nets[intersection] = neat.nn.FeedForwardNetwork.create(genomes[intersection], config)
+        networks.append(nets)
+    nets = networks[0] if len(batch) == 1 else multicorridor.merge_networks(networks)
+
+    if sim_options.get('warm_start'):
+        # a warm simulation only has room for as many triplets as it was started with, so
+        # another demand scenario needs one of its own
+        key = (len(batch), sim_options.get('seed'), repr(sim_options.get('demand')))
+        if _warm_simulation is not None and _warm_key != key:
+            close_simulations()
+        if _warm_simulation is None:
+            _warm_simulation = simulationcontroller.SimulationController(log, **sim_options)
+            _warm_simulation.start(gui, label)
+            _warm_key = key
+        sim = _warm_simulation
+    else:
+        # initialise new simulation
+        sim = simulationcontroller.SimulationController(log, **sim_options)
+        sim.start(gui, label)
+    penalties = sim.run(nets)
+    if len(batch) == 1:
+        return [penalties]
+    return multicorridor.split_penalties(penalties, len(batch))[:size]
+
+
+def batches(triplets, copies):
+    """triplets split into lists of up to copies each, for evaluate_batch"""
+    return [triplets[i:i + copies] for i in range(0, len(triplets), copies)]
+
+
+def close_simulations():
+    """
+    shuts down the simulation kept alive for warm starts in this process, if there is one, and
+    the sumos pooled for backend 'pool'
+    """
+    global _warm_simulation, _warm_key
+    if _warm_simulation is not None:
+        _warm_simulation.close()
+        _warm_simulation = None
+        _warm_key = None
+    sumopool.close_pools()
+
+
+# sim_options that change how a simulation is run but not what comes out of it
+# (a raced run that goes the distance scores the same, and one stopped early isn't cached).
+# copies isn't one of them, a triplet's penalties depend on which copy of the corridor it ran in
+RESULT_NEUTRAL_OPTIONS = ['collection', 'backend', 'profiler', 'racing', 'insertion', 'demand_cache', 'pool_size', 'pool_max_uses',
+                          'trace', 'tripinfo']
+
+
+def scenario_of(sim_options):
+    """the sim_options that can change a triplet's penalties, for keying the fitness cache"""
+    scenario = {}
+    for name in sim_options:
+        if name not in RESULT_NEUTRAL_OPTIONS and name != 'seed':
+            scenario[name] = sim_options[name]
+    return scenario
+
+
+def score_triplets(triplets, evaluate_all, cache=None, sim_options={}):
+    """
+    returns the penalties for every triplet, in order. triplets already in the cache cost
+    nothing, and a triplet that turns up more than once is only simulated once.
+    evaluate_all takes a list of triplets and returns their penalties in the same order
+    """
+    if cache is None:
+        return racing.behind_finished(evaluate_all(triplets))
+
+    seed = sim_options.get('seed', 1234)
+    scenario = scenario_of(sim_options)
+    keys = [cache.key(genomes, seed, scenario) for genomes in triplets]
+
+    scores = {}
+    pending = OrderedDict()
+    for key, genomes in zip(keys, triplets):
+        if key in scores or key in pending:
+            continue
+        cached = cache.get(key)
+        if cached is not None:
+            scores[key] = cached
+        else:
+            pending[key] = genomes
+
+    for key, penalties in zip(pending, evaluate_all(list(pending.values()))):
+        scores[key] = penalties
+        # a failed run isn't worth remembering, and a guess at one stopped early even less so
+        if penalties is not None and None not in penalties.values() and not racing.was_stopped(penalties):
+            cache.put(key, penalties)
+
+    # once a generation, so a restart loses at most the generation in progress
+    cache.save()
+    stats = cache.stats()
+    print('fitness cache: {} simulated, {} hits, {} misses ({:.0%} hit rate), {}/{} entries'.format(
+        len(pending), stats['hits'], stats['misses'], stats['hit_rate'], stats['size'], stats['max_size']))
+
+    return racing.behind_finished([scores[key] for key in keys])
+
+
+def assign_scores(genomes, scores):
+    # scores are keyed by intersection, so match them up by key rather than by dict order
+    for intersection in genomes:
+        if scores[intersection] == None:
+            print('ERROR: Score is None, setting to -1500 to keep things running...')
+            genomes[intersection].fitness = -1500
+        else:
+            genomes[intersection].fitness = scores[intersection]
+
+
+def score_generation(populations, config, evaluate_all, cache=None, sim_options={}):
+    """
+    scores a generation's triplets through evaluate_all (see score_triplets) and sets every
+    genome's fitness
+    """
+    triplets = make_triplets(populations)
+    for genomes in triplets:
+        for intersection in genomes:
+            genomes[intersection].fitness = 0.0
+
+    results = score_triplets(triplets, evaluate_all, cache, sim_options)
+    for genomes, scores in zip(triplets, results):
+        assign_scores(genomes, scores)
+
+
+# per-process state for pool workers, set up once by _init_worker
+_worker_config = None
+_worker_log = None
+_worker_label = None
+_worker_sim_options = {}
+# the generation this worker's copy of the racing policy is racing, see _start_generation
+_worker_generation = None
+
+
+def _init_worker(config, log_file, sim_options):
+    global _worker_config, _worker_log, _worker_label, _worker_sim_options
+    _worker_config = config
+    _worker_sim_options = sim_options
+    # every worker gets its own traci connection label and log file,
+    # so parallel simulations never share a socket or an output stream
+    _worker_label = 'worker{}'.format(os.getpid())
+    output_file = None
+    if log_file != None:
+        output_file = '{}.{}'.format(log_file, _worker_label)
+    _worker_log = logging.Logging(logging.Level.WARNING.value, logging.Level.DEBUG.value, output_file)
+    # shut down any warm-start simulation when the worker exits after pool.close(),
+    # then let the log writer finish what's queued
+    multiprocessing.util.Finalize(None, close_simulations, exitpriority=10)
+    multiprocessing.util.Finalize(None, _worker_log.close, exitpriority=5)
+    # each worker profiles on its own copy of the profiler, so give it its own files too
+    profiler = sim_options.get('profiler')
+    if profiler != None and profiler.path != None:
+        profiler.path = '{}.{}'.format(profiler.path, _worker_label)
+        multiprocessing.util.Finalize(None, profiler.save, exitpriority=5)
+    # workers race on their own copy of the policy, so each reports what it saved
+    policy = sim_options.get('racing')
+    if policy != None:
+        multiprocessing.util.Finalize(None, lambda: print('{} {}'.format(_worker_label, policy.summary())), exitpriority=5)
+
+
+def _start_generation(gen):
+    # each worker races on its own copy of the policy, which has to start every generation
+    # afresh like the one in the main process does
+    global _worker_generation
+    policy = _worker_sim_options.get('racing')
+    if gen != _worker_generation and policy != None:
+        policy.new_generation()
+    _worker_generation = gen
+
+
+def _evaluate_in_worker(task):
+    # a (generation, genomes) from ParallelEvaluator.evaluate
+    gen, genomes = task
+    _start_generation(gen)
+    return evaluate_triplet(genomes, _worker_config, _worker_log, label=_worker_label, **_worker_sim_options)
+
+
+def _evaluate_batch_in_worker(task):
+    gen, batch = task
+    _start_generation(gen)
+    return evaluate_batch(batch, _worker_config, _worker_log, label=_worker_label, **_worker_sim_options)
+
+
+def _evaluate_task_in_worker(task):
+    # a generation and a (task id, genomes, sim_options) from scenarios.ScenarioSet.evaluate_all
+    gen, (task_id, genomes, overrides) = task
+    _start_generation(gen)
+    options = dict(_worker_sim_options, **overrides)
+    return task_id, evaluate_triplet(genomes, _worker_config, _worker_log, label=_worker_label, **options)
+
+
+class ParallelEvaluator(object):
+    """
+    evaluates triplets in a pool of worker processes, each running its own sumo instance.
+    the fitness function signature matches run.score_genomes so it can be passed to
+    CustomPopulation.run directly
+    """
+
+    def __init__(self, num_workers, config, log_file='experiment_output', cache=None, scenarios=None, **sim_options):
+        super(ParallelEvaluator, self).__init__()
+        self.num_workers = num_workers
+        self.cache = cache
+        # with a scenarios.ScenarioSet, every triplet runs on each of its scenarios
+        self.scenarios = scenarios
+        self.sim_options = sim_options
+        # note: we stay on multiprocessing rather than concurrent.futures, which imports
+        # the standard library logging module that our logging.py shadows
+        self.pool = multiprocessing.Pool(num_workers, _init_worker, (config, log_file, sim_options))
+
+    def evaluate(self, populations, config, gen):
+        # map keeps the results in task order, so each score goes back to the triplet
+        # it came from no matter which worker finished first
+        evaluate_all = lambda pending: self.pool.map(_evaluate_in_worker, [(gen, genomes) for genomes in pending], chunksize=1)
+        copies = self.sim_options.get('copies', 1)
+        if copies > 1:
+            evaluate_all = lambda pending: [penalties for results in self.pool.map(_evaluate_batch_in_worker, [(gen, batch) for batch in batches(pending, copies)], chunksize=1)
+                                            for penalties in results]
+        cache = self.cache
+        if self.scenarios is not None:
+            # the workers take triplet and scenario pairs as they free up, and the scenario
+            # set caches them one by one
+            run_tasks = lambda tasks: self.pool.imap_unordered(_evaluate_task_in_worker, ((gen, task) for task in tasks), chunksize=1)
+            evaluate_all = lambda pending: self.scenarios.evaluate_all(pending, run_tasks, self.sim_options, self.cache, gen)
+            cache = None
+        score_generation(populations, config, evaluate_all, cache, self.sim_options)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
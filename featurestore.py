@@ -0,0 +1,167 @@
+"""
+What the controller knows about each intersection between decisions, kept in numpy arrays
+with one row per intersection, so updating it is O(1) per detector reading and a decision reads
+its network inputs straight from a row.
+
+The 13 inputs every network gets, in this order:
+
+    num_cars:       vehicles that have crossed the intersection's detectors
+    av_speed:       mean of every positive detector speed at the intersection so far
+    N_dets_time:    step a vehicle last crossed a North detector
+    S_dets_time:    South "
+    E_dets_time:    East  "
+    W_dets_time:    West  "
+    N_car_flow:     North lanes' open connections in the current phase
+    S_car_flow:     South "
+    E_car_flow:     East  "
+    W_car_flow:     West  "
+    yellow_phase:   1 if the current phase is a yellow one
+    is_timeout:     1 if the decision is on the phase running out
+    is_inductor:    1 if the decision is on a vehicle crossing a detector
+
+followed by any of these extras asked for, which need num_inputs raised to match:
+
+    speed_ewm:      exponentially weighted mean of each step's mean detector speed, by ewm_alpha
+    window_speed:   mean positive detector speed over the last window steps
+    window_cars:    vehicles that crossed the detectors in the last window steps
+    window_queue:   vehicles over the detectors per step, averaged over the last window steps
+
+The window ones are kept in ring buffers of one column per step, with running totals that
+lose the oldest column as each step comes in, so none of them is summed over when read. The
+buffers and the ewm are only kept up when an extra needs them: with three intersections the
+arrays are so small that each numpy call costs more than the arithmetic in it.
+"""
+
+import numpy as np
+
+import phasetable
+
+INPUTS = ['num_cars', 'av_speed', 'N_dets_time', 'S_dets_time', 'E_dets_time', 'W_dets_time',
+          'N_car_flow', 'S_car_flow', 'E_car_flow', 'W_car_flow', 'yellow_phase', 'is_timeout', 'is_inductor']
+EXTRAS = ['speed_ewm', 'window_speed', 'window_cars', 'window_queue']
+
+NUM_CARS = INPUTS.index('num_cars')
+AV_SPEED = INPUTS.index('av_speed')
+DETS_TIME = INPUTS.index('N_dets_time')
+CAR_FLOW = INPUTS.index('N_car_flow')
+YELLOW_PHASE = INPUTS.index('yellow_phase')
+IS_TIMEOUT = INPUTS.index('is_timeout')
+IS_INDUCTOR = INPUTS.index('is_inductor')
+
+# columns of the window ring buffers and their totals, the ones add_readings fills first
+SPEED_SUM, SPEED_COUNT, QUEUE, CARS = range(4)
+
+
+class FeatureStore(object):
+    def __init__(self, intersections, extras=(), window=60, ewm_alpha=0.1):
+        super(FeatureStore, self).__init__()
+        for extra in extras:
+            if extra not in EXTRAS:
+                raise ValueError('unknown feature {!r}, expected one of {}'.format(extra, EXTRAS))
+        self.intersections = list(intersections)
+        self.index = {}
+        for i, intersection in enumerate(self.intersections):
+            self.index[intersection] = i
+        self.extras = list(extras)
+        self.window = window
+        self.ewm_alpha = ewm_alpha
+        # which of the extra bookkeeping add_readings has to do
+        self.windowed = any(extra.startswith('window_') for extra in self.extras)
+        self.ewm = 'speed_ewm' in self.extras
+        n = len(self.intersections)
+
+        # each intersection's row of network inputs, filled in as the run goes
+        self.inputs = np.zeros((n, len(INPUTS) + len(self.extras)))
+        self.speed_sum = np.zeros(n)
+        self.speed_count = np.zeros(n, dtype=np.int64)
+        self.speed_ewm = np.zeros(n)
+        self.ewm_started = np.zeros(n, dtype=bool)
+        # (intersection, step in the window, column) and the totals over the window
+        self.ring = np.zeros((n, window, 4))
+        self.totals = np.zeros((n, 4))
+        self.slot = 0
+        # steps the window holds so far, up to window
+        self.filled = 0
+
+    def __len__(self):
+        return len(self.inputs[0])
+
+    def begin_step(self, step):
+        """makes room in the window for step's readings, dropping the oldest"""
+        if not self.windowed:
+            return
+        self.slot = step % self.window
+        self.totals -= self.ring[:, self.slot]
+        self.ring[:, self.slot] = 0
+        self.filled = min(self.filled + 1, self.window)
+
+    def add_readings(self, rows, speeds, vehicles=None):
+        """
+        one step of detector readings: speeds[k] and vehicles[k] are the mean speed and number of
+        vehicles at a detector of intersection rows[k]. only positive speeds count, a detector
+        nobody crossed reads 0 or less. vehicles is only needed for the window_ extras. called
+        once a step, after begin_step
+        """
+        n = len(self.intersections)
+        positive = speeds > 0
+        counts = np.bincount(rows[positive], minlength=n)
+        # add.at goes through them in order, so av_speed is summed just like a list of them would be
+        np.add.at(self.speed_sum, rows[positive], speeds[positive])
+        self.speed_count += counts
+
+        if self.windowed or self.ewm:
+            sums = np.bincount(rows, speeds * positive, n)
+        if self.windowed:
+            column = self.ring[:, self.slot]
+            column[:, SPEED_SUM] = sums
+            column[:, SPEED_COUNT] = counts
+            column[:, QUEUE] = np.bincount(rows, vehicles, n)
+            self.totals[:, :CARS] += column[:, :CARS]
+        if self.ewm:
+            # each step's mean folds into the ewm, the first one starts it
+            seen = counts > 0
+            alpha = np.where(seen, np.where(self.ewm_started, self.ewm_alpha, 1.0), 0.0)
+            self.speed_ewm += alpha * (sums / np.maximum(counts, 1) - self.speed_ewm)
+            self.ewm_started |= seen
+
+    def add_car(self, row, direction, step):
+        """a vehicle crossing one of row's detectors, on the side direction indexes into N, S, E, W"""
+        self.inputs[row, NUM_CARS] += 1
+        self.inputs[row, DETS_TIME + direction] = step
+        if self.windowed:
+            self.ring[row, self.slot, CARS] += 1
+            self.totals[row, CARS] += 1
+
+    def row_for(self, intersection, flow, yellow, source):
+        """
+        the network inputs for a decision at intersection, with the light's current flow and
+        yellow and what woke it. the row itself is reused, so copy it to keep it
+        """
+        i = self.index[intersection]
+        row = self.inputs[i]
+        count = self.speed_count[i]
+        row[AV_SPEED] = self.speed_sum[i] / count if count else 0
+        row[CAR_FLOW:CAR_FLOW + len(phasetable.DIRECTIONS)] = flow
+        row[YELLOW_PHASE] = 1 if yellow else 0
+        row[IS_TIMEOUT] = 1 if source == 'timeout' else 0
+        row[IS_INDUCTOR] = 1 if source == 'inductor' else 0
+        for k, extra in enumerate(self.extras):
+            row[len(INPUTS) + k] = self.extra(i, extra)
+        return row
+
+    def extra(self, i, name):
+        totals = self.totals[i]
+        if name == 'speed_ewm':
+            return self.speed_ewm[i]
+        if name == 'window_speed':
+            return totals[SPEED_SUM] / totals[SPEED_COUNT] if totals[SPEED_COUNT] else 0
+        if name == 'window_cars':
+            return totals[CARS]
+        return totals[QUEUE] / self.filled if self.filled else 0
+
+    def names(self):
+        return INPUTS + self.extras
+
+    def as_dict(self, intersection):
+        """intersection's inputs as last filled in, keyed by name"""
+        return dict(zip(self.names(), self.inputs[self.index[intersection]].tolist()))
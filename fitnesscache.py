@@ -0,0 +1,87 @@
+"""Remembers the penalties of (WC, CC, EC) triplets that have already been simulated."""
+
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+
+import demand
+
+
+def genome_hash(genome):
+    """
+    hash of everything about a genome that changes the network it builds: node and connection
+    genes with their exact values. the genome key and fitness are left out, so an unchanged
+    elite carried into the next generation hashes the same as it did before
+    """
+    parts = []
+    for key in sorted(genome.nodes):
+        node = genome.nodes[key]
+        parts.append('n{}:{!r}:{!r}:{}:{}'.format(key, node.bias, node.response, node.activation, node.aggregation))
+    for key in sorted(genome.connections):
+        connection = genome.connections[key]
+        parts.append('c{}:{!r}:{}'.format(key, connection.weight, connection.enabled))
+    return hashlib.sha1(';'.join(parts).encode('utf-8')).hexdigest()
+
+
+class FitnessCache(object):
+    """
+    bounded LRU cache of penalties dicts, keyed by the genome triplet, the demand seed and
+    whatever else about the scenario changes the result.
+
+    if path is given, the cache is loaded from it on creation and written back by save(),
+    so it survives across checkpoints and restarts
+    """
+
+    def __init__(self, max_size=1000, path=None):
+        super(FitnessCache, self).__init__()
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if path != None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.entries = pickle.load(f)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def key(self, genomes, seed, scenario):
+        """genomes is a dict of intersection -> genome, scenario a dict of result-changing options"""
+        parts = ['{}={}'.format(intersection, genome_hash(genomes[intersection])) for intersection in sorted(genomes)]
+        parts.append('seed={!r}'.format(seed))
+        # the same seed gives other traffic when the way demand is drawn changes
+        parts.append('demand={}'.format(demand.FORMAT_VERSION))
+        for name in sorted(scenario):
+            parts.append('{}={!r}'.format(name, scenario[name]))
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            # hand out copies, so nobody can change what's cached
+            return dict(self.entries[key])
+        self.misses += 1
+        return None
+
+    def put(self, key, penalties):
+        self.entries[key] = dict(penalties)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        if self.path == None:
+            return
+        # write then rename, so a crash mid-write never leaves a broken cache behind
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self.entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
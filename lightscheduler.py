@@ -0,0 +1,59 @@
+"""
+When each light's controller needs to be woken, for SimulationController.run.
+
+The step loop used to look at every light's next switch on every step, to catch the ones
+switching on the next. A light's next switch only moves when the controller sets a new phase
+duration, or when sumo switches the phase itself at the end of one, so the step a light can
+next need a decision is known in advance. The scheduler keeps those steps in a heap, and due()
+hands out the lights whose step has come, so the loop only touches lights with something to
+do.
+
+Each light has at most one 'timeout' event, the check on its next switch, and scheduling a new
+one replaces the old. Any other source (say 'inductor', for a vehicle crossing a detector) is
+an event of its own, handed out as well as the light's timeout, and passed on to the
+controller as the source of the decision.
+"""
+
+import heapq
+from itertools import count
+
+
+class LightScheduler(object):
+    def __init__(self):
+        super(LightScheduler, self).__init__()
+        # (step, order, light, source)
+        self.heap = []
+        self.order = count()
+        # light -> order of its live timeout event, older ones are skipped when they come up
+        self.timeouts = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, light, step, source='timeout'):
+        order = next(self.order)
+        if source == 'timeout':
+            self.timeouts[light] = order
+        heapq.heappush(self.heap, (step, order, light, source))
+
+    def cancel(self, light):
+        """drops the light's timeout, so only other sources wake it"""
+        self.timeouts.pop(light, None)
+
+    def due(self, step):
+        """[(light, source)] of the events up to step, in the order they were scheduled"""
+        heap = self.heap
+        events = []
+        while len(heap) and heap[0][0] <= step:
+            event_step, order, light, source = heapq.heappop(heap)
+            if source == 'timeout' and self.timeouts.get(light) != order:
+                continue
+            events.append((order, light, source))
+        events.sort()
+        return [(light, source) for order, light, source in events]
+
+    def next_step(self):
+        """the step of the earliest event, or None"""
+        while len(self.heap) and self.heap[0][3] == 'timeout' and self.timeouts.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if len(self.heap) else None
@@ -1,4 +1,8 @@
 
+import os
+import atexit
+import threading
+import queue
 from enum import Enum
 
 # define level hierarchy
@@ -9,49 +13,136 @@ class Level(Enum):
     INFO = 4
     DEBUG = 5
 
+# labels for each level, padded for the file and for stdout
+FILE_LABELS = {1: 'ALL:       ', 2: 'ERROR:     ', 3: 'WARNING:   ', 4: 'INFO:      ', 5: 'DEBUG:     '}
+STDOUT_LABELS = {1: 'ALL:     ', 2: 'ERROR:   ', 3: 'WARNING: ', 4: 'INFO:    ', 5: 'DEBUG:   '}
+
+# put on the writer's queue to ask it to stop
+_STOP = None
+
+
 class Logging(object):
     """
     logging class to handle extraneous info
     can write to file or stdout
+
+    messages are format strings, formatted with any extra arguments only if some output
+    actually wants the level, so a filtered out call costs one comparison:
+
+        log.info('next duration, from {} to {}', duration, scaled)
+
+    file output goes through a background thread that writes whatever has queued up in one
+    batch, with one flush per batch. with max_bytes set the file is rotated once it
+    grows past that, keeping backup_count old files as output_file.1, output_file.2, ...
+    close() waits for everything queued to be written, and runs by itself at exit
     """
 
-    def __init__(self, stdout_level, file_level=None, output_file=None):
+    def __init__(self, stdout_level, file_level=None, output_file=None, max_bytes=0, backup_count=3):
         super(Logging, self).__init__()
         self.level = stdout_level
         self.file_level = file_level
+        self.output_path = output_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
         self.output_file = None
-        if output_file != None:
+        if output_file == None or file_level == None:
+            # nothing to write to, so no level goes to the file
+            self.file_level = 0
+        else:
             self.output_file = open(output_file, 'w')
 
-    def close():
-        self.output_file.close()
+        # highest level anything wants, the only check a filtered out message pays for
+        self.max_level = max(self.level, self.file_level)
+
+        self.queue = None
+        self.writer = None
+        self.writer_pid = None
+        self.written = 0
+
+    def enabled(self, level):
+        """True if messages at this level go anywhere, for guarding costly arguments"""
+        return self.max_level >= level
+
+    def close(self):
+        if self.writer != None and self.writer_pid == os.getpid():
+            self.queue.put(_STOP)
+            self.writer.join()
+        self.writer = None
+        if self.output_file != None:
+            self.output_file.close()
+            self.output_file = None
 
-    def debug(self, message):
-        if self.file_level >= 5:
-            self.output_file.write('DEBUG:     {}\n'.format(message))
-        if self.level >= 5:
-            print('DEBUG:   {}'.format(message))
-
-    def info(self, message):
-        if self.file_level >= 4:
-            self.output_file.write('INFO:      {}\n'.format(message))
-        if self.level >= 4:
-            print('INFO:    {}'.format(message))
-
-    def warning(self, message):
-        if self.file_level >= 3:
-            self.output_file.write('WARNING:   {}\n'.format(message))
-        if self.level >= 3:
-            print('WARNING: {}'.format(message))
-
-    def error(self, message):
-        if self.file_level >= 2:
-            self.output_file.write('INFO:     {}\n'.format(message))
-        if self.level >= 2:
-            print('ERROR:   {}'.format(message))
-
-    def all(self, message):
-        if self.file_level >= 1:
-            self.output_file.write('ALL:      {}\n'.format(message))
-        if self.level >= 1:
-            print('ALL:     {}'.format(message))
+    def debug(self, message, *args):
+        if self.max_level >= 5:
+            self.emit(5, message, args)
+
+    def info(self, message, *args):
+        if self.max_level >= 4:
+            self.emit(4, message, args)
+
+    def warning(self, message, *args):
+        if self.max_level >= 3:
+            self.emit(3, message, args)
+
+    def error(self, message, *args):
+        if self.max_level >= 2:
+            self.emit(2, message, args)
+
+    def all(self, message, *args):
+        if self.max_level >= 1:
+            self.emit(1, message, args)
+
+    def emit(self, level, message, args):
+        if args:
+            message = message.format(*args)
+        if self.file_level >= level and self.output_file != None:
+            self.start_writer()
+            self.queue.put(FILE_LABELS[level] + str(message) + '\n')
+        if self.level >= level:
+            print(STDOUT_LABELS[level] + str(message))
+
+    def start_writer(self):
+        # threads don't survive a fork, so a forked copy of this object starts its own writer
+        if self.writer != None and self.writer_pid == os.getpid():
+            return
+        self.queue = queue.Queue()
+        self.writer_pid = os.getpid()
+        self.writer = threading.Thread(target=self.write_loop, name='log-writer')
+        self.writer.daemon = True
+        self.writer.start()
+        # the writer is a daemon, so make sure whatever it still holds is written on exit
+        atexit.register(self.close)
+
+    def write_loop(self):
+        stopping = False
+        while not stopping:
+            lines = [self.queue.get()]
+            # take whatever else has piled up, and write it all in one go
+            while True:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in lines:
+                stopping = True
+                lines = [line for line in lines if line is not _STOP]
+            if lines:
+                self.write(''.join(lines))
+
+    def write(self, text):
+        self.output_file.write(text)
+        self.output_file.flush()
+        self.written += len(text)
+        if self.max_bytes > 0 and self.written >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.output_file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            older = '{}.{}'.format(self.output_path, i)
+            if os.path.exists(older):
+                os.replace(older, '{}.{}'.format(self.output_path, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.output_path, self.output_path + '.1')
+        self.output_file = open(self.output_path, 'w')
+        self.written = 0
@@ -0,0 +1,186 @@
+"""
+K disjoint copies of the corridor in one sumo network, so one sumo process and one step loop
+score K triplets at once.
+
+Copy k has every id of the original (edges, lanes, junctions, lights, routes, detectors)
+prefixed with 'c<k>.', so its lights are c0.WC, c0.CC, c0.EC, and so on. That prefix is all
+the controller sees: detector ids still start with the intersection they belong to, and
+getNextTLS answers with the prefixed light. The copies are laid out side by side, with some
+space between them, and share no edges, so traffic in one never meets traffic in another.
+
+Every copy gets the same vehicles with the same speed factors (see demand.py), but not the same
+scores: sumo draws the drivers' dawdling from random generators it hands out per lane, so what
+a triplet scores depends on which copy it's in and how many copies there are. run.py doesn't
+batch for that reason, batches are for experimenting with through evaluation.evaluate_batch.
+
+build() writes the net, route, additional and config files into a directory and returns their
+paths, regenerating them only when the originals have changed.
+"""
+
+import os
+import copy
+import xml.etree.ElementTree as ElementTree
+
+# attributes holding a single id, and ones holding a space separated list of ids, per element
+ID_ATTRIBUTES = {
+    'edge': ['id', 'from', 'to'],
+    'lane': ['id'],
+    'junction': ['id'],
+    'connection': ['from', 'to', 'via', 'tl'],
+    'tlLogic': ['id'],
+    'route': ['id'],
+    'e1Detector': ['id', 'lane'],
+}
+LIST_ATTRIBUTES = {
+    'junction': ['incLanes', 'intLanes'],
+    'roundabout': ['nodes', 'edges'],
+    'route': ['edges'],
+}
+
+# metres between one copy and the next
+GAP = 200.0
+
+
+def copy_prefix(k):
+    return 'c{}.'.format(k)
+
+
+def copy_of(name):
+    """(k, original id) of a prefixed id, or (None, name) for one that isn't"""
+    if name.startswith('c') and '.' in name:
+        head, rest = name.split('.', 1)
+        if head[1:].isdigit():
+            return int(head[1:]), rest
+    return None, name
+
+
+def intersections(base, copies):
+    """the ids of the base network's intersections in every copy, in copy order"""
+    if copies <= 1:
+        return list(base)
+    return [copy_prefix(k) + intersection for k in range(copies) for intersection in base]
+
+
+def prefixed(name, prefix):
+    # internal ids start with a colon, which has to stay in front
+    if name.startswith(':'):
+        return ':' + prefix + name[1:]
+    return prefix + name
+
+
+def shift(shape, dy):
+    points = []
+    for point in shape.split():
+        values = point.split(',')
+        values[1] = '{:.2f}'.format(float(values[1]) + dy)
+        points.append(','.join(values))
+    return ' '.join(points)
+
+
+def rename(element, prefix, dy=0.0):
+    """prefixes the ids in element and everything under it, and moves shapes dy metres north"""
+    for child in element.iter():
+        for name in ID_ATTRIBUTES.get(child.tag, []):
+            if child.get(name) != None:
+                child.set(name, prefixed(child.get(name), prefix))
+        for name in LIST_ATTRIBUTES.get(child.tag, []):
+            if child.get(name) != None:
+                child.set(name, ' '.join(prefixed(part, prefix) for part in child.get(name).split()))
+        if dy != 0.0:
+            if child.get('shape') != None:
+                child.set('shape', shift(child.get('shape'), dy))
+            if child.get('y') != None:
+                child.set('y', '{:.2f}'.format(float(child.get('y')) + dy))
+
+
+def replicate(root, copies, dy=0.0, skip=()):
+    """
+    a new root element with copies of root's children, renamed for each copy. children
+    tagged with something in skip are only kept once, unchanged
+    """
+    replicated = ElementTree.Element(root.tag, root.attrib)
+    # each element's copies go where it was, since sumo wants edges before the junctions and
+    # connections that refer to them, and so on
+    for child in root:
+        if child.tag in skip:
+            replicated.append(copy.deepcopy(child))
+            continue
+        for k in range(copies):
+            duplicate = copy.deepcopy(child)
+            rename(duplicate, copy_prefix(k), k * dy)
+            replicated.append(duplicate)
+    return replicated
+
+
+def build(copies, config_dir='.', output_dir='multicorridor', net_file='corridor.net.xml',
+          route_file='corridor.rou.xml', additional_file='corridor.add.xml'):
+    """
+    writes the files for copies copies of the corridor. returns their paths, as a dict with
+    'sumocfg', 'net', 'rou' and 'add'
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    name = 'corridor_x{}'.format(copies)
+    paths = dict((kind, os.path.join(output_dir, '{}.{}.xml'.format(name, kind))) for kind in ['net', 'rou', 'add'])
+    config_path = paths['sumocfg'] = os.path.join(output_dir, name + '.sumocfg')
+    sources = [os.path.join(config_dir, f) for f in [net_file, route_file, additional_file]]
+    # the config goes last, so if it's there and newer than the originals, so is the rest
+    if os.path.exists(config_path) and os.path.getmtime(config_path) >= max(os.path.getmtime(f) for f in sources):
+        return paths
+
+    net = ElementTree.parse(sources[0]).getroot()
+    location = net.find('location')
+    left, bottom, right, top = [float(v) for v in location.get('convBoundary').split(',')]
+    dy = top - bottom + GAP
+    net = replicate(net, copies, dy, skip=['location'])
+    net.find('location').set('convBoundary', '{:.2f},{:.2f},{:.2f},{:.2f}'.format(left, bottom, right, top + (copies - 1) * dy))
+
+    routes = replicate(ElementTree.parse(sources[1]).getroot(), copies)
+
+    additional = replicate(ElementTree.parse(sources[2]).getroot(), copies)
+    # detector output files are relative to the additional file, and need keeping apart
+    for detector in additional.iter('e1Detector'):
+        k, original = copy_of(detector.get('id'))
+        directory, filename = os.path.split(os.path.join(config_dir, detector.get('file')))
+        target = os.path.join(directory, copy_prefix(k) + filename)
+        detector.set('file', os.path.relpath(target, output_dir))
+
+    for kind, root in [('net', net), ('rou', routes), ('add', additional)]:
+        ElementTree.ElementTree(root).write(paths[kind], encoding='UTF-8', xml_declaration=True)
+
+    configuration = ElementTree.Element('configuration')
+    inputs = ElementTree.SubElement(configuration, 'input')
+    for option, kind in [('net-file', 'net'), ('route-files', 'rou'), ('additional-files', 'add')]:
+        ElementTree.SubElement(inputs, option, value=os.path.basename(paths[kind]))
+    # the same settings as corridor.sumocfg
+    ElementTree.SubElement(configuration, 'step-length', value='1')
+    ElementTree.SubElement(configuration, 'time-to-teleport', value='1000')
+    ElementTree.ElementTree(configuration).write(config_path, encoding='UTF-8', xml_declaration=True)
+    return paths
+
+
+def rngs_needed(paths):
+    """
+    sumo picks a lane's random number generator by its number modulo --thread-rngs, and
+    vehicles draw from the one of the lane they're on. with at least one per lane no two
+    copies draw from the same one, so a triplet's penalties don't depend on what the others
+    in its run do. they do still depend on which copy it's in, as each has its own generators
+    """
+    return len(list(ElementTree.parse(paths['net']).getroot().iter('lane')))
+
+
+def merge_networks(networks_list):
+    """one networks dict keyed by prefixed light, from a list of per-copy dicts"""
+    networks = {}
+    for k, nets in enumerate(networks_list):
+        for intersection in nets:
+            networks[copy_prefix(k) + intersection] = nets[intersection]
+    return networks
+
+
+def split_penalties(penalties, copies):
+    """a list of per-copy penalty dicts keyed by the original intersections"""
+    split = [{} for k in range(copies)]
+    for light in penalties:
+        k, intersection = copy_of(light)
+        split[k][intersection] = penalties[light]
+    return split
@@ -0,0 +1,114 @@
+"""
+Per-light phase lookup tables, worked out once from the network's controlled links and programs.
+
+rules picks how a light's phases are read and chosen:
+
+    original:   what the controller did before the tables were derived, so old runs can be
+                reproduced: the corridor's hand-counted flows (a few of them miscounted, e.g.
+                CC phases 0 and 1), and the network's change output ignored, as the phase
+                was set to the current one plus change modulo the number of programs, always 1
+    derived:    the flows counted from the controlled links, and the phase moved on by change
+"""
+
+import multicorridor
+
+# order of the flow vectors, named after the side of the intersection traffic arrives from,
+# same as the last letter of our detector ids
+DIRECTIONS = ['N', 'S', 'E', 'W']
+
+RULES = ['original', 'derived']
+
+# the [N, S, E, W] flows of each phase as they used to be written out in get_flow
+ORIGINAL_FLOW = {
+    'CC': [[0, 0, 3, 2], [0, 0, 0, 1], [2, 0, 1, 1], [0, 0, 1, 0]],
+    'EC': [[0, 0, 4, 4], [0, 0, 0, 0], [4, 4, 0, 0], [0, 0, 0, 0]],
+    'WC': [[0, 0, 4, 4], [0, 0, 4, 0], [1, 0, 4, 0], [1, 0, 0, 0],
+           [4, 4, 0, 0], [0, 1, 0, 0], [0, 1, 0, 4], [0, 0, 0, 4]],
+}
+
+
+def approach_direction(shape):
+    """
+    side of the intersection a lane arrives from, judged from the last segment of its shape.
+    a lane heading east comes in from the west, and so on
+    """
+    (x0, y0), (x1, y1) = shape[-2], shape[-1]
+    dx = x1 - x0
+    dy = y1 - y0
+    if abs(dx) >= abs(dy):
+        return 'W' if dx > 0 else 'E'
+    return 'S' if dy > 0 else 'N'
+
+
+class PhaseTable(object):
+    """
+    everything get_params_for and light_trigger need to know about a light's phases,
+    indexed by light id and then phase number:
+
+        phase_count:    number of phases in the light's program
+        yellow:         True/False if the phase is a 'yellow' phase
+        flow:           [N, S, E, W] number of connections with a green ('G' or 'g')
+                        from each side of the intersection during the phase, or the
+                        original ones under the original rules
+
+    build it with PhaseTable.build once the network is loaded, after that it is pure lookups
+    """
+
+    def __init__(self, rules='original'):
+        super(PhaseTable, self).__init__()
+        if rules not in RULES:
+            raise ValueError('unknown phase rules {!r}, expected one of {}'.format(rules, RULES))
+        self.rules = rules
+        self.phase_count = {}
+        self.yellow = {}
+        self.flow = {}
+
+    @classmethod
+    def build(cls, traci, lights, rules='original'):
+        table = cls(rules)
+        lane_directions = {}
+        for light in lights:
+            # which side each link index of the state string comes in from
+            link_directions = []
+            for links in traci.trafficlight.getControlledLinks(light):
+                direction = None
+                if len(links) != 0:
+                    in_lane = links[0][0]
+                    if in_lane not in lane_directions:
+                        lane_directions[in_lane] = approach_direction(traci.lane.getShape(in_lane))
+                    direction = lane_directions[in_lane]
+                link_directions.append(direction)
+
+            program = traci.trafficlight.getProgram(light)
+            logics = traci.trafficlight.getCompleteRedYellowGreenDefinition(light)
+            logic = logics[0]
+            for candidate in logics:
+                if candidate.programID == program:
+                    logic = candidate
+
+            table.add(light, [phase.state for phase in logic.phases], link_directions)
+            if rules == 'original':
+                # copies of the corridor share the original's flows
+                name = multicorridor.copy_of(light)[1]
+                if name not in ORIGINAL_FLOW or len(ORIGINAL_FLOW[name]) != table.phase_count[light]:
+                    raise ValueError("the original phase rules only know the corridor's lights, not {}".format(light))
+                table.flow[light] = [list(flow) for flow in ORIGINAL_FLOW[name]]
+        return table
+
+    def next_phase(self, light, phase, change):
+        """the phase a decision of change at phase moves light to"""
+        if self.rules == 'original':
+            return phase
+        return (phase + change) % self.phase_count[light]
+
+    def add(self, light, states, link_directions):
+        self.phase_count[light] = len(states)
+        self.yellow[light] = []
+        self.flow[light] = []
+        for state in states:
+            self.yellow[light].append('y' in state)
+            flow = [0, 0, 0, 0]
+            for signal, direction in zip(state, link_directions):
+                if direction != None and signal in 'Gg':
+                    flow[DIRECTIONS.index(direction)] += 1
+            self.flow[light].append(flow)
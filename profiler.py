@@ -0,0 +1,234 @@
+"""
+Optional instrumentation for SimulationController.
+
+Hand a Profiler to the controller (profiler=...) and every evaluation records:
+
+    phases:         time spent in each part of the step loop (insert, simulation_step, collect,
+                    vehicle_scan, emergency_stops, detectors, light_triggers), plus setup and finish
+    calls:          traci calls by domain and method, with their time, and the phase they came from
+    activation:     latency histogram of the network activations in get_duration
+
+Without one the controller only pays for a few None checks per step.
+
+Results are written as json (per evaluation and totals) and in the collapsed stack format
+flame graph tools read, one `frame;frame;frame microseconds` line per stack.
+"""
+
+import json
+import time
+from collections import OrderedDict
+
+
+def _bucket(microseconds):
+    """histogram bucket of a latency: bucket b holds latencies under 2**b microseconds"""
+    return int(microseconds).bit_length()
+
+
+class _Counts(object):
+    """what one evaluation, or all of them together, added up to"""
+
+    def __init__(self):
+        super(_Counts, self).__init__()
+        self.steps = 0
+        self.seconds = 0.0
+        self.phases = OrderedDict()
+        # (phase, 'domain.method') -> [calls, seconds]
+        self.calls = OrderedDict()
+        self.activations = 0
+        self.activation_seconds = 0.0
+        self.activation_max = 0.0
+        # phase -> activation seconds spent inside it
+        self.activation_phases = OrderedDict()
+        self.histogram = {}
+
+    def merge(self, other):
+        self.steps += other.steps
+        self.seconds += other.seconds
+        for phase in other.phases:
+            self.phases[phase] = self.phases.get(phase, 0.0) + other.phases[phase]
+        for key in other.calls:
+            calls = self.calls.setdefault(key, [0, 0.0])
+            calls[0] += other.calls[key][0]
+            calls[1] += other.calls[key][1]
+        self.activations += other.activations
+        self.activation_seconds += other.activation_seconds
+        self.activation_max = max(self.activation_max, other.activation_max)
+        for phase in other.activation_phases:
+            self.activation_phases[phase] = self.activation_phases.get(phase, 0.0) + other.activation_phases[phase]
+        for bucket in other.histogram:
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + other.histogram[bucket]
+
+    def summary(self):
+        calls_by_method = OrderedDict()
+        for (phase, method), (count, seconds) in self.calls.items():
+            totals = calls_by_method.setdefault(method, {'calls': 0, 'seconds': 0.0})
+            totals['calls'] += count
+            totals['seconds'] += seconds
+        total_calls = sum(totals['calls'] for totals in calls_by_method.values())
+        return {
+            'steps': self.steps,
+            'seconds': self.seconds,
+            'us_per_step': 1e6 * self.seconds / self.steps if self.steps else 0.0,
+            'phases': dict(self.phases),
+            'traci_calls': total_calls,
+            'traci_calls_per_step': total_calls / self.steps if self.steps else 0.0,
+            'calls_by_method': calls_by_method,
+            'activation': {
+                'count': self.activations,
+                'mean_us': 1e6 * self.activation_seconds / self.activations if self.activations else 0.0,
+                'max_us': 1e6 * self.activation_max,
+                # 'under_<n>us': activations that took less than n microseconds (and at least n/2)
+                'histogram': OrderedDict(('under_{}us'.format(2 ** bucket), self.histogram[bucket]) for bucket in sorted(self.histogram)),
+            },
+        }
+
+
+class Profiler(object):
+    """
+    collects timings from the controller. the controller marks where each phase starts with
+    phase(name) and where a step ends with end_step(); wrap(traci) returns a proxy that
+    counts and times every call going through it
+    """
+
+    def __init__(self, path=None):
+        super(Profiler, self).__init__()
+        # where save() writes, as path.json and path.folded
+        self.path = path
+        self.evaluations = []
+        self.totals = _Counts()
+        self.current = _Counts()
+        self.current_phase = None
+        self.phase_start = None
+        self.evaluation_start = None
+
+    def wrap(self, traci):
+        return CountingTraci(traci, self)
+
+    # evaluations
+
+    def begin_evaluation(self):
+        self.current = _Counts()
+        self.evaluation_start = time.perf_counter()
+        self.phase('setup')
+
+    def end_evaluation(self, label=None):
+        self.end_step(count=False)
+        self.current.seconds = time.perf_counter() - self.evaluation_start
+        self.totals.merge(self.current)
+        summary = self.current.summary()
+        summary['label'] = label
+        self.evaluations.append(summary)
+        return summary
+
+    # phases
+
+    def phase(self, name):
+        now = time.perf_counter()
+        if self.current_phase != None:
+            self.current.phases[self.current_phase] = self.current.phases.get(self.current_phase, 0.0) + now - self.phase_start
+        self.current_phase = name
+        self.phase_start = now
+
+    def end_step(self, count=True):
+        self.phase(None)
+        if count:
+            self.current.steps += 1
+
+    # counters
+
+    def count_call(self, method, seconds):
+        calls = self.current.calls.get((self.current_phase, method))
+        if calls == None:
+            calls = self.current.calls[(self.current_phase, method)] = [0, 0.0]
+        calls[0] += 1
+        calls[1] += seconds
+
+    def count_activation(self, seconds):
+        current = self.current
+        current.activations += 1
+        current.activation_seconds += seconds
+        if seconds > current.activation_max:
+            current.activation_max = seconds
+        current.activation_phases[self.current_phase] = current.activation_phases.get(self.current_phase, 0.0) + seconds
+        bucket = _bucket(1e6 * seconds)
+        current.histogram[bucket] = current.histogram.get(bucket, 0) + 1
+
+    # export
+
+    def report(self):
+        return {'evaluations': self.evaluations, 'totals': self.totals.summary()}
+
+    def collapsed_stacks(self):
+        """
+        lines of 'evaluate;<phase>;<child> microseconds'. a phase's own line only has the time
+        not already in its traci calls and activations, so the stacks add up to the wall time
+        """
+        counts = self.totals
+        children = {}
+        lines = []
+        for (phase, method), (count, seconds) in counts.calls.items():
+            children[phase] = children.get(phase, 0.0) + seconds
+            lines.append(('evaluate;{};traci.{}'.format(phase, method), seconds))
+        for phase, seconds in counts.activation_phases.items():
+            children[phase] = children.get(phase, 0.0) + seconds
+            lines.append(('evaluate;{};activate'.format(phase), seconds))
+        for phase, seconds in counts.phases.items():
+            lines.append(('evaluate;{}'.format(phase), max(seconds - children.get(phase, 0.0), 0.0)))
+        return ['{} {}'.format(stack, int(round(1e6 * seconds))) for stack, seconds in lines]
+
+    def save(self, path=None):
+        path = path or self.path
+        if path == None:
+            return
+        with open(path + '.json', 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        with open(path + '.folded', 'w') as f:
+            f.write('\n'.join(self.collapsed_stacks()) + '\n')
+
+
+class CountingTraci(object):
+    """
+    stands in for the traci (or libsumo) module, passing every call through to it while
+    counting and timing it under 'domain.method'
+    """
+
+    def __init__(self, module, profiler):
+        super(CountingTraci, self).__init__()
+        self._module = module
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._module, name)
+        # libsumo's domains are classes, traci's are instances, either way not something to time
+        if callable(attribute) and not isinstance(attribute, type):
+            wrapped = _timed(attribute, name, self._profiler)
+        else:
+            wrapped = _CountingDomain(attribute, name, self._profiler)
+        # looked up once, after that it's a plain attribute
+        setattr(self, name, wrapped)
+        return wrapped
+
+
+class _CountingDomain(object):
+    def __init__(self, domain, name, profiler):
+        super(_CountingDomain, self).__init__()
+        self._domain = domain
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._domain, name)
+        if callable(attribute):
+            attribute = _timed(attribute, '{}.{}'.format(self._name, name), self._profiler)
+        setattr(self, name, attribute)
+        return attribute
+
+
+def _timed(function, method, profiler):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.count_call(method, time.perf_counter() - start)
+    return timed
@@ -0,0 +1,177 @@
+"""
+Early termination of evaluations that can't keep up, for SimulationController.run.
+
+A RacingPolicy is asynchronous successive halving over simulation steps. Runs are checked at
+rungs, by default at first_rung steps and every eta times as many after that (100, 200, 400,
+800 for 1200 steps). At each rung the policy remembers the total penalty of every run that got
+that far. A run that isn't in the best 1/eta of those is stopped there, and its penalties are
+filled in for the steps it didn't run: the penalties so far scaled up to the full run, but
+never above the worst complete run seen at each intersection, and never adding up to more
+than the rung's cutoff.
+
+Scaling up alone isn't a fair guess: vehicles wait longer as a run goes on, so the penalty per
+step grows, and a stopped run also misses the penalties charged for the vehicles still on the
+road at the end. Extrapolated, stopped runs came out ahead of most runs that finished. So a
+stopped run only ever ranks behind the finished ones, and behind_finished() makes sure of that
+for a whole generation too, including finished runs the policy didn't see (another worker's,
+or ones finished after the run was stopped).
+
+The comparison only starts once min_samples runs have reached a rung, so the first few of a
+generation always go the distance. Call new_generation() between generations to race each one
+on its own. In worker processes every worker races the runs it sees itself.
+"""
+
+import math
+from collections import OrderedDict
+
+
+class RacedPenalties(dict):
+    """penalties of a run that was stopped early, with the step it stopped at"""
+
+    def __init__(self, penalties, stopped_at):
+        super(RacedPenalties, self).__init__(penalties)
+        self.stopped_at = stopped_at
+
+    def __reduce__(self):
+        # dict subclasses don't pickle their attributes through pool.map otherwise
+        return (RacedPenalties, (dict(self), self.stopped_at))
+
+
+def was_stopped(penalties):
+    return isinstance(penalties, RacedPenalties)
+
+
+class RacingPolicy(object):
+    def __init__(self, steps=1200, first_rung=100, eta=2, min_samples=4, rungs=None, window=None):
+        super(RacingPolicy, self).__init__()
+        if eta < 2:
+            raise ValueError('eta must be at least 2')
+        self.steps = steps
+        self.eta = eta
+        self.min_samples = min_samples
+        # with no generations to mark, only keep this many runs per rung
+        self.window = window
+        if rungs == None:
+            rungs = []
+            rung = first_rung
+            while rung < steps:
+                rungs.append(rung)
+                rung *= eta
+        self.rungs = sorted(rungs)
+        self.new_generation()
+
+        self.evaluations = 0
+        self.stopped = 0
+        self.steps_run = 0
+        self.stopped_by_rung = OrderedDict((rung, 0) for rung in self.rungs)
+
+    def __repr__(self):
+        return 'RacingPolicy(steps={}, rungs={}, eta={}, min_samples={})'.format(
+            self.steps, self.rungs, self.eta, self.min_samples)
+
+    def new_generation(self):
+        # rung -> totals of the runs that reached it
+        self.reached = dict((rung, []) for rung in self.rungs)
+        # intersection -> worst penalty of a complete run
+        self.worst_complete = {}
+
+    def is_rung(self, step):
+        return step in self.reached
+
+    def threshold(self, rung):
+        """the total a run needs at this rung to carry on, None while too few have got here"""
+        totals = self.reached[rung]
+        if len(totals) < self.min_samples:
+            return None
+        keep = int(math.ceil(len(totals) / float(self.eta)))
+        return sorted(totals, reverse=True)[keep - 1]
+
+    def check(self, step, penalties):
+        """
+        called by the controller at each rung. returns None to carry on, or the penalties
+        to finish the run with
+        """
+        total = sum(penalties.values())
+        totals = self.reached[step]
+        totals.append(total)
+        if self.window != None and len(totals) > self.window:
+            del totals[0]
+        threshold = self.threshold(step)
+        if threshold == None or total >= threshold:
+            return None
+
+        self.stopped_by_rung[step] += 1
+        self.finish(step)
+        self.stopped += 1
+        return RacedPenalties(self.filled(step, penalties, threshold), step)
+
+    def filled(self, step, penalties, cutoff):
+        scale = self.steps / float(step)
+        result = {}
+        for intersection in penalties:
+            result[intersection] = int(round(penalties[intersection] * scale))
+            worst = self.worst_complete.get(intersection)
+            if worst != None:
+                result[intersection] = min(result[intersection], worst - 1)
+        # whatever the total is over the cutoff is shared out in proportion to each
+        # intersection's projected penalty, evenly if none has any, as each one's own fitness
+        over = sum(result.values()) - (cutoff - 1)
+        if over > 0 and len(result):
+            total = sum(result.values())
+            shares = {}
+            for intersection in result:
+                share = result[intersection] / float(total) if total < 0 else 1.0 / len(result)
+                shares[intersection] = int(math.ceil(over * share))
+            for intersection in result:
+                result[intersection] -= shares[intersection]
+        return result
+
+    def complete(self, penalties):
+        """called with the penalties of a run that went the distance"""
+        self.finish(self.steps)
+        for intersection in penalties:
+            worst = self.worst_complete.get(intersection)
+            if worst == None or penalties[intersection] < worst:
+                self.worst_complete[intersection] = penalties[intersection]
+
+    def finish(self, steps_run):
+        self.evaluations += 1
+        self.steps_run += steps_run
+
+    def stats(self):
+        full = self.evaluations * self.steps
+        return {'evaluations': self.evaluations, 'stopped': self.stopped,
+                'stopped_by_rung': dict(self.stopped_by_rung), 'steps_run': self.steps_run,
+                'steps_saved': full - self.steps_run,
+                'saved_fraction': (full - self.steps_run) / float(full) if full else 0.0}
+
+    def summary(self):
+        stats = self.stats()
+        return 'racing: {} of {} runs stopped early, {} of {} steps saved ({:.0%})'.format(
+            stats['stopped'], stats['evaluations'], stats['steps_saved'],
+            stats['steps_saved'] + stats['steps_run'], stats['saved_fraction'])
+
+
+def behind_finished(results):
+    """
+    results, a list of penalties dicts, with every stopped run's penalties shifted to sit just
+    below the worst finished run at each intersection, keeping the stopped runs' own order
+    """
+    finished = [penalties for penalties in results if penalties is not None and not was_stopped(penalties)]
+    stopped = [i for i, penalties in enumerate(results) if penalties is not None and was_stopped(penalties)]
+    if not len(finished) or not len(stopped):
+        return results
+    results = list(results)
+    shifted = dict((i, dict(results[i])) for i in stopped)
+    for intersection in results[stopped[0]]:
+        scores = [penalties[intersection] for penalties in finished if penalties.get(intersection) is not None]
+        if not len(scores):
+            continue
+        best_stopped = max(results[i][intersection] for i in stopped)
+        over = best_stopped - (min(scores) - 1)
+        if over > 0:
+            for i in stopped:
+                shifted[i][intersection] -= over
+    for i in stopped:
+        results[i] = RacedPenalties(shifted[i], results[i].stopped_at)
+    return results
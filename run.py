@@ -6,6 +6,17 @@ import optparse
 import neat
 import custompopulation
 import simulationcontroller
+import evaluation
+import fitnesscache
+import profiler
+import featurestore
+import racing
+import distributed
+import demand
+import checkpointer
+import discovery
+import speciation
+import scenarios
 import logging
 
 
@@ -24,51 +35,123 @@ import traci
 
 log = logging.Logging(logging.Level.WARNING.value, logging.Level.DEBUG.value, "experiment_output")
 
+# extra SimulationController arguments picked from the command line options
+sim_options = {}
+
+# remembers the penalties of triplets already simulated, if turned on from the command line
+fitness_cache = None
+
+# runs every triplet on several demand scenarios, if turned on
+scenario_set = None
+
 def get_options():
     opt_parser = optparse.OptionParser()
     opt_parser.add_option("--nogui", action="store_true",
                          default=False, help="run the commandline version of sumo")
+    opt_parser.add_option("--workers", type="int", default=0,
+                         help="number of worker processes to evaluate triplets in parallel (0 runs them serially)")
+    opt_parser.add_option("--collection", type="choice", choices=["subscription", "poll"], default="subscription",
+                         help="how the simulation loop gathers its per-step data from traci")
+    opt_parser.add_option("--phase-rules", type="choice", choices=["original", "derived"], default="original",
+                         help="read the lights' flows from the original hand-counted tables and ignore the networks' change output (original), or count the flows from the network and act on change (derived), see phasetable.py")
+    opt_parser.add_option("--backend", type="choice", choices=["auto", "libsumo", "traci", "pool"], default="auto",
+                         help="drive sumo in-process through libsumo (auto uses it when available and no gui is needed), over traci, or over traci to sumos started ahead of time (pool)")
+    opt_parser.add_option("--pool-size", type="int", default=2,
+                         help="with --backend pool, sumos each process keeps started and waiting")
+    opt_parser.add_option("--pool-max-uses", type="int", default=20,
+                         help="with --backend pool, runs a sumo is reloaded for before it's replaced by a new one")
+    opt_parser.add_option("--warm-start", action="store_true", default=False,
+                         help="keep one sumo alive per process and reset it from a saved state between evaluations")
+    opt_parser.add_option("--warmup-steps", type="int", default=0,
+                         help="with --warm-start, steps of shared demand to run before the state is saved")
+    opt_parser.add_option("--seed", type="int", default=1234,
+                         help="seed for the generated demand")
+    opt_parser.add_option("--insertion", type="choice", choices=simulationcontroller.INSERTIONS, default="traci",
+                         help="add each vehicle over traci, or have sumo read them from a cached route file")
+    opt_parser.add_option("--demand-cache", default="demand_cache",
+                         help="directory the generated route files are kept in")
+    opt_parser.add_option("--demand-interval", type="int", default=20,
+                         help="steps between batches of new vehicles")
+    opt_parser.add_option("--cars-per-batch", default="10,40", metavar="MIN,MAX",
+                         help="smallest and largest number of vehicles in a batch")
+    opt_parser.add_option("--route-probabilities", default="0.35,0.35",
+                         help="chance of a vehicle taking route_0, route_1, ..., the rest take one of the other routes at random")
+    opt_parser.add_option("--scenario-seeds", default=None, metavar="SEED,SEED,...",
+                         help="run every triplet on the demand from each of these seeds, the same ones for the whole generation")
+    opt_parser.add_option("--demand-levels", default="1.0", metavar="LEVEL,LEVEL,...",
+                         help="with --scenario-seeds, also run each seed with the vehicles per batch scaled by each of these")
+    opt_parser.add_option("--scenario-statistic", type="choice", choices=scenarios.STATISTICS, default="mean",
+                         help="with --scenario-seeds, how the penalties of the scenarios are combined: mean, worst or cvar")
+    opt_parser.add_option("--cvar-alpha", type="float", default=0.2,
+                         help="with --scenario-statistic cvar, the fraction of worst scenarios averaged")
+    opt_parser.add_option("--resample-seeds", action="store_true", default=False,
+                         help="with --scenario-seeds, draw as many new seeds for every generation instead")
+    opt_parser.add_option("--scenario-results", default=None, metavar="PATH",
+                         help="with --scenario-seeds, append each triplet's penalties on each scenario to PATH as json lines")
+    opt_parser.add_option("--fitness-cache", type="int", default=0,
+                         help="remember the penalties of up to this many triplets, so repeats aren't re-simulated (0 turns it off)")
+    opt_parser.add_option("--fitness-cache-file", default=None,
+                         help="with --fitness-cache, keep the cache in this file between runs")
+    opt_parser.add_option("--checkpoint-dir", default="checkpoints",
+                         help="directory to keep the population checkpoints in")
+    opt_parser.add_option("--checkpoint-every", type="int", default=1,
+                         help="generations between checkpoints (0 turns them off)")
+    opt_parser.add_option("--full-checkpoint-every", type="int", default=10,
+                         help="checkpoints between full ones, the rest only store the genomes that are new")
+    opt_parser.add_option("--resume", action="store_true", default=False,
+                         help="carry on from the latest checkpoint in --checkpoint-dir")
+    opt_parser.add_option("--log-max-bytes", type="int", default=0,
+                         help="rotate the log file once it grows past this many bytes (0 never rotates)")
+    opt_parser.add_option("--profile", default=None, metavar="PATH",
+                         help="time the step loop and count traci calls, writing PATH.json and PATH.folded (flame graph input)")
+    opt_parser.add_option("--serve", type="int", default=0, metavar="PORT",
+                         help="hand triplets out to workers on other machines (distributed.py --connect HOST:PORT) instead of running them here")
+    opt_parser.add_option("--host", default=distributed.DEFAULT_HOST,
+                         help="with --serve, the address to listen on, e.g. 0.0.0.0 for every interface (anyone who can connect with the authkey can run code here)")
+    opt_parser.add_option("--authkey", default=None,
+                         help="with --serve, the secret workers need to connect, made up and printed if not given")
+    opt_parser.add_option("--task-timeout", type="float", default=None,
+                         help="with --serve, seconds after which a task still out is handed to another worker too")
+    opt_parser.add_option("--steps", type="int", default=1200,
+                         help="steps each simulation runs for")
+    opt_parser.add_option("--racing", action="store_true", default=False,
+                         help="stop simulations early once they fall behind the rest of the generation")
+    opt_parser.add_option("--racing-first-rung", type="int", default=100,
+                         help="with --racing, step of the first check, later ones are --racing-eta times further on")
+    opt_parser.add_option("--racing-eta", type="int", default=2,
+                         help="with --racing, only the best 1/eta of the runs reaching a check carry on")
+    opt_parser.add_option("--racing-min-samples", type="int", default=4,
+                         help="with --racing, runs that must reach a check before any are stopped there")
+    opt_parser.add_option("--extra-features", default=None, metavar="NAME,...",
+                         help="network inputs to add to the usual 13, from {} (num_inputs in neat_configuration has to match)".format(', '.join(featurestore.EXTRAS)))
+    opt_parser.add_option("--feature-window", type="int", default=60,
+                         help="steps the window_ extra features are taken over")
+    opt_parser.add_option("--trace", default=None, metavar="DIR",
+                         help="record every run's steps and decisions into a new directory under DIR, see tracerecorder.py")
+    opt_parser.add_option("--no-tripinfo", action="store_true", default=False,
+                         help="don't have sumo write tripinfo.xml")
     options, args = opt_parser.parse_args()
     return options
 
 
 
-def score_genomes(pop1, pop2, pop3, config, gen):
-    for i in range(max(len(pop1), len(pop2), len(pop3))):
-
-        # in the case of species stagnation, any number of members may be removed from a population
-        # so we just re-use and re-score genomes in that case, not counting their first score
-        pops = {}
-        pops['WC'] = pop1[i % len(pop1)][1]
-        pops['CC'] = pop2[i % len(pop2)][1]
-        pops['EC'] = pop3[i % len(pop3)][1]
-        nets = {'WC': None, 'CC': None, 'EC': None}
-
-        # initialise new simulation
-        sim = simulationcontroller.SimulationController(log)
-        # if gen % 10 == 0 and i == 0:
-        #     sim.start('gui')
-        # else:
-        sim.start()
-
-        for pop, net in zip(pops, nets):
-
+def score_genomes(populations, config, gen):
+    policy = sim_options.get('racing')
+    if policy != None:
+        policy.new_generation()
 
-            # initialise fitness and the networks
-            pops[pop].fitness = 0.0
-            nets[net] = neat.nn.FeedForwardNetwork.create(pops[pop], config)
-
-
-        # traci starts sumo as a subprocess and then this script connects and runs
-        # traci.start([sumoBinary, "-c", "corridor.sumocfg",
-        #                          "--tripinfo-output", "tripinfo.xml"])
-        scores = sim.run(nets)
-        for net, score in zip(nets, scores):
-            if scores[score] == None:
-                print('ERROR: Score is None, setting to -1500 to keep things running...')
-                pops[pop].fitness = -1500
-            else:
-                pops[net].fitness = scores[score]
+    # run a fresh simulation for each triplet that needs one
+    evaluate_all = lambda pending: [evaluation.evaluate_triplet(genomes, config, log, **sim_options) for genomes in pending]
+    cache = fitness_cache
+    if scenario_set != None:
+        # or one for each triplet on each scenario, which the scenario set caches itself
+        run_tasks = lambda tasks: ((task_id, evaluation.evaluate_triplet(genomes, config, log, **dict(sim_options, **overrides)))
+                                   for task_id, genomes, overrides in tasks)
+        evaluate_all = lambda pending: scenario_set.evaluate_all(pending, run_tasks, sim_options, fitness_cache, gen)
+        cache = None
+    evaluation.score_generation(populations, config, evaluate_all, cache, sim_options)
+    if policy != None:
+        print(policy.summary())
 
 
 
@@ -80,6 +163,52 @@ if __name__ == "__main__":
 
     i = 0
     options = get_options()
+    sim_options['collection'] = options.collection
+    sim_options['phase_rules'] = options.phase_rules
+    sim_options['backend'] = options.backend
+    if options.backend == 'pool':
+        if options.warm_start:
+            sys.exit("--backend pool can't be combined with --warm-start, which keeps its own sumo alive")
+        sim_options['pool_size'] = options.pool_size
+        sim_options['pool_max_uses'] = options.pool_max_uses
+    sim_options['warm_start'] = options.warm_start
+    sim_options['warmup_steps'] = options.warmup_steps
+    sim_options['seed'] = options.seed
+    sim_options['steps'] = options.steps
+    min_cars, max_cars = [int(cars) for cars in options.cars_per_batch.split(',')]
+    route_probabilities = [float(p) for p in options.route_probabilities.split(',')]
+    sim_options['demand'] = demand.Demand(options.seed, options.demand_interval, min_cars, max_cars, route_probabilities)
+    sim_options['insertion'] = options.insertion
+    sim_options['demand_cache'] = options.demand_cache
+    # no --copies: a triplet batched into a copy of the corridor still doesn't score what it
+    # does on its own, sumo draws the drivers' randomness per lane and each copy has lanes of
+    # its own. batches stay an experiment, through evaluation.evaluate_batch
+    if options.scenario_seeds != None:
+        if options.racing or options.serve > 0:
+            sys.exit("--scenario-seeds can't be combined with --racing or --serve")
+        seeds = [int(seed) for seed in options.scenario_seeds.split(',')]
+        levels = [float(level) for level in options.demand_levels.split(',')]
+        scenario_set = scenarios.ScenarioSet(sim_options['demand'], seeds, levels, options.scenario_statistic,
+                                             options.cvar_alpha, options.resample_seeds, options.scenario_results)
+    if options.extra_features != None:
+        sim_options['extra_features'] = options.extra_features.split(',')
+        for name in sim_options['extra_features']:
+            if name not in featurestore.EXTRAS:
+                sys.exit("unknown feature {!r}, expected one of {}".format(name, ', '.join(featurestore.EXTRAS)))
+        sim_options['feature_window'] = options.feature_window
+    if options.trace != None:
+        sim_options['trace'] = options.trace
+    if options.no_tripinfo:
+        sim_options['tripinfo'] = False
+    if options.racing:
+        sim_options['racing'] = racing.RacingPolicy(options.steps, options.racing_first_rung, options.racing_eta,
+                                                    options.racing_min_samples)
+    log.max_bytes = options.log_max_bytes
+    if options.profile != None:
+        sim_options['profiler'] = profiler.Profiler(options.profile)
+
+    if options.fitness_cache > 0:
+        fitness_cache = fitnesscache.FitnessCache(options.fitness_cache, options.fitness_cache_file)
 
     # check binary
     if options.nogui:
@@ -88,27 +217,65 @@ if __name__ == "__main__":
         sumoBinary = checkBinary('sumo-gui')
 
     config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
-                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         speciation.VectorisedSpeciesSet, neat.DefaultStagnation,
                          "neat_configuration")
+    inputs = len(featurestore.INPUTS) + len(sim_options.get('extra_features', []))
+    if config.genome_config.num_inputs != inputs:
+        sys.exit("neat_configuration has num_inputs = {}, but the networks are given {}".format(config.genome_config.num_inputs, inputs))
+
 
+    # one population per intersection the network has, see discovery.py
+    intersections = discovery.from_files('.')
+    print('evolving networks for {}'.format(', '.join(intersections)))
 
     # Add a stdout reporter to show progress in the terminal.
-    pop = custompopulation.CustomPopulation(config)
+    if options.resume:
+        pop = checkpointer.restore(options.checkpoint_dir, config, intersections)
+        print('resuming from generation {}'.format(pop.generation))
+    else:
+        pop = custompopulation.CustomPopulation(config, intersections)
     pop.add_reporter(neat.StdOutReporter(True))
     stats = neat.StatisticsReporter()
     pop.add_reporter(stats)
-    pop.add_reporter(neat.Checkpointer(5))
-
-    best = pop.run(score_genomes, 1)
+    # neat.Checkpointer only knows about a single population, this one saves all of them
+    checkpoints = None
+    if options.checkpoint_every > 0:
+        checkpoints = checkpointer.PopulationCheckpointer(pop, options.checkpoint_dir, options.checkpoint_every,
+                                                          options.full_checkpoint_every)
+        pop.add_reporter(checkpoints)
+
+    if options.serve > 0:
+        authkey = options.authkey
+        if authkey == None:
+            authkey = distributed.new_authkey()
+        print('distributed: listening on {}:{}, workers connect with --authkey {}'.format(options.host, options.serve, authkey))
+        evaluator = distributed.Coordinator(config, authkey.encode(), (options.host, options.serve), cache=fitness_cache,
+                                            task_timeout=options.task_timeout, **sim_options)
+        best = pop.run(evaluator.evaluate, 1)
+        evaluator.close()
+    elif options.workers > 0:
+        evaluator = evaluation.ParallelEvaluator(options.workers, config, cache=fitness_cache,
+                                                      scenarios=scenario_set, **sim_options)
+        best = pop.run(evaluator.evaluate, 1)
+        evaluator.close()
+    else:
+        best = pop.run(score_genomes, 1)
+        evaluation.close_simulations()
+        if options.profile != None:
+            sim_options['profiler'].save()
+    if checkpoints != None:
+        checkpoints.close()
     print(best)
 
 
-    winners = {'WC': best[0], 'CC': best[1], 'EC': best[2]}
+    winners = dict(zip(pop.intersections, best))
 
-    nets = {'WC': None, 'CC': None, 'EC': None}
+    nets = dict((intersection, None) for intersection in pop.intersections)
 
     # initialise new simulation
-    sim = simulationcontroller.SimulationController(log)
+    # the winners' run is there to be watched to the end
+    sim_options['racing'] = None
+    sim = simulationcontroller.SimulationController(log, **sim_options)
     # if gen % 10 == 0 and i == 0:
     #     sim.start('gui')
     # else:
@@ -119,7 +286,10 @@ if __name__ == "__main__":
         nets[net] = neat.nn.FeedForwardNetwork.create(winners[pop], config)
 
     scores = sim.run(nets)
+    if options.warm_start:
+        sim.close()
     print('scores:')
     print(scores)
+    log.close()
 
     # print(pop.population)
@@ -0,0 +1,154 @@
+"""
+Scoring triplets on several demand scenarios instead of one.
+
+A scenario is a demand seed and a demand level, the level scaling the number of vehicles in
+each batch of the base demand. Every triplet of a generation runs on the same scenarios
+(common random numbers), so the differences between triplets come from the triplets and not
+from the traffic they happened to get. With resample on, each generation gets a new set of
+seeds, drawn from the generation number, so the controllers can't learn a fixed set by heart
+either.
+
+A triplet's penalties on its scenarios are folded into one penalty per intersection:
+
+    mean:   the average
+    worst:  the lowest
+    cvar:   the average of the lowest alpha fraction, at least one of them
+
+evaluate_all runs the triplet and scenario pairs through whatever run_tasks it's given, in
+any order, so a pool of workers can take them as they come (see evaluation.ParallelEvaluator).
+Each result is written to results_file as a line of json as soon as it's in, if there is one.
+"""
+
+import json
+import math
+import random
+
+import evaluation
+import demand as demandmodule
+
+STATISTICS = ['mean', 'worst', 'cvar']
+
+
+class Scenario(object):
+    def __init__(self, seed, level=1.0):
+        super(Scenario, self).__init__()
+        self.seed = seed
+        self.level = level
+
+    def __repr__(self):
+        return 'Scenario(seed={!r}, level={!r})'.format(self.seed, self.level)
+
+
+class ScenarioSet(object):
+    def __init__(self, demand, seeds=(1234,), levels=(1.0,), statistic='mean', alpha=0.2, resample=False, results_file=None):
+        super(ScenarioSet, self).__init__()
+        if statistic not in STATISTICS:
+            raise ValueError('unknown statistic {!r}, expected one of {}'.format(statistic, STATISTICS))
+        # the demand every scenario is a variation of
+        self.demand = demand
+        self.seeds = list(seeds)
+        self.levels = list(levels)
+        self.statistic = statistic
+        self.alpha = alpha
+        self.resample = resample
+        self.results_file = results_file
+
+    def __repr__(self):
+        return 'ScenarioSet(seeds={!r}, levels={!r}, statistic={!r}, alpha={!r}, resample={!r})'.format(
+            self.seeds, self.levels, self.statistic, self.alpha, self.resample)
+
+    def scenarios(self, generation=0):
+        """the scenarios every triplet of this generation is run on"""
+        seeds = self.seeds
+        if self.resample:
+            rng = random.Random('{}-{}'.format(self.seeds, generation))
+            seeds = [rng.randrange(2 ** 31) for seed in self.seeds]
+        return [Scenario(seed, level) for seed in seeds for level in self.levels]
+
+    def demand_for(self, scenario):
+        base = self.demand
+        return demandmodule.Demand(scenario.seed, base.interval, int(round(base.min_cars * scenario.level)),
+                                   int(round(base.max_cars * scenario.level)), base.route_probabilities, base.other_routes)
+
+    def options(self, scenario):
+        """the sim_options that put a simulation on scenario"""
+        return {'seed': scenario.seed, 'demand': self.demand_for(scenario)}
+
+    def aggregate(self, results):
+        """one penalties dict from a triplet's penalties on each scenario"""
+        intersections = []
+        for penalties in results:
+            if penalties is not None:
+                intersections += [intersection for intersection in penalties if intersection not in intersections]
+        aggregated = {}
+        for intersection in intersections:
+            values = sorted(penalties[intersection] for penalties in results
+                            if penalties is not None and penalties.get(intersection) is not None)
+            if not len(values):
+                aggregated[intersection] = None
+            elif self.statistic == 'mean':
+                aggregated[intersection] = sum(values) / float(len(values))
+            elif self.statistic == 'worst':
+                aggregated[intersection] = values[0]
+            else:
+                tail = values[:max(1, int(math.ceil(self.alpha * len(values))))]
+                aggregated[intersection] = sum(tail) / float(len(tail))
+        return aggregated
+
+    def evaluate_all(self, triplets, run_tasks, sim_options={}, cache=None, generation=0):
+        """
+        aggregated penalties for every triplet, in order. run_tasks takes a list of
+        (task id, genomes, sim_options) and yields (task id, penalties) as each one finishes,
+        where the sim_options go on top of the usual ones. results are cached per triplet and
+        scenario
+        """
+        scenarios = self.scenarios(generation)
+        results = [[None] * len(scenarios) for genomes in triplets]
+        # triplet and scenario -> the (triplet, scenario) index pairs waiting on it
+        waiting = {}
+        tasks = []
+        keys = {}
+        # scenario by scenario, so workers keeping a warm simulation can mostly stay on one
+        for j, scenario in enumerate(scenarios):
+            overrides = self.options(scenario)
+            options = dict(sim_options, **overrides)
+            for i, genomes in enumerate(triplets):
+                # triplets are reused when a population runs short, those only run once
+                identity = (tuple(sorted((intersection, genomes[intersection].key) for intersection in genomes)), j)
+                if identity in waiting:
+                    waiting[identity].append((i, j))
+                    continue
+                waiting[identity] = [(i, j)]
+                if cache is not None:
+                    keys[identity] = cache.key(genomes, scenario.seed, evaluation.scenario_of(options))
+                    cached = cache.get(keys[identity])
+                    if cached is not None:
+                        results[i][j] = cached
+                        continue
+                tasks.append((identity, genomes, overrides))
+
+        stream = open(self.results_file, 'a') if self.results_file != None else None
+        try:
+            for identity, penalties in run_tasks(tasks):
+                for i, j in waiting[identity]:
+                    results[i][j] = penalties
+                if cache is not None and penalties is not None and None not in penalties.values():
+                    cache.put(keys[identity], penalties)
+                if stream != None:
+                    scenario = scenarios[identity[1]]
+                    stream.write(json.dumps({'generation': generation, 'triplet': dict(identity[0]), 'seed': scenario.seed,
+                                             'level': scenario.level, 'penalties': penalties}) + '\n')
+                    stream.flush()
+        finally:
+            if stream != None:
+                stream.close()
+        # duplicates of a cached triplet were skipped above along with it
+        for identity, indices in waiting.items():
+            first = indices[0]
+            for i, j in indices[1:]:
+                results[i][j] = results[first[0]][first[1]]
+        if cache is not None:
+            cache.save()
+        print('scenarios: {} triplets on {} scenarios, {} runs ({} from the cache), scored by {}'.format(
+            len(triplets), len(scenarios), len(waiting), len(waiting) - len(tasks), self.statistic))
+        return [self.aggregate(row) for row in results]
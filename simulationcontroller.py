@@ -1,340 +1,541 @@
 import os
 import sys
-import optparse
 import neat
 import random
+import time
+import math
+import copy
+import tempfile
+import importlib.util
 
 # we need to import some python modules from the $SUMO_HOME/tools directory
 if 'SUMO_HOME' in os.environ:
     tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
     sys.path.append(tools)
-else:
+elif importlib.util.find_spec('traci') is None:
+    # without it traci and sumolib have to be installed as python packages, which is
+    # enough for the benchmarks' stand-in for sumo
     sys.exit("please declare environment variable 'SUMO_HOME'")
 
 
 from sumolib import checkBinary  # Checks for the binary in environ vars
-import traci
-
-def get_options():
-    opt_parser = optparse.OptionParser()
-    opt_parser.add_option("--nogui", action="store_true",
-                         default=False, help="run the commandline version of sumo")
-    options, args = opt_parser.parse_args()
-    return options
+import datacollection
+import phasetable
+import vehicletable
+import lightscheduler
+import featurestore
+import tracerecorder
+import simulatorbackend
+import demand as demandmodule
+import multicorridor
+import discovery
+import numpy as np
+
+# how run gathers its per-step data, see datacollection.py
+COLLECTORS = {'poll': datacollection.PollingCollector, 'subscription': datacollection.SubscriptionCollector}
+
+# how the demand gets into sumo: a traci vehicle.add per car, or a route file sumo reads itself
+INSERTIONS = ['traci', 'file']
+
+# everything run changes as it goes, and so everything a warm start needs to put back
+RUN_STATE = ['features', 'penalties', 'step', 'car_number', 'vehicles']
 
 class SimulationController(object):
     """docstring for SimulationController."""
 
-    def __init__(self, log):
+    def __init__(self, log, collection='subscription', backend='auto', warm_start=False, warmup_steps=0, seed=1234, profiler=None, steps=1200, racing=None,
+                 demand=None, insertion='traci', demand_cache='demand_cache', copies=1,
+                 pool_size=2, pool_max_uses=20, extra_features=(), feature_window=60, trace=None, tripinfo=True,
+                 intersections=None, phase_rules='original'):
         super(SimulationController, self).__init__()
         self.log = log
-        # intersection parameter template:
-        # ~~~~~
-        # num_cars:     numcars that have gone through the intersection in the last phase
-        # av_speed:     average speed of cars through the intersection in the last phase
-        # N_dets_time:  North detectors' measurement of the time since a car arrived at the intersection
-        # S_dets_time:  South "
-        # E_dets_time:  East  "
-        # W_dets_time:  West  "
-        # N_car_flow:   North lanes' allowed movement, indicating the number of open connections allowed at the current time
-        # S_car_flow:   South "
-        # E_car_flow:   East  "
-        # W_car_flow:   West  "
-        # yellow_phase: True/False if this phase is a 'yellow' phase, which are typically shorter
-        # ~~~~~
-        p = {'num_cars': 0, 'av_speed' : 0, 'N_dets_time': 0,'S_dets_time': 0,'E_dets_time': 0,'W_dets_time': 0, 'N_car_flow': 0, 'S_car_flow': 0, 'E_car_flow': 0, 'W_car_flow': 0, 'yellow_phase': 0}
-        self.intersection_parameters = {'CC': p, 'EC': p, 'WC': p}
-        self.intersection_speeds = {'CC': [], 'EC': [], 'WC': []}
-
-        self.penalties = { 'CC': 0, 'EC': 0, 'WC': 0 }
-
-    def start(self, gui='nogui'):
-        options = get_options()
-
-        # check binary
-        if gui=='nogui':
-            sumoBinary = checkBinary('sumo')
+        # how long a run lasts, and the optional racing.RacingPolicy that may cut it short
+        self.steps = steps
+        self.racing = racing
+        # the lights with detectors, found from the network files in the working directory
+        # unless given, see discovery.py. with copies > 1 sumo runs that many copies of the
+        # corridor side by side, see multicorridor.py, and everything keyed by intersection
+        # uses the prefixed light ids
+        self.copies = copies
+        if intersections == None:
+            intersections = discovery.from_files()
+        self.intersections = multicorridor.intersections(intersections, copies)
+        if racing != None and copies > 1:
+            raise ValueError("racing compares whole runs, it can't be used with copies > 1")
+        # optional profiler.Profiler, timing each phase of the step loop when set
+        self.profiler = profiler
+        # seed for the demand, so every controller faces the same traffic
+        self.seed = seed
+        # a demand.Demand, by default the usual traffic drawn from seed
+        if demand == None:
+            demand = demandmodule.Demand(seed)
+        self.demand = demand
+        if insertion not in INSERTIONS:
+            raise ValueError('unknown insertion {!r}, expected one of {}'.format(insertion, INSERTIONS))
+        self.insertion = insertion
+        if insertion == 'file' and warm_start and warmup_steps > 0:
+            # sumo re-reads the route file when loading a saved state, and loses vehicles departing
+            # around the time it was saved
+            raise ValueError("insertion 'file' can't warm start from a saved state, use warmup_steps=0 or insertion 'traci'")
+        # how the lights' flows are read and their phases chosen, see phasetable.py
+        if phase_rules not in phasetable.RULES:
+            raise ValueError('unknown phase rules {!r}, expected one of {}'.format(phase_rules, phasetable.RULES))
+        self.phase_rules = phase_rules
+        # network inputs past the usual 13 and the steps the windowed ones cover, see featurestore.py
+        self.extra_features = list(extra_features)
+        self.feature_window = feature_window
+        # with a directory, every run records a trace into a new directory under it, see
+        # tracerecorder.py. tripinfo says whether sumo writes tripinfo.xml
+        self.trace = trace
+        self.tripinfo = tripinfo
+        self.recorder = None
+        # where route files for insertion 'file' are kept, see demand.py
+        self.demand_cache = demand_cache
+        self.schedule = None
+        self.collection = collection
+        # a backend name, or a ready made SimulatorBackend
+        if isinstance(backend, simulatorbackend.SimulatorBackend):
+            self.backend = backend
         else:
-            sumoBinary = checkBinary('sumo-gui')
-        traci.start([sumoBinary, "--start", "-c", "corridor.sumocfg", "--tripinfo-output", "tripinfo.xml"])
+            # pool_size and pool_max_uses only matter to backend 'pool', see sumopool.py
+            self.backend = simulatorbackend.SimulatorBackend(backend, pool_size=pool_size, pool_max_uses=pool_max_uses)
+        if self.backend.name == 'pool' and warm_start:
+            # a warm start already keeps its sumo for the next run, there's nothing for a pool to hide
+            raise ValueError("backend 'pool' can't be used with warm_start, which keeps its own sumo alive")
+        # both of these are set up by start, once we know which library sumo is driven through
+        self.traci = None
+        self.collector = None
+        self.phase_table = None
 
-    #
+        # warm start keeps one sumo alive between runs, and resets it by loading a state
+        # saved after warmup_steps of demand instead of starting and closing sumo every time
+        self.warm_start = warm_start
+        self.warmup_steps = warmup_steps
+        self.snapshot_file = None
+        self.snapshot = None
+        self.at_snapshot = False
 
-    def get_params(self):
-        for index in self.intersection_parameters:
-            speed_array = self.intersection_speeds[index]
-            av_speed = 0
-            if len(speed_array) != 0:
-                av_speed = sum(speed_array)/len(speed_array)
-            self.intersection_parameters[index]['av_speed'] = av_speed
+        self.reset()
 
+    def reset(self):
+        """clears everything a run accumulates, so the next run starts as if on a fresh controller"""
+        # what each intersection's network is given, see featurestore.py
+        self.features = featurestore.FeatureStore(self.intersections, self.extra_features, self.feature_window)
 
-            flow = self.get_flow(index)
-            self.intersection_parameters[index]['N_car_flow'] = flow[0]
-            self.intersection_parameters[index]['S_car_flow'] = flow[1]
-            self.intersection_parameters[index]['E_car_flow'] = flow[2]
-            self.intersection_parameters[index]['W_car_flow'] = flow[3]
+        self.penalties = self.no_penalties()
 
-            self.intersection_parameters[intersection]['yellow_phase'] = 0
-            if 'y' in traci.trafficlight.getRedYellowGreenState(intersection):
-                self.intersection_parameters[intersection]['yellow_phase'] = 1
+        self.step = 0
 
-        return self.intersection_parameters
+        self.car_number = 0
 
-    def get_params_for(self, intersection, source):
-        speed_array = self.intersection_speeds[intersection]
+        # per-vehicle stops and scoring, see vehicletable.py. needs the detectors, so begin_run makes it
+        self.vehicles = None
 
+        random.seed(a=self.seed) # seed for replicability
 
-        av_speed = 0
-        if len(speed_array) != 0:
-            av_speed = sum(speed_array)/len(speed_array)
-        self.intersection_parameters[intersection]['av_speed'] = av_speed
-
-        flow = self.get_flow(intersection)
-        self.intersection_parameters[intersection]['N_car_flow'] = flow[0]
-        self.intersection_parameters[intersection]['S_car_flow'] = flow[1]
-        self.intersection_parameters[intersection]['E_car_flow'] = flow[2]
-        self.intersection_parameters[intersection]['W_car_flow'] = flow[3]
-
-        self.intersection_parameters[intersection]['yellow_phase'] = 0
-        if 'y' in traci.trafficlight.getRedYellowGreenState(intersection):
-            self.intersection_parameters[intersection]['yellow_phase'] = 1
-
-
-        self.intersection_parameters[intersection]['is_timeout'] = 1 if source == 'timeout' else 0
-        self.intersection_parameters[intersection]['is_inductor'] = 1 if source == 'inductor' else 0
-        # self.intersection_parameters[intersection]['is_pedestrian'] = 1 if source == 'pedestrian' else 0
+    def no_penalties(self):
+        return dict((intersection, 0) for intersection in self.intersections)
 
+    def start(self, gui='nogui', label=None):
+        # check binary
+        if gui=='nogui':
+            sumoBinary = checkBinary('sumo')
+        else:
+            sumoBinary = checkBinary('sumo-gui')
+        config_file, route_file = "corridor.sumocfg", "corridor.rou.xml"
+        if self.copies > 1:
+            paths = multicorridor.build(self.copies)
+            config_file, route_file = paths['sumocfg'], paths['rou']
+        cmd = [sumoBinary, "--start", "-c", config_file]
+        if self.tripinfo:
+            cmd += ["--tripinfo-output", "tripinfo.xml"]
+        if self.copies > 1:
+            cmd += ["--thread-rngs", str(multicorridor.rngs_needed(paths))]
+        self.output_prefix = ''
+        if label != None:
+            # labelled connections run side by side, so keep their output files apart too
+            # (sumo prepends this to the file name of every output, detector files included)
+            self.output_prefix = label + "."
+            cmd += ["--output-prefix", self.output_prefix]
+        if self.insertion == 'file':
+            # sumo reads the vehicles along with the routes they use
+            cmd += ["--route-files", route_file + "," + self.demand.route_file(self.steps, self.demand_cache, self.copies)]
+        elif self.schedule == None:
+            self.schedule = self.demand.by_step(self.steps, self.copies)
+        if self.warm_start:
+            # keep the rng and full precision positions in the snapshot, or runs from it drift
+            cmd += ["--save-state.rng", "--save-state.precision", "6"]
+        self.sumo_args = cmd[1:]
+        self.traci = self.backend.start(cmd, gui, label)
+        if self.profiler != None:
+            self.traci = self.profiler.wrap(self.traci)
+
+        if self.warm_start:
+            self.take_snapshot()
+
+    def close(self):
+        self.backend.close()
+        if self.snapshot_file != None:
+            os.remove(self.snapshot_file)
+            self.snapshot_file = None
+
+    def take_snapshot(self):
+        """
+        runs the shared demand for warmup_steps with the lights left on their default programs,
+        then saves sumo's state along with our own run state so every later run can restart there
+        """
+        self.reset()
+        self.begin_run()
+        while self.step < self.warmup_steps:
+            self.simulate_step(None)
+        # nobody is to blame for the warm-up, every run starts with a clean sheet
+        self.penalties = self.no_penalties()
+
+        # reloading inside the running sumo is far cheaper than a new process, and the same every
+        # time, which simulation.loadState isn't: it leaks state from the previous run, and can't
+        # restore an empty network at all (vehicles inserted afterwards never move)
+        if self.warmup_steps > 0:
+            fd, self.snapshot_file = tempfile.mkstemp(prefix=self.output_prefix + 'sumo_snapshot_', suffix='.xml')
+            os.close(fd)
+            # saved states get the output prefix too, so ask for the name without it
+            directory, name = os.path.split(self.snapshot_file)
+            self.traci.simulation.saveState(os.path.join(directory, name[len(self.output_prefix):]))
+        self.snapshot = copy.deepcopy(self.run_state())
+        # a reload straight from the config is identical to where we are now, but a reload
+        # from the saved state isn't quite identical to carrying on, so that one always reloads
+        self.at_snapshot = self.snapshot_file == None
+
+    def run_state(self):
+        state = {}
+        for name in RUN_STATE:
+            state[name] = getattr(self, name)
+        state['random'] = random.getstate()
+        return state
+
+    def restore(self):
+        """puts sumo and the controller back to the snapshot taken in start"""
+        if not self.at_snapshot:
+            if self.snapshot_file != None:
+                self.traci.load(self.sumo_args + ["--load-state", self.snapshot_file])
+            else:
+                self.traci.load(self.sumo_args)
+        state = copy.deepcopy(self.snapshot)
+        for name in RUN_STATE:
+            setattr(self, name, state[name])
+        random.setstate(state['random'])
+        # reloading drops all the subscriptions, so set the collector up again
+        self.begin_run()
 
+    #
 
+    def get_params(self):
+        params = {}
+        for index in self.intersections:
+            self.collector.light_state(index)
+            phase = self.collector.phases[index]
+            self.features.row_for(index, self.get_flow(index), self.phase_table.yellow[index][phase], None)
+            params[index] = self.features.as_dict(index)
+        return params
 
-        return list(self.intersection_parameters[intersection].values())
+    def get_params_for(self, intersection, source):
+        phase = self.collector.phases[intersection]
+        row = self.features.row_for(intersection, self.get_flow(intersection), self.phase_table.yellow[intersection][phase], source)
+        # neat's networks go through the inputs in python, where floats beat numpy scalars
+        return row.tolist()
 
 
 
-    # hard coding these values for now, bigger model will need more sophisticated methods
-    # far out, if i use getControlledLinks it shows it in the traffic state thing order
+    # open connections from each side for the light's current phase, see phasetable.py
+    # returned list in format:
+    #               N, S, E, W:
     def get_flow(self, intersection):
-        ryg_state = traci.trafficlight.getRedYellowGreenState(intersection)
-        phase = traci.trafficlight.getPhase(intersection)
-
-        # print(intersection + " " + str(phase))
-        # returned string in format:
-        #               N, S, E, W:
-        if intersection == 'CC':
-            if phase == 0:
-                return [0, 0, 3, 2]
-            elif phase == 1:
-                return [0, 0, 0, 1]
-            elif phase == 2:
-                return [2, 0, 1, 1]
-            elif phase == 3:
-                return [0, 0, 1, 0]
-        elif intersection == 'EC':
-            if phase == 0:
-                return [0, 0, 4, 4]
-            elif phase == 1:
-                return [0, 0, 0, 0]
-            elif phase == 2:
-                return [4, 4, 0, 0]
-            elif phase == 3:
-                return [0, 0, 0, 0]
-        elif intersection == 'WC':
-            if phase == 0:
-                return [0, 0, 4, 4]
-            elif phase == 1:
-                return [0, 0, 4, 0]
-            elif phase == 2:
-                return [1, 0, 4, 0]
-            elif phase == 3:
-                return [1, 0, 0, 0]
-            elif phase == 4:
-                return [4, 4, 0, 0]
-            elif phase == 5:
-                return [0, 1, 0, 0]
-            elif phase == 6:
-                return [0, 1, 0, 4]
-            elif phase == 7:
-                return [0, 0, 0, 4]
+        return self.phase_table.flow[intersection][self.collector.phases[intersection]]
 
 
 
 
     def get_duration(self, params, net):
-        output = net.activate(params)
+        if self.profiler != None:
+            start = time.perf_counter()
+            output = net.activate(params)
+            self.profiler.count_activation(time.perf_counter() - start)
+        else:
+            output = net.activate(params)
+        # kept for the trace, if there is one
+        self.last_output = output
         change = output[0]
         duration = output[1]
 
-        self.log.info('next duration, from {} to {}'.format(duration, duration * 98.5 + 1.5))
+        self.log.info('next duration, from {} to {}', duration, duration * 98.5 + 1.5)
         # linear mapping of number between 0 and 1
         # to number between 1.5 and 100.
         # 50% chance of changing if output is truly random
         return (round(change), duration * 98.5 + 1.5)
 
     def light_trigger(self, light, net, source):
-
-        change, duration = self.get_duration(self.get_params_for(light, source), net)
+        params = self.get_params_for(light, source)
+        change, duration = self.get_duration(params, net)
 
         # add the change option to the current light phase number
         # means decision to change as 0 won't change phase,
         # and 1 means change
-        traci.trafficlight.setPhase(light, traci.trafficlight.getPhase(light) + change % len(traci.trafficlight.getCompleteRedYellowGreenDefinition(light)))
-        traci.trafficlight.setPhaseDuration(light, duration)
+        phase = self.phase_table.next_phase(light, self.collector.phases[light], change)
+        self.traci.trafficlight.setPhase(light, phase)
+        self.traci.trafficlight.setPhaseDuration(light, duration)
+        if self.recorder != None:
+            self.recorder.decision(self.step, light, source, params, self.last_output, phase, duration)
+        return duration
+
+    def check_light(self, light, net, step):
+        """
+        wakes light's controller if its phase ends on the next step, like the loop used to
+        check every step, and works out when it next needs looking at
+        """
+        next_switch, phase = self.collector.light_state(light)
+        if next_switch - step == 1:
+            duration = self.light_trigger(light, net, 'timeout')
+            # the new phase ends at step + 1 + duration. sumo keeps that to the millisecond,
+            # so don't trust the fraction and look again at the step it could first be due
+            self.scheduler.schedule(light, step + max(1, int(duration)))
+        else:
+            # nothing can change before sumo ends the phase, which it does on the step
+            # its end is due or just after, and then the next one is known
+            self.scheduler.schedule(light, max(step + 1, int(math.ceil(next_switch)) - 1))
 
+    def trigger(self, light, source, step=None):
+        """
+        asks for light's controller to be woken with source, at step or the current one.
+        a timeout is still checked for as usual
+        """
+        self.scheduler.schedule(light, step if step != None else self.step, source)
 
 
 
 
 
-    def run(self, networks):
-        step = 0
 
-        car_number = 0
+    def begin_run(self):
+        self.lights = self.traci.trafficlight.getIDList()
+        missing = [intersection for intersection in self.intersections if intersection not in self.lights]
+        if len(missing):
+            raise ValueError('intersections {} found in the network files but not in the running network'.format(missing))
+        # only the detectors of an intersection are read, with the feature row of their
+        # intersection and the side they're on, in N, S, E, W
+        self.detectors, rows, self.detector_directions = discovery.detector_index(self.traci.inductionloop.getIDList(), self.intersections)
+        self.detector_rows = np.array(rows, dtype=np.intp)
 
-        vehicle_last_intersection_step = {}
-        vehicle_last_intersection_id = {}
+        # reloads in a warm start use the same network, so the table only needs building once
+        if self.phase_table == None:
+            self.phase_table = phasetable.PhaseTable.build(self.traci, self.intersections, self.phase_rules)
 
-        # maybe for measuring overall performance of system
-        vehicle_number_of_stops = {}
-        vehicle_trip_time = {}
-        vehicle_is_stopped = {}
-        vehicle_stop_time = {}
+        self.collector = COLLECTORS[self.collection](self.traci)
+        self.collector.setup(self.intersections, self.detectors)
 
-        lights = traci.trafficlight.getIDList()
-        detectors = traci.inductionloop.getIDList()
+        # a restored warm start brings its own table along
+        if self.vehicles == None:
+            self.vehicles = vehicletable.VehicleTable(self.detectors)
+        # what the step loop needs of each detector, looked up once
+        self.detector_table = list(zip(self.detectors, [self.intersections[row] for row in rows], rows,
+                                       self.detector_directions, [self.vehicles.detector_index[detector] for detector in self.detectors]))
 
-        random.seed(a=1234) # seed for replicability
+        # every light gets looked at on the first step, which tells when it's next due
+        self.scheduler = lightscheduler.LightScheduler()
+        for light in self.intersections:
+            self.scheduler.schedule(light, self.step)
 
+    def run(self, networks):
+        profiler = self.profiler
+        if profiler != None:
+            profiler.begin_evaluation()
+        if self.warm_start:
+            self.restore()
+        else:
+            self.reset()
+            self.begin_run()
+        self.at_snapshot = False
+        if self.trace != None:
+            # the warm-up isn't part of the run, so recording starts here
+            directory = tracerecorder.new_run_directory(self.trace, self.output_prefix)
+            self.recorder = tracerecorder.TraceRecorder(directory, self.intersections, self.features.names(),
+                                                        meta={'seed': self.seed, 'steps': self.steps, 'copies': self.copies})
+
+        racing = self.racing
         # while traci.simulation.getMinExpectedNumber() > 0:
-        while True:
-
-            if step > 1200:
-                # apply penalties to instersections
-                vehs = traci.vehicle.getIDList()
-
-                for veh in vehs: # usually just one here
-                    intersection = traci.vehicle.getNextTLS(veh)
-                    # print(intersection)
-                    # update penalties and parameters
-                    if len(intersection) != 0:
-                        self.penalties[intersection[0][0]] -= step - vehicle_last_intersection_step[veh]
-                        self.penalties[intersection[0][0]] -= vehicle_number_of_stops[veh]
-                        vehicle_last_intersection_id[veh] = detector
-
-
-                # finish simulation
-                break
-
-            # generate cars before time step
-            if step % 20 == 0:
-                cars_generated = random.randint(10,40)
-                for car in range(cars_generated):
-                    gen_number = random.random()
-                    # route 0 and 1 are more likely:
-                    if gen_number < 0.35:
-                        traci.vehicle.add('vehicle_'+str(car_number), 'route_0')
-                    elif gen_number < 0.7:
-                        traci.vehicle.add('vehicle_'+str(car_number), 'route_1')
-                    else:
-                        # choose other random route 30% of the time
-                        route_number = random.randint(2, 13)
-                        traci.vehicle.add('vehicle_'+str(car_number), 'route_'+str(route_number))
-                    car_number += 1
-
-
-
-
-            # simulation step
-            traci.simulationStep()
-
-
-
-
-            # initialise vehicle time tracking for new vehicles for use in scoring intersections
-            vehicles = traci.vehicle.getIDList()
-            for vehicle in vehicles:
-
-                # initialise item in to dicts
-                if vehicle not in vehicle_is_stopped:
-                    vehicle_is_stopped[vehicle] = 0
-                    vehicle_number_of_stops[vehicle] = 0
-                    vehicle_stop_time[vehicle] = 0
-
-                # record stop
-                if traci.vehicle.isStopped(vehicle) == True and vehicle_is_stopped[vehicle] != 0:
-                    vehicle_is_stopped[vehicle] = 1
-                    vehicle_number_of_stops[vehicle] += 1
-                    vehicle_stop_time[vehicle] = step
-
-                # reset stop status
-                if traci.vehicle.isStopped(vehicle) == False and vehicle_is_stopped[vehicle] != 0:
-                    vehicle_is_stopped[vehicle] = 0
-
-                if vehicle_last_intersection_step.get(vehicle) == None:
-                    vehicle_last_intersection_step[vehicle] = step
-                    vehicle_last_intersection_id[vehicle] = None
-
-            #
-
-            # apply penalty to upcoming intersection if the deceleration exceeds the defined emergency deceleration
-            stopping_vehicles = traci.simulation.getEmergencyStoppingVehiclesIDList()
-            # if len(stopping_vehicles) > 0:
-            for vehicle in stopping_vehicles:
-                self.log.warning('~~~~~ noticed emergency stop from vehicle {}, penalising {}'.format(vehicle, traci.vehicle.getNextTLS(vehicle)[0][0]))
-                self.penalties[traci.vehicle.getNextTLS(vehicle)[0][0]] -= 20
-
-
-
-            # can't penalise the right intersection here
-            #
-            # teleporting_vehicles = traci.simulation.getStartingTeleportIDList()
-            # for vehicle in teleporting_vehicles:
-            #     print('next intersections: \n{}'.format(traci.vehicle.getNextTLS(vehicle)))
-            #     print('~~~~~ noticed teleport from vehicle {}, penalising {}'.format(vehicle, traci.vehicle.getNextTLS(vehicle)[0][0]))
-            #     self.penalties[traci.vehicle.getNextTLS(vehicle)[0][0]] -= 20
-
-
-            for detector in detectors:
-                vehs = traci.inductionloop.getLastStepVehicleIDs(detector)
-                intersection = detector.split('_')[0]
-
-                if traci.inductionloop.getLastStepMeanSpeed(detector) > 0:
-                    self.intersection_speeds[intersection].append(traci.inductionloop.getLastStepMeanSpeed(detector))
-
-                for veh in vehs: # usually just one here
-
-                    # update penalties and parameters
-                    if vehicle_last_intersection_id[veh] != detector:
-                        self.penalties[intersection] -= step - vehicle_last_intersection_step[veh]
-                        self.penalties[intersection] -= vehicle_number_of_stops[veh]
-                        self.intersection_parameters[intersection]['num_cars'] += 1
-                        self.intersection_parameters[intersection][detector.split('_')[-1] + '_dets_time'] = step
-                        vehicle_last_intersection_id[veh] = detector
-                    else:
-                        self.penalties[intersection] -= 1
-                    #
-
-                    #reset vehicle's step
-                    vehicle_last_intersection_step[veh] = step
-                #
-            #
-
-
-
-            # actual cool decision making stuff happens here:
-            for light in lights:
-                if (traci.trafficlight.getNextSwitch(light) - step) == 1:
-                    # use the neural network to make decisions (cool)
-
-                    self.light_trigger(light, networks[light], 'timeout')
-
-
-            step += 1
-
-        traci.close()
+        while self.step <= self.steps:
+            self.simulate_step(networks)
+            if racing != None and racing.is_rung(self.step):
+                stopped = racing.check(self.step, self.penalties)
+                if stopped != None:
+                    return self.stop_early(stopped)
+
+        if profiler != None:
+            profiler.phase('finish')
+        # apply penalties to instersections
+        vehs = self.traci.vehicle.getIDList()
+
+        for veh in vehs: # usually just one here
+            intersection = self.traci.vehicle.getNextTLS(veh)
+            # print(intersection)
+            # update penalties and parameters
+            if len(intersection) != 0 and intersection[0][0] in self.penalties:
+                row = self.vehicles.row(veh)
+                self.penalties[intersection[0][0]] -= self.step - int(self.vehicles.last_intersection_step[row])
+                self.penalties[intersection[0][0]] -= int(self.vehicles.number_of_stops[row])
+
+        if self.recorder != None:
+            self.recorder.finish(np.fromiter(self.penalties.values(), dtype=np.int64, count=len(self.penalties)))
+        self.close_trace(self.penalties)
+        # finish simulation, unless it's kept around for the next warm start
+        if not self.warm_start:
+            self.close()
+        self.log.info('collection: {} traci calls issued, {} saved against per-step polling', self.collector.calls, self.collector.saved_calls())
+        if profiler != None:
+            profiler.end_evaluation(dict(self.penalties))
+        if racing != None:
+            racing.complete(self.penalties)
         # print('penalties: ')
         # print(penalties)
         # print('intersection params: ')
         # print(get_params())
         # sys.stdout.flush()
         return self.penalties
+
+    def stop_early(self, penalties):
+        """ends a run the racing policy has given up on, with the penalties it filled in"""
+        self.log.info('racing: stopped at step {}, penalties {}', self.step, penalties)
+        self.close_trace(penalties)
+        if not self.warm_start:
+            self.close()
+        if self.profiler != None:
+            self.profiler.end_evaluation(dict(penalties))
+        return penalties
+
+    def close_trace(self, penalties):
+        if self.recorder != None:
+            self.recorder.close(penalties)
+            self.recorder = None
+
+    def record_step(self, step, counts):
+        queue = np.bincount(self.detector_rows, counts, len(self.intersections))
+        self.recorder.step(step, np.fromiter(self.penalties.values(), dtype=np.int64, count=len(self.penalties)),
+                           queue, len(self.collector.vehicles))
+
+    def simulate_step(self, networks):
+        """
+        one step of the main loop: insert demand, step sumo, score what happened,
+        then let the networks decide on any lights about to switch.
+        with networks None the lights are left to run their default programs
+        """
+        step = self.step
+        table = self.vehicles
+        profiler = self.profiler
+
+        if profiler != None:
+            profiler.phase('insert')
+        # generate cars before time step, unless sumo is reading them from a file
+        if self.schedule != None:
+            for vehicle, route, speed_factor in self.schedule.get(step, ()):
+                self.traci.vehicle.add(vehicle, route)
+                if speed_factor != None:
+                    self.traci.vehicle.setSpeedFactor(vehicle, speed_factor)
+                self.car_number += 1
+
+
+
+
+        # simulation step
+        if profiler != None:
+            profiler.phase('simulation_step')
+        self.traci.simulationStep()
+
+
+
+
+        # initialise vehicle time tracking for new vehicles for use in scoring intersections,
+        # and record stops, for every vehicle on the road at once
+        if profiler != None:
+            profiler.phase('collect')
+        self.collector.collect()
+        if profiler != None:
+            profiler.phase('vehicle_scan')
+        table.update(self.collector.vehicles, step)
+
+        #
+
+        # apply penalty to upcoming intersection if the deceleration exceeds the defined emergency deceleration
+        if profiler != None:
+            profiler.phase('emergency_stops')
+        stopping_vehicles = self.collector.emergency_stops
+        # if len(stopping_vehicles) > 0:
+        for vehicle in stopping_vehicles:
+            light = self.traci.vehicle.getNextTLS(vehicle)[0][0]
+            # lights left on their own programs aren't anyone's fault
+            if light in self.penalties:
+                self.log.warning('~~~~~ noticed emergency stop from vehicle {}, penalising {}', vehicle, light)
+                self.penalties[light] -= 20
+
+
+
+        # can't penalise the right intersection here
+        #
+        # teleporting_vehicles = traci.simulation.getStartingTeleportIDList()
+        # for vehicle in teleporting_vehicles:
+        #     print('next intersections: \n{}'.format(traci.vehicle.getNextTLS(vehicle)))
+        #     print('~~~~~ noticed teleport from vehicle {}, penalising {}'.format(vehicle, traci.vehicle.getNextTLS(vehicle)[0][0]))
+        #     self.penalties[traci.vehicle.getNextTLS(vehicle)[0][0]] -= 20
+
+
+        if profiler != None:
+            profiler.phase('detectors')
+        features = self.features
+        features.begin_step(step)
+        detector_vehicles = self.collector.detector_vehicles
+        speeds = np.fromiter(map(self.collector.detector_speeds.__getitem__, self.detectors), dtype=np.float64, count=len(self.detectors))
+        counts = None
+        if features.windowed or self.recorder != None:
+            counts = np.fromiter((len(detector_vehicles[detector]) for detector in self.detectors), dtype=np.float64, count=len(self.detectors))
+        features.add_readings(self.detector_rows, speeds, counts)
+        for detector, intersection, row_index, direction, detector_id in self.detector_table:
+            vehs = detector_vehicles[detector]
+
+            for veh in vehs: # usually just one here
+                row = table.row(veh)
+
+                # update penalties and parameters
+                if table.last_intersection_id[row] != detector_id:
+                    self.penalties[intersection] -= step - int(table.last_intersection_step[row])
+                    self.penalties[intersection] -= int(table.number_of_stops[row])
+                    features.add_car(row_index, direction, step)
+                    table.last_intersection_id[row] = detector_id
+                else:
+                    self.penalties[intersection] -= 1
+                #
+
+                #reset vehicle's step
+                table.last_intersection_step[row] = step
+            #
+        #
+
+        # vehicles that have left won't be back, so hand their rows to the next ones in
+        table.remove(self.collector.arrived)
+
+        # actual cool decision making stuff happens here:
+        if profiler != None:
+            profiler.phase('light_triggers')
+        if networks != None:
+            # only the lights the scheduler says are due
+            for light, source in self.scheduler.due(step):
+                if source == 'timeout':
+                    # use the neural network to make decisions (cool)
+                    self.check_light(light, networks[light], step)
+                else:
+                    self.collector.light_state(light)
+                    duration = self.light_trigger(light, networks[light], source)
+                    self.scheduler.schedule(light, step + max(1, int(duration)))
+
+        if self.recorder != None:
+            self.record_step(step, counts)
+
+        self.step += 1
+        if profiler != None:
+            profiler.end_step()
@@ -0,0 +1,88 @@
+"""
+Picks the library SimulationController drives sumo through: libsumo in-process, traci over a
+socket, or traci to one of the sumos a sumopool.SumoPool started ahead of time.
+"""
+
+import os
+import sys
+import importlib.util
+
+# we need to import some python modules from the $SUMO_HOME/tools directory
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+elif importlib.util.find_spec('traci') is None:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+import traci
+import sumopool
+
+# libsumo is only there when sumo was built with it, so it's optional
+try:
+    import libsumo
+except ImportError:
+    libsumo = None
+
+
+class SimulatorBackend(object):
+    """
+    small wrapper so the controller doesn't care which library is underneath.
+
+    once started, `module` is either traci, libsumo or a traci connection. all of them expose
+    the same domains (vehicle, trafficlight, inductionloop, simulation) plus simulationStep and
+    close, so the controller just calls everything through backend.module.
+
+    name is one of:
+        auto:       libsumo whenever it's installed and no gui is wanted, otherwise traci
+        libsumo:    same as auto, but fail loudly if libsumo isn't installed
+        traci:      always go over the socket
+        pool:       over the socket to a sumo from this process's pool for the command line, of
+                    pool_size sumos that are each replaced after pool_max_uses runs. the gui
+                    still gets one of its own
+
+    or module can be given to drive sumo, or something pretending to be it, through any other
+    library with traci's interface, e.g. the fake one the benchmarks use
+    """
+
+    def __init__(self, name='auto', module=None, pool_size=2, pool_max_uses=20):
+        super(SimulatorBackend, self).__init__()
+        if name == 'libsumo' and libsumo is None:
+            raise RuntimeError('libsumo backend requested but libsumo could not be imported')
+        self.name = name
+        self.custom_module = module
+        self.pool_size = pool_size
+        self.pool_max_uses = pool_max_uses
+        self.module = None
+        # the pool module came from, when it did
+        self.pool = None
+
+    def uses_libsumo(self, gui):
+        # libsumo runs sumo inside this process and has no gui, so the gui always needs traci
+        return self.custom_module == None and self.name not in ['traci', 'pool'] and gui == 'nogui' and libsumo is not None
+
+    def start(self, cmd, gui='nogui', label=None):
+        if self.custom_module != None:
+            self.module = self.custom_module
+            self.module.start(cmd, label=label)
+        elif self.uses_libsumo(gui):
+            # only one in-process simulation per python process, so labels have nothing to pick between
+            self.module = libsumo
+            libsumo.start(cmd)
+        elif self.name == 'pool' and gui == 'nogui':
+            # pooled connections aren't registered under a label, so they never clash with one
+            self.pool = sumopool.get_pool(cmd, self.pool_size, self.pool_max_uses)
+            self.module = self.pool.acquire()
+        else:
+            self.module = traci
+            if label != None:
+                traci.start(cmd, label=label)
+            else:
+                traci.start(cmd)
+        return self.module
+
+    def close(self):
+        if self.pool != None:
+            self.pool.release(self.module)
+            self.pool = None
+        else:
+            self.module.close()
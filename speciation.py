@@ -0,0 +1,313 @@
+"""
+NumPy version of neat.DefaultSpeciesSet.
+
+Speciation itself is the same as neat's, step for step, so genomes end up in the same species
+with the same representatives. What changes is where the genome distances come from. neat
+works them out one pair at a time as speciate asks for them, in python. Here the pairs
+speciate is about to ask for are worked out together: the old representatives against the
+whole population first, then the new representatives against the genomes still to be placed,
+and each new species' representative against what's left once it's made.
+
+For that every genome is encoded once as an array of gene columns, one column per node or
+connection key seen so far, and an array of attribute values, so finding the homologous and
+disjoint genes of many pairs comes down to one sort. Genomes aren't changed once they're made,
+so both the encodings and the distances are kept, keyed by genome key, for as long as the
+genomes are around: elites and representatives carry over from one generation to the next,
+and so do the distances between them.
+
+Use it as the species_set_type, with a [VectorisedSpeciesSet] section in the config:
+
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         speciation.VectorisedSpeciesSet, neat.DefaultStagnation,
+                         "neat_configuration")
+"""
+
+import numpy as np
+from neat.math_util import mean, stdev
+from neat.six_util import iteritems, iterkeys, itervalues
+from neat.species import DefaultSpeciesSet, Species
+from neat.config import ConfigParameter, DefaultClassConfig
+
+# pairs worked out per numpy pass, which bounds the size of its arrays
+CHUNK_SIZE = 4096
+
+
+class _Encoding(object):
+    """the genes of one genome as column indices and attribute arrays"""
+
+    def __init__(self, node_columns, node_values, connection_columns, connection_values):
+        super(_Encoding, self).__init__()
+        self.node_columns = node_columns
+        # (genes, 4): bias, response, activation code, aggregation code
+        self.node_values = node_values
+        self.connection_columns = connection_columns
+        # (genes, 2): weight, enabled
+        self.connection_values = connection_values
+
+
+class GenomeEncoder(object):
+    """encodes genomes onto shared columns, growing them as new gene keys turn up"""
+
+    def __init__(self):
+        super(GenomeEncoder, self).__init__()
+        self.node_columns = {}
+        self.connection_columns = {}
+        # activation and aggregation names -> codes, only ever compared for equality
+        self.codes = {}
+        self.encodings = {}
+
+    def column(self, columns, key):
+        if key not in columns:
+            columns[key] = len(columns)
+        return columns[key]
+
+    def code(self, name):
+        if name not in self.codes:
+            self.codes[name] = float(len(self.codes))
+        return self.codes[name]
+
+    def encode(self, genome):
+        encoding = self.encodings.get(genome.key)
+        if encoding is None:
+            nodes = list(iteritems(genome.nodes))
+            connections = list(iteritems(genome.connections))
+            encoding = _Encoding(
+                np.array([self.column(self.node_columns, k) for k, n in nodes], dtype=np.intp),
+                np.array([[n.bias, n.response, self.code(n.activation), self.code(n.aggregation)] for k, n in nodes],
+                         dtype=np.float64).reshape(len(nodes), 4),
+                np.array([self.column(self.connection_columns, k) for k, c in connections], dtype=np.intp),
+                np.array([[c.weight, float(c.enabled)] for k, c in connections],
+                         dtype=np.float64).reshape(len(connections), 2))
+            self.encodings[genome.key] = encoding
+        return encoding
+
+    def flat(self, genomes):
+        """
+        the genes of genomes one after the other: (node columns, node values, node offsets,
+        node counts, connection columns, connection values, connection offsets, connection
+        counts), where a genome's genes start at its offset
+        """
+        encodings = [self.encode(genome) for genome in genomes]
+        result = []
+        for columns, values, width in [('node_columns', 'node_values', 4), ('connection_columns', 'connection_values', 2)]:
+            counts = np.array([len(getattr(encoding, columns)) for encoding in encodings], dtype=np.intp)
+            offsets = np.zeros(len(encodings), dtype=np.intp)
+            offsets[1:] = np.cumsum(counts)[:-1]
+            result += [np.concatenate([getattr(encoding, columns) for encoding in encodings]),
+                       np.concatenate([getattr(encoding, values) for encoding in encodings]).reshape(-1, width),
+                       offsets, counts]
+        return result
+
+    def forget(self, keep):
+        for key in list(self.encodings):
+            if key not in keep:
+                del self.encodings[key]
+
+
+def _ragged_range(starts, counts):
+    """the concatenation of range(start, start + count) for each start and count"""
+    ends = np.cumsum(counts)
+    return np.repeat(starts - (ends - counts), counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+def _gene_distances(columns, values, offsets, counts, a, b, continuous, disjoint_coefficient, weight_coefficient):
+    """
+    the node or connection part of DefaultGenome.distance for each pair of genomes (a[i], b[i]),
+    given as indices into offsets and counts. the first `continuous` attributes count by their
+    absolute difference, the rest 1 if they differ.
+
+    genomes only have a handful of the gene keys there are, so rather than lining up a row per
+    genome the genes of both sides of every pair go into one array, sorted by pair and column.
+    the homologous genes are then the neighbours with the same pair and column
+    """
+    pairs = len(a)
+    count_a = counts[a]
+    count_b = counts[b]
+    genes = np.concatenate([_ragged_range(offsets[a], count_a), _ragged_range(offsets[b], count_b)])
+    pair = np.concatenate([np.repeat(np.arange(pairs), count_a), np.repeat(np.arange(pairs), count_b)])
+    order = np.argsort(pair * (int(columns.max()) + 1 if len(columns) else 1) + columns[genes], kind='stable')
+    sorted_pair = pair[order]
+    sorted_columns = columns[genes[order]]
+    # a genome has each key once, so equal neighbours are one gene from each side
+    same = np.flatnonzero((sorted_pair[1:] == sorted_pair[:-1]) & (sorted_columns[1:] == sorted_columns[:-1]))
+    first = values[genes[order[same]]]
+    second = values[genes[order[same + 1]]]
+    per_gene = np.abs(first[:, :continuous] - second[:, :continuous]).sum(axis=1)
+    per_gene += (first[:, continuous:] != second[:, continuous:]).sum(axis=1)
+    homologous = np.bincount(sorted_pair[same], minlength=pairs)
+    homologous_distance = np.bincount(sorted_pair[same], weights=per_gene * weight_coefficient, minlength=pairs)
+    disjoint = count_a + count_b - 2 * homologous
+    largest = np.maximum(count_a, count_b)
+    # neither genome having any genes of the kind counts as no distance, like neat
+    return np.where(largest > 0, (homologous_distance + disjoint_coefficient * disjoint) / np.maximum(largest, 1), 0.0)
+
+
+def distances(encoder, genomes_a, genomes_b, genome_config):
+    """DefaultGenome.distance for each pair (genomes_a[i], genomes_b[i]), as an array"""
+    result = np.zeros(len(genomes_a))
+    disjoint = genome_config.compatibility_disjoint_coefficient
+    weight = genome_config.compatibility_weight_coefficient
+    for start in range(0, len(genomes_a), CHUNK_SIZE):
+        chunk_a = genomes_a[start:start + CHUNK_SIZE]
+        chunk_b = genomes_b[start:start + CHUNK_SIZE]
+        # every genome of the chunk once, then picked out by index for each side of the pairs
+        unique = dict((genome.key, genome) for genome in chunk_a + chunk_b)
+        rows = dict((key, row) for row, key in enumerate(unique))
+        flat = encoder.flat(list(unique.values()))
+        a = np.array([rows[genome.key] for genome in chunk_a], dtype=np.intp)
+        b = np.array([rows[genome.key] for genome in chunk_b], dtype=np.intp)
+        result[start:start + len(chunk_a)] = (_gene_distances(*(flat[:4] + [a, b, 2, disjoint, weight])) +
+                                              _gene_distances(*(flat[4:] + [a, b, 1, disjoint, weight])))
+    return result
+
+
+class DistanceCache(object):
+    """
+    genome distances, kept between generations. fill works out the missing ones for a set of
+    pairs in one go, and calling it looks one up, like neat's GenomeDistanceCache. the
+    distances speciate looks up are also kept in self.distances, for its report
+    """
+
+    def __init__(self, config):
+        super(DistanceCache, self).__init__()
+        self.config = config
+        self.encoder = GenomeEncoder()
+        # (key, key) -> distance, both ways round
+        self.known = {}
+        self.distances = {}
+        # distances worked out, and looked up
+        self.misses = 0
+        self.hits = 0
+
+    def fill(self, genomes_a, genomes_b):
+        """makes sure every distance between genomes_a and genomes_b is known"""
+        known = self.known
+        missing = {}
+        for genome0 in genomes_a:
+            for genome1 in genomes_b:
+                pair = (genome0.key, genome1.key)
+                if pair not in known and (genome1.key, genome0.key) not in missing:
+                    missing[pair] = (genome0, genome1)
+        if len(missing):
+            pairs = list(missing.values())
+            found = distances(self.encoder, [a for a, b in pairs], [b for a, b in pairs], self.config)
+            for (genome0, genome1), d in zip(pairs, found.tolist()):
+                known[genome0.key, genome1.key] = d
+                known[genome1.key, genome0.key] = d
+        self.misses += len(missing)
+
+    def __call__(self, genome0, genome1):
+        pair = (genome0.key, genome1.key)
+        if pair not in self.known:
+            self.fill([genome0], [genome1])
+        self.hits += 1
+        d = self.known[pair]
+        self.distances[pair] = d
+        self.distances[genome1.key, genome0.key] = d
+        return d
+
+    def new_generation(self):
+        self.distances = {}
+
+    def forget(self, keep):
+        """drops everything about genomes whose keys aren't in keep"""
+        for pair in list(self.known):
+            if pair[0] not in keep or pair[1] not in keep:
+                del self.known[pair]
+        self.encoder.forget(keep)
+
+
+class VectorisedSpeciesSet(DefaultSpeciesSet):
+    def __init__(self, config, reporters):
+        super(VectorisedSpeciesSet, self).__init__(config, reporters)
+        self.distance_cache = None
+
+    @classmethod
+    def parse_config(cls, param_dict):
+        return DefaultClassConfig(param_dict,
+                                  [ConfigParameter('compatibility_threshold', float)])
+
+    def __getstate__(self):
+        # the cache is only there to save time, and checkpoints are better off without it
+        state = dict(self.__dict__)
+        state['distance_cache'] = None
+        return state
+
+    def speciate(self, config, population, generation):
+        """the same as DefaultSpeciesSet.speciate, with the distances worked out in bulk"""
+        assert isinstance(population, dict)
+
+        compatibility_threshold = self.species_set_config.compatibility_threshold
+        if self.distance_cache is None:
+            self.distance_cache = DistanceCache(config.genome_config)
+        distances = self.distance_cache
+        distances.new_generation()
+
+        # Find the best representatives for each existing species.
+        unspeciated = set(iterkeys(population))
+        distances.fill([s.representative for s in itervalues(self.species)], list(itervalues(population)))
+        new_representatives = {}
+        new_members = {}
+        for sid, s in iteritems(self.species):
+            candidates = []
+            for gid in unspeciated:
+                g = population[gid]
+                d = distances(s.representative, g)
+                candidates.append((d, g))
+
+            # The new representative is the genome closest to the current representative.
+            ignored_rdist, new_rep = min(candidates, key=lambda x: x[0])
+            new_rid = new_rep.key
+            new_representatives[sid] = new_rid
+            new_members[sid] = [new_rid]
+            unspeciated.remove(new_rid)
+
+        # Partition population into species based on genetic similarity.
+        distances.fill([population[rid] for rid in itervalues(new_representatives)],
+                       [population[gid] for gid in unspeciated])
+        while unspeciated:
+            gid = unspeciated.pop()
+            g = population[gid]
+
+            # Find the species with the most similar representative.
+            candidates = []
+            for sid, rid in iteritems(new_representatives):
+                rep = population[rid]
+                d = distances(rep, g)
+                if d < compatibility_threshold:
+                    candidates.append((d, sid))
+
+            if candidates:
+                ignored_sdist, sid = min(candidates, key=lambda x: x[0])
+                new_members[sid].append(gid)
+            else:
+                # No species is similar enough, create a new species, using
+                # this genome as its representative.
+                sid = next(self.indexer)
+                new_representatives[sid] = gid
+                new_members[sid] = [gid]
+                distances.fill([g], [population[other] for other in unspeciated])
+
+        # Update species collection based on new speciation.
+        self.genome_to_species = {}
+        for sid, rid in iteritems(new_representatives):
+            s = self.species.get(sid)
+            if s is None:
+                s = Species(sid, generation)
+                self.species[sid] = s
+
+            members = new_members[sid]
+            for gid in members:
+                self.genome_to_species[gid] = sid
+
+            member_dict = dict((gid, population[gid]) for gid in members)
+            s.update(population[rid], member_dict)
+
+        # anything not in this population can only come back as a representative,
+        # and those are all in it now
+        distances.forget(set(iterkeys(population)))
+
+        gdmean = mean(itervalues(distances.distances))
+        gdstdev = stdev(itervalues(distances.distances))
+        self.reporters.info(
+            'Mean genetic distance {0:.3f}, standard deviation {1:.3f}'.format(gdmean, gdstdev))
@@ -7,17 +7,34 @@ import os
 import sys
 import optparse
 
-from xml.dom import minidom
+# sumooutputs.py lives at the top of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import sumooutputs
 
 
-# parse an xml file by name
-mydoc = minidom.parse('/Users/charlie/a1726075/2020/s2/AML/sumoStuff/corridor/dets/CC_e1Detector_CE_0_10.xml')
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--prefix", default="",
+                         help="read the outputs of the run with this --output-prefix, e.g. 'worker123.'")
+    opt_parser.add_option("--processes", type="int", default=None,
+                         help="processes to read the files with, 0 reads them here one by one")
+    options, args = opt_parser.parse_args()
+    return options
 
-intervals = mydoc.getElementsByTagName('interval')
 
-# one specific item attribute
-print('Interval #1 attribute:')
-print(intervals[0].attributes['speed'].value)
+if __name__ == "__main__":
+    options = get_options()
+    here = os.path.dirname(os.path.abspath(__file__))
 
-# notes before finishing this: I don't think the detecter plates
-# pick up good enough stats for measuring congestion
+    tripinfo = os.path.join(here, '..', options.prefix + 'tripinfo.xml')
+    tripinfo_paths = [tripinfo] if os.path.exists(tripinfo) else []
+    detectors, trips = sumooutputs.load(sumooutputs.detector_files(here, options.prefix), tripinfo_paths, options.processes)
+
+    print('{} intervals from {} detector files, {} trips'.format(len(detectors['begin']), len(detectors['files']), len(trips['duration'])))
+    for intersection, summary in sorted(sumooutputs.intersection_summary(detectors).items()):
+        print('{}: {} vehicles, mean speed {:.2f}'.format(intersection, summary['vehicles'], summary['mean_speed']))
+    if len(trips['duration']):
+        print('trips: mean duration {:.2f}, mean waiting time {:.2f}'.format(trips['duration'].mean(), trips['waitingTime'].mean()))
+
+    # notes before finishing this: I don't think the detecter plates
+    # pick up good enough stats for measuring congestion
@@ -0,0 +1,142 @@
+"""
+Loads sumo's own outputs, the e1 detector interval files and tripinfo.xml, into numpy columns.
+
+Files are read with iterparse and every element is dropped as soon as its attributes are
+copied out, so a file never sits in memory as a tree however long the run was. Lots of
+files, e.g. the outputs of every worker in a generation, are read in parallel, one file
+per task.
+"""
+
+import os
+import array
+import multiprocessing
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+
+# interval attributes read from the detector files, all floats
+DETECTOR_COLUMNS = ['begin', 'end', 'flow', 'occupancy', 'speed', 'harmonicMeanSpeed', 'nVehContrib', 'nVehEntered']
+# tripinfo attributes read from tripinfo files, all floats
+TRIPINFO_COLUMNS = ['depart', 'arrival', 'duration', 'routeLength', 'waitingTime', 'waitingCount', 'timeLoss']
+
+
+def detector_files(directory='dets', prefix=''):
+    """
+    the detector files in directory written by a run with the given --output-prefix.
+    without a prefix, only the files of unlabelled runs
+    """
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if not name.startswith(prefix) or not name.endswith('.xml') or '_e1Detector_' not in name:
+            continue
+        # anything left in front of the intersection name belongs to some other run's prefix
+        if '.' in name[len(prefix):].split('_e1Detector_')[0]:
+            continue
+        files.append(os.path.join(directory, name))
+    return files
+
+
+def _stream(path, tag, columns):
+    """reads one attribute column per name from every tag element, plus the elements' ids"""
+    values = {}
+    for name in columns:
+        values[name] = array.array('d')
+    ids = []
+    for event, element in ElementTree.iterparse(path, events=('end',)):
+        if element.tag == tag:
+            attributes = element.attrib
+            for name in columns:
+                values[name].append(float(attributes.get(name, 'nan')))
+            ids.append(attributes.get('id'))
+        # nothing is kept once it has been read
+        element.clear()
+
+    result = {}
+    for name in columns:
+        result[name] = np.frombuffer(values[name], dtype=np.float64) if len(values[name]) else np.zeros(0)
+    result['id'] = ids
+    return result
+
+
+def read_detector_file(path):
+    return _stream(path, 'interval', DETECTOR_COLUMNS)
+
+
+def read_tripinfo_file(path):
+    return _stream(path, 'tripinfo', TRIPINFO_COLUMNS)
+
+
+def _read(task):
+    kind, path = task
+    if kind == 'detector':
+        return read_detector_file(path)
+    return read_tripinfo_file(path)
+
+
+def _concatenate(parts, columns, paths):
+    """
+    joins the columns of several files, interning the ids to ints. 'id' indexes into 'ids',
+    and 'file' into 'files' for the file each row came from
+    """
+    result = {}
+    for name in columns:
+        result[name] = np.concatenate([part[name] for part in parts]) if parts else np.zeros(0)
+
+    ids = []
+    id_index = {}
+    codes = []
+    for part in parts:
+        for element_id in part['id']:
+            if element_id not in id_index:
+                id_index[element_id] = len(ids)
+                ids.append(element_id)
+            codes.append(id_index[element_id])
+    result['id'] = np.array(codes, dtype=np.int32)
+    result['ids'] = ids
+    result['file'] = np.repeat(np.arange(len(parts), dtype=np.int32), [len(part['id']) for part in parts])
+    result['files'] = list(paths)
+    return result
+
+
+def load(detector_paths=[], tripinfo_paths=[], processes=None):
+    """
+    reads every file given and returns (detectors, trips), each a dict of numpy columns
+    for all of its files joined together. with processes 0 the files are read one after
+    another in this process, otherwise across a pool of that many processes (None for
+    one per cpu)
+    """
+    tasks = [('detector', path) for path in detector_paths] + [('tripinfo', path) for path in tripinfo_paths]
+    if processes == 0 or len(tasks) < 2:
+        parts = [_read(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            parts = pool.map(_read, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    detectors = _concatenate(parts[:len(detector_paths)], DETECTOR_COLUMNS, detector_paths)
+    trips = _concatenate(parts[len(detector_paths):], TRIPINFO_COLUMNS, tripinfo_paths)
+    return detectors, trips
+
+
+def intersection_summary(detectors):
+    """
+    per intersection totals over all the detector intervals given, by the intersection
+    named at the start of each detector id: vehicles counted, and their mean speed
+    """
+    intersections = sorted(set(detector_id.split('_')[0] for detector_id in detectors['ids']))
+    detector_intersection = np.array([intersections.index(detector_id.split('_')[0]) for detector_id in detectors['ids']], dtype=np.intp)
+    rows = detector_intersection[detectors['id']] if len(detectors['id']) else np.zeros(0, dtype=np.intp)
+
+    counted = detectors['nVehContrib']
+    # intervals nobody passed through have a speed of -1
+    measured = counted > 0
+    vehicles = np.bincount(rows, weights=counted, minlength=len(intersections))
+    speed_sum = np.bincount(rows[measured], weights=(detectors['speed'] * counted)[measured], minlength=len(intersections))
+
+    summary = {}
+    for i, intersection in enumerate(intersections):
+        summary[intersection] = {'vehicles': int(vehicles[i]),
+                                 'mean_speed': speed_sum[i] / vehicles[i] if vehicles[i] > 0 else 0.0}
+    return summary
@@ -0,0 +1,211 @@
+"""
+sumo processes started ahead of time, so an evaluation doesn't wait for one to boot.
+
+A SumoPool keeps `size` sumo processes running for one command line, each on its own local
+port with the corridor already loaded, waiting for traci to connect. acquire() hands out a
+connection to one that's ready, and release() gives it back. Given back, it's reloaded with
+the same options in the background, which is how a warm start resets too and leaves it as it
+was freshly started, unless it has been used max_uses times, in which case it's closed and
+a new process takes its place. Before a connection is handed out it has to pass a health
+check: the process is still running and answers at simulation time 0.
+
+Pools run side by side, so each process gets its own --output-prefix (pool<n>. after any the
+command had) to keep their output files apart.
+
+There's one pool per command line per python process, through get_pool(), and close_pools()
+shuts them all down; it's also called at exit, so no sumo outlives the process that started
+it.
+"""
+
+import os
+import sys
+import importlib.util
+import time
+import atexit
+import threading
+import subprocess
+from queue import Queue, Empty
+
+# we need to import some python modules from the $SUMO_HOME/tools directory
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+elif importlib.util.find_spec('traci') is None:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+import traci
+from sumolib.miscutils import getFreeSocketPort
+
+
+class _PooledSumo(object):
+    """one sumo process of a pool, and the connection to it"""
+
+    def __init__(self, slot, process, connection, load_args):
+        super(_PooledSumo, self).__init__()
+        self.slot = slot
+        self.process = process
+        self.connection = connection
+        # what reloading it takes, the command line without the binary and port
+        self.load_args = load_args
+        self.uses = 0
+
+
+def with_prefix(cmd, prefix):
+    """cmd with prefix added to the end of its --output-prefix, or given one"""
+    cmd = list(cmd)
+    if '--output-prefix' in cmd:
+        index = cmd.index('--output-prefix') + 1
+        cmd[index] = cmd[index] + prefix
+    else:
+        cmd += ['--output-prefix', prefix]
+    return cmd
+
+
+class SumoPool(object):
+    def __init__(self, cmd, size=2, max_uses=20, host='localhost', timeout=120.0):
+        super(SumoPool, self).__init__()
+        self.cmd = list(cmd)
+        self.size = size
+        self.max_uses = max_uses
+        self.host = host
+        # longest acquire waits for a process to be ready
+        self.timeout = timeout
+        self.ready = Queue()
+        # id of a handed out connection -> its _PooledSumo
+        self.out = {}
+        self.lock = threading.Lock()
+        self.closing = False
+
+        self.launched = 0
+        self.recycled = 0
+        self.acquired = 0
+        self.waited = 0.0
+        for slot in range(size):
+            self.background(self.launch, slot)
+
+    def background(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def launch(self, slot):
+        """starts a new sumo for slot and puts it in the ready queue once it's connected"""
+        cmd = with_prefix(self.cmd, 'pool{}.'.format(slot))
+        port = getFreeSocketPort()
+        process = subprocess.Popen(cmd + ['--remote-port', str(port)])
+        try:
+            connection = traci.connect(port, host=self.host, proc=process, waitBetweenRetries=0.1)
+        except Exception as e:
+            process.kill()
+            print('sumopool: sumo for slot {} failed to start: {}'.format(slot, e))
+            return
+        with self.lock:
+            self.launched += 1
+        self.offer(_PooledSumo(slot, process, connection, cmd[1:]))
+
+    def offer(self, sumo):
+        if self.closing:
+            self.retire(sumo, replace=False)
+        else:
+            self.ready.put(sumo)
+
+    def recycle(self, sumo):
+        """reloads a used sumo, which leaves it as if it had just been started"""
+        try:
+            sumo.connection.load(sumo.load_args)
+        except Exception as e:
+            print('sumopool: reloading slot {} failed, replacing it: {}'.format(sumo.slot, e))
+            self.retire(sumo)
+            return
+        with self.lock:
+            self.recycled += 1
+        self.offer(sumo)
+
+    def retire(self, sumo, replace=True):
+        try:
+            sumo.connection.close(wait=False)
+        except Exception:
+            pass
+        try:
+            sumo.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            sumo.process.kill()
+        if replace and not self.closing:
+            self.launch(sumo.slot)
+
+    def healthy(self, sumo):
+        if sumo.process.poll() is not None:
+            return False
+        try:
+            return sumo.connection.simulation.getTime() == 0
+        except Exception:
+            return False
+
+    def acquire(self):
+        """a traci connection to a freshly started sumo, for the caller to run one simulation on"""
+        start = time.time()
+        while True:
+            remaining = self.timeout - (time.time() - start)
+            try:
+                sumo = self.ready.get(timeout=max(remaining, 0))
+            except Empty:
+                raise RuntimeError('no sumo ready in the pool after {:.0f}s'.format(self.timeout))
+            if self.healthy(sumo):
+                break
+            print('sumopool: slot {} failed its health check, replacing it'.format(sumo.slot))
+            self.background(self.retire, sumo)
+        with self.lock:
+            self.out[id(sumo.connection)] = sumo
+            self.acquired += 1
+            self.waited += time.time() - start
+        return sumo.connection
+
+    def release(self, connection):
+        """gives a connection back once its simulation is done with"""
+        with self.lock:
+            sumo = self.out.pop(id(connection))
+        sumo.uses += 1
+        if sumo.uses >= self.max_uses:
+            self.background(self.retire, sumo)
+        else:
+            self.background(self.recycle, sumo)
+
+    def stats(self):
+        return {'launched': self.launched, 'recycled': self.recycled, 'acquired': self.acquired,
+                'mean_wait': self.waited / self.acquired if self.acquired else 0.0}
+
+    def close(self):
+        self.closing = True
+        with self.lock:
+            handed_out = list(self.out.values())
+            self.out = {}
+        for sumo in handed_out:
+            self.retire(sumo, replace=False)
+        while True:
+            try:
+                self.retire(self.ready.get_nowait(), replace=False)
+            except Empty:
+                break
+
+
+# command line -> SumoPool, for this process
+_pools = {}
+
+
+def get_pool(cmd, size=2, max_uses=20):
+    """the pool for cmd, started the first time it's asked for"""
+    key = tuple(cmd)
+    if key not in _pools:
+        if not len(_pools):
+            atexit.register(close_pools)
+        _pools[key] = SumoPool(cmd, size, max_uses)
+    return _pools[key]
+
+
+def close_pools():
+    for pool in list(_pools.values()):
+        stats = pool.stats()
+        print('sumopool: {} sumos launched, {} reloaded, {} evaluations, {:.3f}s mean wait'.format(
+            stats['launched'], stats['recycled'], stats['acquired'], stats['mean_wait']))
+        pool.close()
+    _pools.clear()
@@ -0,0 +1,243 @@
+"""
+Step by step record of a run, for working out afterwards why a controller scored what it did,
+or for training on offline.
+
+A trace is a directory with a meta.json and one raw binary file per column, in two tables:
+
+    steps:      one row per simulated step
+        step:       the step
+        penalty:    what each intersection was penalised in the step (its penalties went down by it)
+        queue:      vehicles over each intersection's detectors
+        vehicles:   vehicles on the network
+
+        a run that went the distance ends with one more row, on the same step as the one before
+        it, for the penalties charged at the end to the vehicles still on the road. so penalty
+        adds up to the run's result, meta['penalties']. a run racing stopped early (see
+        racing.py) gets no such row: its result is filled in, and only the steps it ran are here
+
+    decisions:  one row per network activation
+        step:       the step it was made on
+        light:      index of the light into meta['intersections']
+        source:     what woke it, index into meta['sources']
+        inputs:     the inputs get_params_for gave the network, named in meta['features']
+        outputs:    the network's raw (change, duration) outputs
+        phase:      the phase it set
+        duration:   the phase duration it set, in steps
+
+Rows are kept in preallocated numpy buffers of chunk_size rows and appended to the column
+files a chunk at a time, so a step costs a few array assignments. Columns are fixed width and
+little endian, so load() maps the files straight into numpy arrays without reading or copying
+them, and a run that died part way can still be loaded up to its last full chunk.
+"""
+
+import os
+import json
+import itertools
+import numpy as np
+
+SOURCES = ['timeout', 'inductor', 'pedestrian']
+
+VERSION = 1
+
+
+class _Table(object):
+    """fixed width columns buffered in memory and appended to one file each"""
+
+    def __init__(self, directory, name, columns, chunk_size):
+        super(_Table, self).__init__()
+        self.directory = directory
+        self.name = name
+        # name -> (dtype, width), width 0 for a plain column
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.buffers = {}
+        self.files = {}
+        for column, (dtype, width) in columns.items():
+            shape = (chunk_size, width) if width else (chunk_size,)
+            self.buffers[column] = np.zeros(shape, dtype=np.dtype(dtype))
+            self.files[column] = open(column_path(directory, name, column), 'wb')
+        # rows in the buffers, and rows written out
+        self.size = 0
+        self.rows = 0
+
+    def append(self):
+        """index of a new row in the buffers, for the caller to fill in"""
+        if self.size == self.chunk_size:
+            self.flush()
+        self.size += 1
+        return self.size - 1
+
+    def flush(self):
+        for column, buffer in self.buffers.items():
+            self.files[column].write(buffer[:self.size].tobytes())
+        self.rows += self.size
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+
+def column_path(directory, table, column):
+    return os.path.join(directory, '{}.{}.bin'.format(table, column))
+
+
+def table_columns(intersections, features):
+    n = len(intersections)
+    return {
+        'steps': {'step': ('<i4', 0), 'penalty': ('<i4', n), 'queue': ('<i2', n), 'vehicles': ('<i4', 0)},
+        'decisions': {'step': ('<i4', 0), 'light': ('<i2', 0), 'source': ('<i1', 0), 'inputs': ('<f4', len(features)),
+                      'outputs': ('<f4', 2), 'phase': ('<i2', 0), 'duration': ('<f4', 0)},
+    }
+
+
+# run numbers handed out in this process
+_runs = itertools.count()
+
+
+def new_run_directory(directory, prefix=''):
+    """a directory under directory for the next run's trace, prefix keeping processes apart"""
+    while True:
+        path = os.path.join(directory, '{}run{:05d}'.format(prefix, next(_runs)))
+        if not os.path.exists(path):
+            os.makedirs(path)
+            return path
+
+
+class TraceRecorder(object):
+    def __init__(self, directory, intersections, features, chunk_size=4096, meta=None):
+        super(TraceRecorder, self).__init__()
+        self.directory = directory
+        self.intersections = list(intersections)
+        self.light_index = {}
+        for i, intersection in enumerate(self.intersections):
+            self.light_index[intersection] = i
+        self.source_index = {}
+        for i, source in enumerate(SOURCES):
+            self.source_index[source] = i
+        columns = table_columns(self.intersections, features)
+        self.steps = _Table(directory, 'steps', columns['steps'], chunk_size)
+        self.decisions = _Table(directory, 'decisions', columns['decisions'], chunk_size)
+        self.meta = {'version': VERSION, 'intersections': self.intersections, 'features': list(features),
+                     'sources': SOURCES, 'columns': columns}
+        if meta != None:
+            self.meta.update(meta)
+        # penalties at the end of the last step recorded, to take each step's from
+        self.last_penalties = np.zeros(len(self.intersections), dtype=np.int64)
+        self.write_meta()
+
+    def write_meta(self):
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    def step(self, step, penalties, queue, vehicles):
+        """one step. penalties is every intersection's running total, in intersections order"""
+        table = self.steps
+        i = table.append()
+        buffers = table.buffers
+        buffers['step'][i] = step
+        buffers['penalty'][i] = self.last_penalties - penalties
+        self.last_penalties[:] = penalties
+        buffers['queue'][i] = queue
+        buffers['vehicles'][i] = vehicles
+
+    def decision(self, step, light, source, inputs, outputs, phase, duration):
+        table = self.decisions
+        i = table.append()
+        buffers = table.buffers
+        buffers['step'][i] = step
+        buffers['light'][i] = self.light_index[light]
+        buffers['source'][i] = self.source_index.get(source, -1)
+        buffers['inputs'][i] = inputs
+        buffers['outputs'][i] = outputs
+        buffers['phase'][i] = phase
+        buffers['duration'][i] = duration
+
+    def finish(self, penalties):
+        """the row for what the end of the run charged, penalties being the final running totals"""
+        table = self.steps
+        buffers = table.buffers
+        if table.size == 0 and table.rows == 0:
+            return
+        # the same step, queue and vehicles as the last step, that's where the run ended. a
+        # flush leaves the buffers as they were, so a last step just written out is still there
+        last = table.size - 1 if table.size else table.chunk_size - 1
+        i = table.append()
+        buffers['step'][i] = buffers['step'][last]
+        buffers['penalty'][i] = self.last_penalties - penalties
+        self.last_penalties[:] = penalties
+        buffers['queue'][i] = buffers['queue'][last]
+        buffers['vehicles'][i] = buffers['vehicles'][last]
+        self.meta['finished'] = True
+
+    def close(self, penalties=None):
+        """writes out what's buffered, with the run's final penalties dict if there is one"""
+        self.steps.close()
+        self.decisions.close()
+        self.meta['rows'] = {'steps': self.steps.rows, 'decisions': self.decisions.rows}
+        if penalties != None:
+            self.meta['penalties'] = dict(penalties)
+        self.write_meta()
+
+
+class Trace(object):
+    """
+    a recorded run. steps and decisions are dicts of column name -> numpy array, mapped from
+    the files rather than read, so loading costs nothing until the data is touched
+    """
+
+    def __init__(self, directory):
+        super(Trace, self).__init__()
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.intersections = self.meta['intersections']
+        self.features = self.meta['features']
+        self.steps = self.load_table('steps')
+        self.decisions = self.load_table('decisions')
+
+    def load_table(self, table):
+        columns = {}
+        for column, (dtype, width) in self.meta['columns'][table].items():
+            path = column_path(self.directory, table, column)
+            dtype = np.dtype(dtype)
+            row_bytes = dtype.itemsize * max(width, 1)
+            # a run cut short can leave part of a row behind
+            rows = os.path.getsize(path) // row_bytes
+            shape = (rows, width) if width else (rows,)
+            if rows == 0:
+                columns[column] = np.zeros(shape, dtype=dtype)
+            else:
+                columns[column] = np.memmap(path, dtype=dtype, mode='r', shape=shape)
+        # columns of a table written up to different points are cut to the shortest
+        rows = min(len(values) for values in columns.values())
+        for column in columns:
+            columns[column] = columns[column][:rows]
+        return columns
+
+    def penalties(self):
+        """
+        (steps, intersections) running penalties, as the controller had them after each step. for
+        a run that finished, the last row is its result, end of run charges included
+        """
+        return -np.cumsum(self.steps['penalty'], axis=0, dtype=np.int64)
+
+    def decisions_for(self, intersection):
+        """the decisions column dict, cut down to one intersection's"""
+        mask = self.decisions['light'] == self.intersections.index(intersection)
+        return dict((column, values[mask]) for column, values in self.decisions.items())
+
+    def feature(self, name):
+        """one input column of every decision"""
+        return self.decisions['inputs'][:, self.features.index(name)]
+
+
+def load(directory):
+    return Trace(directory)
+
+
+def runs(directory):
+    """the trace directories under directory, in the order they were named"""
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if os.path.exists(os.path.join(directory, name, 'meta.json'))]
@@ -0,0 +1,244 @@
+"""
+NumPy version of neat.nn.FeedForwardNetwork.
+
+A genome is compiled into layers of weight matrices once, after which a network can be
+activated on a single input vector (same interface as FeedForwardNetwork.activate) or on
+a whole batch of inputs at once. StackedNetworks goes one step further and runs several
+compiled networks, e.g. the three intersections or a whole population, in one pass.
+
+The payoff is in batches: for one vector at a time through networks as small as ours,
+numpy's per-call overhead loses to neat's plain loop (see benchmarks/inference.py), which
+is why the controller's per-trigger get_duration still uses FeedForwardNetwork.
+"""
+
+import numpy as np
+from neat.graphs import feed_forward_layers
+from neat.six_util import itervalues
+
+
+# numpy equivalents of neat's built-in activation functions, clamped the same way
+def _sigmoid(z):
+    z = np.clip(5.0 * z, -60.0, 60.0)
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def _tanh(z):
+    return np.tanh(np.clip(2.5 * z, -60.0, 60.0))
+
+
+def _sin(z):
+    return np.sin(np.clip(5.0 * z, -60.0, 60.0))
+
+
+def _gauss(z):
+    z = np.clip(z, -3.4, 3.4)
+    return np.exp(-5.0 * z ** 2)
+
+
+def _softplus(z):
+    z = np.clip(5.0 * z, -60.0, 60.0)
+    return 0.2 * np.log(1 + np.exp(z))
+
+
+def _inv(z):
+    with np.errstate(divide='ignore', over='ignore'):
+        out = 1.0 / z
+    out[~np.isfinite(out)] = 0.0
+    return out
+
+
+ACTIVATIONS = {
+    'sigmoid': _sigmoid,
+    'tanh': _tanh,
+    'sin': _sin,
+    'gauss': _gauss,
+    'relu': lambda z: np.maximum(z, 0.0),
+    'softplus': _softplus,
+    'identity': lambda z: z,
+    'clamped': lambda z: np.clip(z, -1.0, 1.0),
+    'inv': _inv,
+    'log': lambda z: np.log(np.maximum(z, 1e-7)),
+    'exp': lambda z: np.exp(np.clip(z, -60.0, 60.0)),
+    'abs': np.abs,
+    'hat': lambda z: np.maximum(0.0, 1 - np.abs(z)),
+    'square': lambda z: z ** 2,
+    'cube': lambda z: z ** 3,
+}
+
+
+class Layer(object):
+    """
+    one feed forward layer: gathers the value slots it reads from (src), multiplies by a
+    dense (len(src), len(dst)) weight matrix, then applies bias, response and activation
+    to the slots it writes to (dst)
+    """
+
+    def __init__(self, src, dst, weights, bias, response, activations):
+        super(Layer, self).__init__()
+        self.src = np.asarray(src, dtype=np.intp)
+        self.dst = np.asarray(dst, dtype=np.intp)
+        self.weights = np.asarray(weights, dtype=np.float64).reshape(len(src), len(dst))
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.response = np.asarray(response, dtype=np.float64)
+        self.activation_names = list(activations)
+        # nodes grouped by activation function, so each function runs once per layer
+        self.activations = []
+        for name in sorted(set(activations)):
+            columns = np.array([i for i, a in enumerate(activations) if a == name], dtype=np.intp)
+            self.activations.append((ACTIVATIONS[name], columns, len(columns) == len(activations)))
+
+    def forward(self, values):
+        """values is either one vector of slots, or a (batch, slots) array"""
+        z = self.bias + self.response * values[..., self.src].dot(self.weights)
+        for function, columns, whole_layer in self.activations:
+            if whole_layer:
+                z = function(z)
+            else:
+                z[..., columns] = function(z[..., columns])
+        values[..., self.dst] = z
+
+
+class VectorisedNetwork(object):
+    """
+    drop-in replacement for neat.nn.FeedForwardNetwork.
+
+    values live in one array of slots: the inputs first, then every evaluated node, then a
+    final slot that always holds 0.0 for outputs that nothing connects to (as in neat,
+    where those outputs never leave their initial 0.0)
+    """
+
+    def __init__(self, num_inputs, num_slots, output_slots, layers):
+        super(VectorisedNetwork, self).__init__()
+        self.num_inputs = num_inputs
+        self.num_slots = num_slots
+        self.output_slots = np.asarray(output_slots, dtype=np.intp)
+        self.layers = layers
+        self.values = np.zeros(num_slots)
+
+    def activate(self, inputs):
+        if self.num_inputs != len(inputs):
+            raise RuntimeError("Expected {0:n} inputs, got {1:n}".format(self.num_inputs, len(inputs)))
+        # a single vector skips the batch bookkeeping and reuses one buffer
+        values = self.values
+        values[:self.num_inputs] = inputs
+        for layer in self.layers:
+            layer.forward(values)
+        return values[self.output_slots].tolist()
+
+    def activate_batch(self, inputs):
+        """inputs has shape (batch, num_inputs), returns an array of shape (batch, num_outputs)"""
+        inputs = np.asarray(inputs, dtype=np.float64)
+        values = np.zeros((inputs.shape[0], self.num_slots))
+        values[:, :self.num_inputs] = inputs
+        for layer in self.layers:
+            layer.forward(values)
+        return values[:, self.output_slots]
+
+    @staticmethod
+    def create(genome, config):
+        """ Receives a genome and returns its compiled phenotype. """
+        genome_config = config.genome_config
+
+        # Gather expressed connections.
+        connections = [cg.key for cg in itervalues(genome.connections) if cg.enabled]
+        layers = feed_forward_layers(genome_config.input_keys, genome_config.output_keys, connections)
+
+        slots = {}
+        for key in genome_config.input_keys:
+            slots[key] = len(slots)
+        for layer in layers:
+            # sorted, so the same genome always compiles to the same slots
+            for node in sorted(layer):
+                slots[node] = len(slots)
+        zero_slot = len(slots)
+
+        compiled = []
+        for layer in layers:
+            nodes = sorted(layer)
+            src = sorted(set(slots[i] for (i, o) in connections if o in layer))
+            weights = np.zeros((len(src), len(nodes)))
+            bias = []
+            response = []
+            activations = []
+            for column, node in enumerate(nodes):
+                ng = genome.nodes[node]
+                if ng.aggregation != 'sum':
+                    raise RuntimeError('only sum aggregation can be vectorised, node {} uses {}'.format(node, ng.aggregation))
+                if ng.activation not in ACTIVATIONS:
+                    raise RuntimeError('no vectorised version of the {} activation'.format(ng.activation))
+                bias.append(ng.bias)
+                response.append(ng.response)
+                activations.append(ng.activation)
+                for conn_key in connections:
+                    inode, onode = conn_key
+                    if onode == node:
+                        weights[src.index(slots[inode]), column] += genome.connections[conn_key].weight
+            compiled.append(Layer(src, [slots[n] for n in nodes], weights, bias, response, activations))
+
+        output_slots = [slots.get(key, zero_slot) for key in genome_config.output_keys]
+        return VectorisedNetwork(len(genome_config.input_keys), zero_slot + 1, output_slots, compiled)
+
+
+class StackedNetworks(object):
+    """
+    several compiled networks run side by side in a single forward pass.
+
+    layer i of the stack holds layer i of every network, with the weights laid out block
+    diagonally, so each network only ever reads its own slots. networks shallower than the
+    deepest one just sit out the extra layers
+    """
+
+    def __init__(self, networks):
+        super(StackedNetworks, self).__init__()
+        self.networks = list(networks)
+        self.num_inputs = self.networks[0].num_inputs
+
+        # every network keeps its own range of slots, its inputs at the start of the range
+        offsets = []
+        num_slots = 0
+        for network in self.networks:
+            if network.num_inputs != self.num_inputs:
+                raise RuntimeError('stacked networks need the same number of inputs')
+            offsets.append(num_slots)
+            num_slots += network.num_slots
+        self.num_slots = num_slots
+        self.input_slots = np.concatenate([offset + np.arange(self.num_inputs) for offset in offsets])
+        self.output_slots = np.stack([offset + network.output_slots for offset, network in zip(offsets, self.networks)])
+
+        self.layers = []
+        depth = max(len(network.layers) for network in self.networks)
+        for i in range(depth):
+            parts = [(offset, network.layers[i]) for offset, network in zip(offsets, self.networks) if i < len(network.layers)]
+            src = np.concatenate([offset + layer.src for offset, layer in parts])
+            dst = np.concatenate([offset + layer.dst for offset, layer in parts])
+            weights = np.zeros((len(src), len(dst)))
+            row = 0
+            column = 0
+            activations = []
+            for offset, layer in parts:
+                rows, columns = layer.weights.shape
+                weights[row:row + rows, column:column + columns] = layer.weights
+                row += rows
+                column += columns
+                activations.extend(layer.activation_names)
+            bias = np.concatenate([layer.bias for offset, layer in parts])
+            response = np.concatenate([layer.response for offset, layer in parts])
+            self.layers.append(Layer(src, dst, weights, bias, response, activations))
+
+    def activate_batch(self, inputs):
+        """
+        inputs has shape (batch, num_networks, num_inputs), or (batch, num_inputs) to feed the
+        same inputs to every network. returns an array of shape (batch, num_networks, num_outputs)
+        """
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if inputs.ndim == 2:
+            inputs = np.repeat(inputs[:, np.newaxis, :], len(self.networks), axis=1)
+        values = np.zeros((inputs.shape[0], self.num_slots))
+        values[:, self.input_slots] = inputs.reshape(inputs.shape[0], -1)
+        for layer in self.layers:
+            layer.forward(values)
+        return values[:, self.output_slots]
+
+    def activate(self, inputs):
+        """one input vector per network, returns one list of outputs per network"""
+        return self.activate_batch(np.asarray(inputs, dtype=np.float64)[np.newaxis])[0].tolist()
@@ -0,0 +1,120 @@
+"""Per-vehicle bookkeeping for SimulationController, kept in numpy arrays rather than dicts keyed by id."""
+
+import numpy as np
+
+# owner of a row nobody is using
+FREE = -1
+# last_intersection_id of a vehicle that hasn't passed a detector yet
+NO_DETECTOR = -1
+
+
+def vehicle_number(vehicle):
+    """the N of a 'vehicle_N' id"""
+    return int(vehicle[vehicle.rindex('_') + 1:])
+
+
+class VehicleTable(object):
+    """
+    what the controller tracks for each vehicle on the road, one row per vehicle:
+
+        is_stopped:             1 if the vehicle was last seen stopped
+        number_of_stops:        stops the vehicle has made
+        stop_time:              step of the vehicle's last stop
+        last_intersection_step: step the vehicle was last scored at
+        last_intersection_id:   detector it was last scored at, as an index into detectors
+
+    vehicle_N lives in row N % capacity. ids are handed out in order and vehicles only stay
+    for a while, so the vehicles on the road at any one time rarely land on the same row.
+    when they do the table doubles in size, which keeps them apart from then on.
+    rows are given back when vehicles arrive, so the size follows the vehicles on the road
+    rather than every vehicle the run has ever inserted
+    """
+
+    COLUMNS = ['owner', 'is_stopped', 'number_of_stops', 'stop_time', 'last_intersection_step', 'last_intersection_id']
+
+    def __init__(self, detectors, capacity=1024):
+        super(VehicleTable, self).__init__()
+        # detector ids interned to small ints, so comparing them is cheap
+        self.detectors = list(detectors)
+        self.detector_index = {}
+        for index, detector in enumerate(self.detectors):
+            self.detector_index[detector] = index
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.capacity = capacity
+        # number of the vehicle holding each row
+        self.owner = np.full(capacity, FREE, dtype=np.int64)
+        self.is_stopped = np.zeros(capacity, dtype=np.int8)
+        self.number_of_stops = np.zeros(capacity, dtype=np.int64)
+        self.stop_time = np.zeros(capacity, dtype=np.int64)
+        self.last_intersection_step = np.zeros(capacity, dtype=np.int64)
+        self.last_intersection_id = np.full(capacity, NO_DETECTOR, dtype=np.int32)
+
+    def grow(self):
+        old = {}
+        for name in self.COLUMNS:
+            old[name] = getattr(self, name)
+        live = old['owner'] != FREE
+        self.allocate(self.capacity * 2)
+        # two numbers that differ modulo capacity still differ modulo twice that,
+        # so the vehicles already in the table never clash after growing
+        rows = old['owner'][live] % self.capacity
+        for name in self.COLUMNS:
+            getattr(self, name)[rows] = old[name][live]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.owner != FREE))
+
+    def rows_for(self, numbers):
+        """rows of the given vehicle numbers, adding the ones not in the table yet. returns (rows, new)"""
+        numbers = np.asarray(numbers, dtype=np.int64)
+        while True:
+            rows = numbers % self.capacity
+            owners = self.owner[rows]
+            new = owners != numbers
+            # a row held by some other vehicle, or wanted by two new ones at once
+            clash = np.any(new & (owners != FREE)) or len(np.unique(rows[new])) != np.count_nonzero(new)
+            if not clash:
+                return rows, new
+            self.grow()
+
+    def row(self, vehicle):
+        number = vehicle_number(vehicle)
+        row = number % self.capacity
+        if self.owner[row] != number:
+            raise KeyError(vehicle)
+        return row
+
+    def update(self, vehicles, step):
+        """records one step of vehicles, a dict of vehicle id -> True/False if the vehicle is stopped"""
+        numbers = np.fromiter((vehicle_number(vehicle) for vehicle in vehicles), dtype=np.int64, count=len(vehicles))
+        stopped = np.fromiter(vehicles.values(), dtype=bool, count=len(vehicles))
+        rows, new = self.rows_for(numbers)
+
+        # initialise vehicles seen for the first time
+        added = rows[new]
+        self.owner[added] = numbers[new]
+        self.is_stopped[added] = 0
+        self.number_of_stops[added] = 0
+        self.stop_time[added] = 0
+        self.last_intersection_step[added] = step
+        self.last_intersection_id[added] = NO_DETECTOR
+
+        # record stop
+        was_stopped = self.is_stopped[rows] != 0
+        stops = rows[stopped & was_stopped]
+        self.is_stopped[stops] = 1
+        self.number_of_stops[stops] += 1
+        self.stop_time[stops] = step
+
+        # reset stop status
+        self.is_stopped[rows[~stopped & was_stopped]] = 0
+
+    def remove(self, vehicles):
+        """gives back the rows of vehicles that have left the network"""
+        for vehicle in vehicles:
+            number = vehicle_number(vehicle)
+            row = number % self.capacity
+            if self.owner[row] == number:
+                self.owner[row] = FREE